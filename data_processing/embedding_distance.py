@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+'''
+Distance statistics of (contextual) word embeddings, computed in chunks with torch.cdist,
+e.g. how far the BERT embeddings of one word spread, and how far the centers of two words are.
+Embeddings are read from the memory-mapped X_2d.npy (N x max_len x 768) written by en_bert_feature_extract.py.
+'''
+import json
+import logging
+import numpy as np
+import torch
+logging.basicConfig(level=logging.INFO)#,format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+def _to_tensor(embeddings, device):
+    return torch.from_numpy(np.asarray(embeddings, dtype=np.float32)).to(device)
+
+def mean_pairwise_distance(embeddings, chunk_size=4096, device='cpu'):
+    '''
+    average euclidean distance over all pairs of different rows, only chunk_size x n distances are held at once
+    @params:
+        1. embeddings: n x d (numpy array, memmap or list of vectors)
+    @return:
+        1. sum_{i != j} ||e_i - e_j|| / (n * (n - 1)), nan if n < 2
+    '''
+    embeddings = np.asarray(embeddings)
+    n = len(embeddings)
+    if n < 2:
+        return float('nan')
+    all_emb = _to_tensor(embeddings, device)
+    total = 0.0
+    for start in range(0, n, chunk_size):
+        chunk = all_emb[start: start + chunk_size]
+        dis = torch.cdist(chunk, all_emb)
+        # the diagonal is not exactly zero with the Gram-matrix trick of cdist
+        rows = torch.arange(chunk.size(0), device=dis.device)
+        dis[rows, rows + start] = 0
+        total += dis.double().sum().item()
+    return total / (n * (n - 1))
+
+def centroid(embeddings, chunk_size=4096):
+    '''mean vector of n x d embeddings, accumulated chunk by chunk'''
+    n = len(embeddings)
+    total = np.zeros(np.shape(embeddings)[1], dtype=np.float64)
+    for start in range(0, n, chunk_size):
+        total += np.asarray(embeddings[start: start + chunk_size], dtype=np.float64).sum(axis=0)
+    return total / n
+
+def bert_token_rows(file, max_len=76):
+    '''
+    token -> rows of X_2d.reshape(-1, 768), i.e. sentence_idx * max_len + position, consistent with
+    en_bert_feature_extract.bert_line_to_emb ([CLS]/[SEP] dropped, truncated to max_len)
+    '''
+    token_rows = {}
+    sen_idx = 0
+    with open(file, 'rb') as fd:
+        for line in fd:
+            if not line.strip():
+                continue
+            tokens = [f['token'] for f in json_loads(line)['features'] if f['token'] not in ('[CLS]', '[SEP]')]
+            for position, t in enumerate(tokens[:max_len]):
+                token_rows.setdefault(t, []).append(sen_idx * max_len + position)
+            sen_idx += 1
+    return {t: np.array(rows, dtype=np.int64) for t, rows in token_rows.items()}
+
+def word_distance_stats(X_flat, token_rows, words=None, chunk_size=4096, device='cpu'):
+    '''
+    @params:
+        1. X_flat: (N * max_len) x d token embeddings, e.g. np.load('X_2d.npy', mmap_mode='r').reshape(-1, 768)
+        2. token_rows: returned by bert_token_rows
+        3. words: None for all tokens
+    @return:
+        1. word -> mean pairwise distance of its embeddings
+        2. word -> center of its embeddings
+    '''
+    if words is None:
+        words = list(token_rows.keys())
+    distances, centers = {}, {}
+    for w in words:
+        embeddings = X_flat[token_rows[w]]  # rows are sorted, sequential reads on the memmap
+        distances[w] = mean_pairwise_distance(embeddings, chunk_size, device)
+        centers[w] = centroid(embeddings, chunk_size)
+    return distances, centers
@@ -4,9 +4,18 @@ import numpy as np
 import os
 import json
 from collections import Counter
+from multiprocessing import Pool
 from tqdm import tqdm
 import logging
 
+import embedding_distance
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 logging.basicConfig(level=logging.INFO)#,format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -14,20 +23,12 @@ def generate_H(en_ba_nums):
     '''
 
     :param en_ba_nums: [[num_of_vertex_within_edge1, num_of_vertex_within_edge2, ...], [num_of_other_vertex_within_edge1, num_of_other_vertex_within_edge2, ...]]
-    :return: incidence matrix
+    :return: incidence matrix in index form [node_idx, hyedge_idx] (2 x N), vertices are numbered En first, then Ba
     '''
-    col = en_ba_nums.shape[1]
-    en_matrix = []
-    ba_matrix = []
-    for c in range(col):
-        en_num = en_ba_nums[0, c]
-        ba_num = en_ba_nums[1, c]
-        en_mx = [[1 if i == c else 0 for i in range(col)]] * en_num
-        ba_mx = [[1 if i == c else 0 for i in range(col)]] * ba_num
-        en_matrix += en_mx
-        ba_matrix += ba_mx
-    en_matrix += ba_matrix
-    return np.array(en_matrix)
+    en_ba_nums = np.asarray(en_ba_nums, dtype=np.int64)
+    hyedge_idx = np.repeat(np.tile(np.arange(en_ba_nums.shape[1]), en_ba_nums.shape[0]), en_ba_nums.reshape(-1))
+    node_idx = np.arange(len(hyedge_idx))
+    return np.stack([node_idx, hyedge_idx])
 
 def generate_target(en_ba_dim):
     en_target = []
@@ -74,7 +75,7 @@ def extract_en_ba_sens_of_same_intent():
             fd.write('\n'.join(ba_domain_sens))
         # np.save(os.path.join(output_dir, d, 'en_ba_sen_nums_metadata.npy'), np.array([en_nums, ba_nums]))
 
-def bert_sen_feature_extract(file, sens_len, word_emb_d=768, max_len=76):
+def bert_sen_feature_extract(file, sens_len, word_emb_d=768, max_len=76, dtype=np.float32):
     domain_sens_emb = []
     with open(file, 'r', encoding='utf8') as fd:
         pbar = tqdm(total=sens_len)
@@ -92,14 +93,82 @@ def bert_sen_feature_extract(file, sens_len, word_emb_d=768, max_len=76):
                 sen_emb = np.row_stack((sen_emb, np.zeros((max_len - len(sen_emb), word_emb_d))))
             else:
                 sen_emb = sen_emb[:max_len]
-            domain_sens_emb.append(sen_emb)
+            domain_sens_emb.append(sen_emb.astype(dtype))
             pbar.update(1)
         pbar.close()
-    return np.array(domain_sens_emb)
+    return np.array(domain_sens_emb, dtype=dtype)
+
+def bert_line_offsets(file):
+    '''byte offsets of the non-empty lines of a jsonl file, only newlines are searched and no JSON is parsed'''
+    offsets = []
+    offset = 0
+    with open(file, 'rb') as fd:
+        for line in fd:
+            if line.strip():
+                offsets.append(offset)
+            offset += len(line)
+    return offsets
+
+def bert_line_to_emb(line, word_emb_d=768, max_len=76, dtype=np.float16):
+    '''one line of the BERT jsonl -> max_len x word_emb_d array, zero-padded, [CLS] and [SEP] are dropped'''
+    sen_bert = json_loads(line)
+    values = [f['layers'][0]['values'] for f in sen_bert['features'] if f['token'] not in ('[CLS]', '[SEP]')][:max_len]
+    sen_emb = np.zeros((max_len, word_emb_d), dtype=dtype)
+    if values:
+        sen_emb[:len(values)] = np.asarray(values, dtype=np.float32)
+    return sen_emb
+
+def _bert_shard_extract(args):
+    file, offset, out_path, row_start, row_end, word_emb_d, max_len = args
+    out = np.load(out_path, mmap_mode='r+')
+    with open(file, 'rb') as fd:
+        fd.seek(offset)
+        row = row_start
+        while row < row_end:
+            line = fd.readline()
+            if not line:
+                raise ValueError('%s ends after %d sentences, but %d are expected (was it changed after its lines were indexed?)' % (file, row - row_start, row_end - row_start))
+            if not line.strip():
+                continue
+            out[row] = bert_line_to_emb(line, word_emb_d, max_len, out.dtype)
+            row += 1
+    out.flush()
+    return row_end - row_start
+
+def bert_sen_feature_extract_to_memmap(file, out_path, sens_len=None, word_emb_d=768, max_len=76, dtype=np.float16, out_row=0, num_workers=1):
+    '''
+    streaming version of bert_sen_feature_extract: each sentence is parsed and written into a memory-mapped
+    (N x max_len x word_emb_d) .npy, so memory does not grow with the number of sentences.
+    @params:
+        1. out_path: created if it does not exist, otherwise rows [out_row, out_row + sens_len) of the existing .npy are filled
+        2. num_workers: contiguous shards of lines are parsed by a process pool
+    @return:
+        1. number of sentences
+    '''
+    offsets = bert_line_offsets(file)
+    if sens_len is None:
+        sens_len = len(offsets)
+    assert len(offsets) == sens_len, '%s has %d sentences, but %d are expected' % (file, len(offsets), sens_len)
+    if not os.path.exists(out_path):
+        out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.dtype(dtype), shape=(out_row + sens_len, max_len, word_emb_d))
+        del out
+
+    shard_size = (sens_len + num_workers - 1) // num_workers if sens_len else 0
+    shards = [(file, offsets[start], out_path, out_row + start, out_row + min(start + shard_size, sens_len), word_emb_d, max_len)
+              for start in range(0, sens_len, max(shard_size, 1))]
+    if num_workers > 1:
+        with Pool(num_workers) as pool:
+            done = sum(pool.map(_bert_shard_extract, shards))
+    else:
+        done = sum(map(_bert_shard_extract, shards))
+    logger.info('%d sentences of %s are written into %s' % (done, file, out_path))
+    return done
 
 def main():
     domain_list = ['hotel'] #, 'attraction', 'taxi', 'restaurant']
     data_dir = './'
+    x_dtype = np.float16 # or np.float32
+    num_workers = 4 # processes to parse the BERT jsonl
     # data_dir = '../../multiwoz_bahasawoz_v2/HG_data'
     for d in domain_list:
         print('domain:', d)
@@ -108,42 +177,42 @@ def main():
         en_ba_nums = np.load(os.path.join(data_dir, d, 'en_ba_sen_nums_metadata.npy'))
         H = generate_H(en_ba_nums)
         print('H.shape:', H.shape)
-        np.save(os.path.join(data_dir, d, 'H.npy'), H)
+        np.save(os.path.join(data_dir, d, 'H_idx.npy'), H)
 
         en_n, ba_n = np.sum(en_ba_nums, axis=1)
 
         print('generating X ...')
         en_file_path = os.path.join(data_dir, d, 'en_sentences_bert_embedding.jsonl')
         # en_file_path = os.path.join(data_dir, d, 'small.jsonl')
-        en_domain_sen_emb = bert_sen_feature_extract(en_file_path, en_n)
         ba_sentences = open(os.path.join(data_dir, d, 'ba_sentences.txt'), 'r', encoding='utf8').read().strip().split('\n')
         # ba_sentences = open(os.path.join(data_dir, d, 'small_ba.txt'), 'r', encoding='utf8').read().strip().split('\n')
-        ba_domain_sen_random_emb = random_word2vec(ba_sentences, ba_n)
-        # print(np.array(en_domain_sen_emb).shape)
-
-        X_2d = np.row_stack((en_domain_sen_emb, ba_domain_sen_random_emb))
-        np.save(os.path.join(data_dir, d, 'X_2d.npy'), X_2d)
+        ba_ids, ba_table = random_word2vec_ids(ba_sentences, dtype=x_dtype)
+        assert len(ba_ids) == ba_n
+
+        # X is written into a float16 memmap (float64 from np.row_stack needs 4x the disk and memory),
+        # see data_processing/reduce_HG_features.py to reduce the dimension of X_1d
+        X_2d_path = os.path.join(data_dir, d, 'X_2d.npy')
+        X_2d = np.lib.format.open_memmap(X_2d_path, mode='w+', dtype=x_dtype,
+                                         shape=(en_n + ba_n,) + ba_ids.shape[1:] + ba_table.shape[1:])
+        for start in range(0, ba_n, 1024):
+            X_2d[en_n + start: en_n + start + 1024] = ba_table[ba_ids[start: start + 1024]]
+        X_2d.flush()
+        del X_2d
+        # English BERT features are streamed into the first en_n rows
+        bert_sen_feature_extract_to_memmap(en_file_path, X_2d_path, en_n, out_row=0, num_workers=num_workers)
+        X_2d = np.load(X_2d_path, mmap_mode='r')
         print('X_2d.shape:', X_2d.shape)
+        # X_1d is not stored: X_2d.reshape(N, -1) is a view of the same memmap, the readers reshape it on load
         X_1d = X_2d.reshape((X_2d.shape[0], -1))
-        np.save(os.path.join(data_dir, d, 'X_1d.npy'), X_1d)
         print('X_1d.shape:', X_1d.shape)
 
         print('en and ba sentences length:', np.sum(en_ba_nums))
 
 def overall_distance(word_embeddings):
-    word_embeddings = np.array(word_embeddings)
-    ds = []
-    for wemb in word_embeddings:
-        d = np.sum(np.sqrt(np.sum(np.power(word_embeddings - wemb, 2), axis=1)))/(len(word_embeddings)-1)
-        # print(d)
-        ds.append(d)
-    # print(ds)
-    return np.average(ds)
+    return embedding_distance.mean_pairwise_distance(word_embeddings)
 
 def get_center(word_embeddings):
-    word_embeddings = np.array(word_embeddings)
-    c = np.average(word_embeddings, axis=0)
-    return c
+    return embedding_distance.centroid(np.asarray(word_embeddings))
 
 def main2_bert_word_embedding_distance():
     domain_list = ['taxi']  # , 'attraction', 'taxi', 'restaurant']
@@ -156,66 +225,50 @@ def main2_bert_word_embedding_distance():
         # print('generating H ...')
         # H = generate_H(en_ba_nums)
         # print('H.shape:', H.shape)
-        # np.save(os.path.join(data_dir, d, 'H.npy'), H)
+        # np.save(os.path.join(data_dir, d, 'H_idx.npy'), H)
 
         en_n, ba_n = np.sum(en_ba_nums, axis=1)
 
-        # print('generating X ...')
+        # English BERT features are the first en_n sentences of X_2d (see main), only the rows of the listed words are read
         en_file_path = os.path.join(data_dir, d, 'en_sentences_bert_embedding.jsonl')
         # en_file_path = os.path.join(data_dir, d, 'small.jsonl')
-        word_embeddings = {}
-        with open(en_file_path, 'r', encoding='utf8') as fd:
-            # pbar = tqdm(total=range(np.sum(en_n)))
-            for line in fd:
-                sen_bert = json.loads(line)
-                sen_emb = []
-
-                for f in sen_bert['features']:
-                    t, word_emb = f['token'], f['layers'][0]['values']
-                    if t in ['[CLS]', '[SEP]']:
-                        continue
-                    if t not in word_embeddings:
-                        word_embeddings[t] = []
-                    word_embeddings[t].append(word_emb)
-                # pbar.update(1)
-            # pbar.close()
+        X_2d = np.load(os.path.join(data_dir, d, 'X_2d.npy'), mmap_mode='r')
+        token_rows = embedding_distance.bert_token_rows(en_file_path, max_len=X_2d.shape[1])
+        X_flat = X_2d.reshape(-1, X_2d.shape[2])
         word_list = ['pick', 'take']
+        distances, centers = embedding_distance.word_distance_stats(X_flat, token_rows, word_list)
         for w in word_list:
-            print('word: {}, overall distance: {}'.format(w, overall_distance(word_embeddings[w])))
-            # print('word: {}, overall distance: {}'.format(w, get_center(word_embeddings[w]).shape))
-        print(overall_distance([get_center(word_embeddings[word_list[0]]), get_center(word_embeddings[word_list[1]])]))
-
-
-def random_word2vec(sentences, sens_len, word_emb_d=768, max_len=76):
-    word_bank = Counter()
-    # sentences = [s.strip() for s in sentences]
-    pbar = tqdm(total=sens_len)
-    for s in sentences:
-        pbar.update(1)
-        s = s.strip()
-        word_bank.update([t.lower() for t in s.split()])
-    pbar.close()
+            print('word: {}, overall distance: {}'.format(w, distances[w]))
+            # print('word: {}, overall distance: {}'.format(w, centers[w].shape))
+        print(overall_distance([centers[word_list[0]], centers[word_list[1]]]))
+
+
+def random_word2vec_ids(sentences, word_emb_d=768, max_len=76, dtype=np.float32):
+    '''
+    encode sentences into a padded id matrix and draw a random embedding for each (lowercased) word
+    @return:
+        1. ids: N x max_len int matrix, padding points to the last (all-zero) row of the table
+        2. table: (voc_size + 1) x word_emb_d, table[ids] is the N x max_len x word_emb_d sentence embedding
+    '''
+    sentences = [s.strip().split() for s in sentences]
+    word_bank = Counter(t.lower() for tokens in sentences for t in tokens)
     word2idx = {w_f[0]: i for i, w_f in enumerate(word_bank.most_common())}
-    idx2word = {i: w_f[0] for i, w_f in enumerate(word_bank.most_common())}
     voc_size = len(word2idx)
     voc_embedding = np.random.uniform(-1, 1, (voc_size, word_emb_d))
     assert (len(voc_embedding) == len(word2idx))
     print('vocabulary size:', len(word2idx))
-    sens_emb = []
-    pbar = tqdm(total=sens_len)
-    for s in sentences:
-        pbar.update(1)
-        tokens = s.strip().split()
-        sen_emb = np.array([voc_embedding[word2idx[t.lower()]] for t in tokens])
-        if len(tokens) < max_len:
-            sen_emb = np.row_stack((sen_emb, np.zeros((max_len - len(tokens), word_emb_d))))
-        else:
-            sen_emb = sen_emb[:max_len]
-        # print(s)
-        # print(sen_emb)
-        sens_emb.append(sen_emb)
-    pbar.close()
-    return np.array(sens_emb)
+    table = np.vstack((voc_embedding, np.zeros((1, word_emb_d)))).astype(dtype)
+
+    ids = np.full((len(sentences), max_len), voc_size, dtype=np.int64)
+    lengths = np.array([min(len(tokens), max_len) for tokens in sentences], dtype=np.int64)
+    flat_ids = np.fromiter((word2idx[t.lower()] for tokens in sentences for t in tokens[:max_len]), dtype=np.int64, count=int(lengths.sum()))
+    ids[np.arange(max_len) < lengths[:, None]] = flat_ids
+    return ids, table
+
+def random_word2vec(sentences, sens_len, word_emb_d=768, max_len=76, dtype=np.float32):
+    ids, table = random_word2vec_ids(sentences, word_emb_d, max_len, dtype)
+    assert len(ids) == sens_len
+    return table[ids]
 
 def test():
     nums = np.array([[5,2,3], [4,4,2]])
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-import os
+import os, sys
+import io
 import json
 import re
 import logging
@@ -7,6 +8,48 @@ import numpy as np
 logging.basicConfig(level=logging.INFO)#,format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(install_path)
+
+import utils.read_wordEmb as read_wordEmb
+
+def average_word_embeddings(sen2embs, sentences, chunk_size=100000):
+    '''
+    average the embeddings of all occurrences of each word
+    @params:
+        1. sen2embs: N x max_len x dim (e.g. memmap), the i-th word of the n-th sentence is sen2embs[n, i]
+        2. sentences: N tokenized sentences, words beyond max_len are ignored
+    @return:
+        1. words, in order of first occurrence
+        2. embedding: len(words) x dim, float32
+    '''
+    sen_num, max_len, word_dim = sen2embs.shape
+    word_to_idx = {}
+    word_ids, rows = [], []
+    for line_num, words in enumerate(sentences):
+        for i, w in enumerate(words[:max_len]):
+            word_ids.append(word_to_idx.setdefault(w, len(word_to_idx)))
+            rows.append(line_num * max_len + i)
+    word_ids = np.array(word_ids, dtype=np.int64)
+    rows = np.array(rows, dtype=np.int64)
+
+    X_flat = sen2embs.reshape(sen_num * max_len, word_dim)
+    sums = np.zeros((len(word_to_idx), word_dim), dtype=np.float64)
+    for start in range(0, len(rows), chunk_size):
+        np.add.at(sums, word_ids[start: start + chunk_size], X_flat[rows[start: start + chunk_size]])
+    counts = np.bincount(word_ids, minlength=len(word_to_idx))
+    embedding = (sums / counts[:, None]).astype(np.float32)
+    return list(word_to_idx.keys()), embedding
+
+def write_word2vec_inText(words, embedding, file_path, chunk_size=10000):
+    with open(file_path, 'w', encoding='utf8') as f:
+        f.write(str(len(words)) + ' ' + str(embedding.shape[1]) + '\n')
+        for start in range(0, len(words), chunk_size):
+            buf = io.StringIO()
+            np.savetxt(buf, embedding[start: start + chunk_size], fmt='%.9g')
+            lines = buf.getvalue().splitlines()
+            f.write(''.join(w + ' ' + emb_str + '\n' for w, emb_str in zip(words[start: start + chunk_size], lines)))
+
 def format_data():
     # bahasa
     # dir_list = ['hotel', 'attraction', 'taxi', 'restaurant']
@@ -22,29 +65,15 @@ def format_data():
 
     for d in dir_list:
 
-        sen2embs = np.load(os.path.join(data_dir, d, HG_emb_file))
+        sen2embs = np.load(os.path.join(data_dir, d, HG_emb_file), mmap_mode='r')
         sen2embs = sen2embs.reshape(sen2embs.shape[0], -1, 768)
-        word_embeddings = {}
         with open(os.path.join(data_dir, d, sen_file), 'r', encoding='utf8') as f:
-            for line_num, line in enumerate(f):
-                line = line.strip()
-                words = line.split()
-                for i, w in enumerate(words):
-                    if w not in word_embeddings:
-                        word_embeddings[w] = []
-                    w_emb = sen2embs[line_num, i]
-                    word_embeddings[w].append(w_emb)
-
-            for w, embs in word_embeddings.items():
-                word_emb = np.average(np.array(embs), axis=0).tolist()
-                word_embeddings[w] = word_emb
-        voc_size, word_dim = len(word_embeddings), 768
-        with open(os.path.join(data_dir, d, 'HG_word_embedding.txt'), 'w', encoding='utf8') as f:
-            f.write(str(voc_size) + ' ' + str(word_dim) + '\n')
-            for w, emb in word_embeddings.items():
-                emb_str = ' '.join([ str(float(e)) for e in emb])
-                f.write(w + ' ' + emb_str + '\n')
+            sentences = [line.strip().split() for line in f]
+        words, embedding = average_word_embeddings(sen2embs, sentences)
+        # HG_word_embedding.npy + HG_word_embedding.vocab can be passed to --read_input_word2vec directly
+        read_wordEmb.save_word2vec_inBin(words, embedding, os.path.join(data_dir, d, 'HG_word_embedding.npy'))
+        write_word2vec_inText(words, embedding, os.path.join(data_dir, d, 'HG_word_embedding.txt'))
+        logger.info('%s: %d words x %d dims' % (d, len(words), embedding.shape[1]))
                 
 if __name__=='__main__':
     format_data()
-
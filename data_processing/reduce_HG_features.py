@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''
+Reduce the hypergraph node features X_1d (X_2d.npy, N x 76 x 768, flattened to N x 76*768) to a low dimension before the first HyConv.
+The input is read in chunks from a memmap and the output is written to a float16/float32 memmap,
+e.g. X_2d.npy -> X_2d_rp256.npy, which is passed to scripts/train_HGTransEnNet.py (x_in_file).
+'''
+import os
+import argparse
+import logging
+import numpy as np
+logging.basicConfig(level=logging.INFO)#,format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def random_projection_matrix(in_dim, out_dim, seed=0):
+    '''Gaussian random projection (Johnson-Lindenstrauss), scaled to preserve distances in expectation'''
+    rng = np.random.RandomState(seed)
+    return (rng.standard_normal((in_dim, out_dim)) / np.sqrt(out_dim)).astype(np.float32)
+
+def pca_projection_matrix(X, out_dim, sample_num=1000, seed=0):
+    '''
+    PCA fitted on a random sample of rows, so that only sample_num x in_dim floats are held in memory.
+    @return:
+        1. mean: in_dim
+        2. components: in_dim x out_dim
+    '''
+    rng = np.random.RandomState(seed)
+    sample_num = min(sample_num, X.shape[0])
+    rows = np.sort(rng.choice(X.shape[0], sample_num, replace=False))
+    sample = np.asarray(X[rows], dtype=np.float32)
+    mean = sample.mean(axis=0)
+    _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    assert out_dim <= vt.shape[0], 'PCA dimension %d is larger than the number of sampled rows %d' % (out_dim, vt.shape[0])
+    return mean, vt[:out_dim].T
+
+def project_features(in_path, out_path, out_dim, method='random', dtype='float16', chunk_size=1024, seed=0):
+    '''
+    @params:
+        1. in_path: N x D (or N x L x D, flattened) features in .npy
+        2. method: random | pca
+        3. dtype: float16 | float32, of the output memmap
+    @return:
+        1. shape of the output
+    '''
+    X = np.load(in_path, mmap_mode='r')
+    X = X.reshape(X.shape[0], -1)
+    node_num, in_dim = X.shape
+    if method == 'random':
+        mean, proj = None, random_projection_matrix(in_dim, out_dim, seed)
+    elif method == 'pca':
+        mean, proj = pca_projection_matrix(X, out_dim, seed=seed)
+    else:
+        raise ValueError('unknown projection method: %s' % method)
+
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.dtype(dtype), shape=(node_num, out_dim))
+    for start in range(0, node_num, chunk_size):
+        chunk = np.asarray(X[start: start + chunk_size], dtype=np.float32)
+        if mean is not None:
+            chunk = chunk - mean
+        out[start: start + chunk_size] = chunk.dot(proj)
+    out.flush()
+    logger.info('%s: %d x %d -> %s: %d x %d (%s, %s)' % (in_path, node_num, in_dim, out_path, node_num, out_dim, method, dtype))
+    return out.shape
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--in_path', required=True, help='e.g. HG_data/hotel/X_2d.npy')
+    parser.add_argument('--out_path', required=False, help='default: X_2d_{rp|pca}{dim}.npy next to in_path')
+    parser.add_argument('--dim', type=int, default=256, help='dimension after projection')
+    parser.add_argument('--method', default='random', help='random | pca')
+    parser.add_argument('--dtype', default='float16', help='float16 | float32')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    assert args.dtype in {'float16', 'float32'}
+    if args.out_path is None:
+        tag = 'rp' if args.method == 'random' else args.method
+        args.out_path = '%s_%s%d.npy' % (os.path.splitext(args.in_path)[0], tag, args.dim)
+    project_features(args.in_path, args.out_path, args.dim, method=args.method, dtype=args.dtype, seed=args.seed)
@@ -4,33 +4,108 @@ import sys
 install_path = os.path.abspath(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(install_path)
 
+import numpy as np
+import torch
 import torch.nn.functional as F
 from torch import nn
 
-from hyconv import HyConv
+from hyconv import HyConv, HyConvSparse
+from hyedge import count_node, count_hyedge, degree_node, degree_hyedge
 
 
 class HGTransEnNet(nn.Module):
-    def __init__(self, in_ch, n_class, hiddens=(16,), dropout=0.5) -> None:
+    def __init__(self, in_ch, n_class, hiddens=(16,), dropout=0.5, sparse_conv=False) -> None:
         super().__init__()
         self.dropout = dropout
+        conv = HyConvSparse if sparse_conv else HyConv
         _in = in_ch
         self.hyconvs = []
         for _h in hiddens:
             _out = _h
-            self.hyconvs.append(HyConv(_in, _out))
+            self.hyconvs.append(conv(_in, _out))
             _in = _out
         self.hyconvs = nn.ModuleList(self.hyconvs)
-        self.last_hyconv = HyConv(_in, n_class)
+        self.last_hyconv = conv(_in, n_class)
 
     def forward(self, x, H, hyedge_weight=None):
         for hyconv in self.hyconvs:
             x = hyconv(x, H)
             x = F.leaky_relu(x, inplace=True)
-            x = F.dropout(x, self.dropout)
+            x = F.dropout(x, self.dropout, training=self.training)
         x = self.last_hyconv(x, H)
         return F.log_softmax(x, dim=1)
 
+    def _node_ft_from_hyedge(self, hyconv, hyedge_ft, node_idx, hyedge_idx, node_norm, node_num, last):
+        # HyConv.gen_node_ft + bias (+ activation), for the incidences (node_idx, hyedge_idx) of node_num nodes
+        x = torch.zeros(node_num, hyedge_ft.size(1), device=hyedge_ft.device)
+        x = x.index_add(0, node_idx, hyedge_ft[hyedge_idx] * node_norm.unsqueeze(1))
+        if hyconv.bias is not None:
+            x = x + hyconv.bias
+        return x if last else F.leaky_relu(x)
+
+    def hyedge_cache(self, x, H, chunk_size=None):
+        '''
+        hyperedge features (HyConv.gen_hyedge_ft) of every layer on the training hypergraph, used by forward_inductive.
+        Nodes are processed in chunks, so x can be a callable (start, end) -> chunk of node features. x is only read
+        for the first layer, the node features of the next layers come from the hyperedge features of the previous one.
+        @return:
+            1. list of E x C_l tensors, one for each HyConv
+        '''
+        hyconvs = list(self.hyconvs) + [self.last_hyconv]
+        device = self.last_hyconv.theta.device
+        H = torch.stack(list(H)).to(device)
+        node_idx, hyedge_idx = H
+        node_num, hyedge_num = count_node(H), count_hyedge(H)
+        hyedge_norm = 1.0 / degree_hyedge(H).float()
+        node_norm = 1.0 / degree_node(H).float()
+        chunk_size = node_num if chunk_size is None else chunk_size
+
+        # incidences of each chunk of nodes: (start, end, node_idx - start, hyedge_idx, node_norm[node_idx])
+        chunks = []
+        for start in range(0, node_num, chunk_size):
+            end = min(start + chunk_size, node_num)
+            mask = (node_idx >= start) & (node_idx < end)
+            chunks.append((start, end, node_idx[mask] - start, hyedge_idx[mask], node_norm[node_idx[mask]]))
+
+        hyedge_fts = []
+        with torch.no_grad():
+            for layer, hyconv in enumerate(hyconvs):
+                hyedge_ft = torch.zeros(hyedge_num, hyconv.theta.size(1), device=device)
+                for start, end, chunk_node_idx, chunk_hyedge_idx, chunk_node_norm in chunks:
+                    if layer == 0:
+                        h = x(start, end) if callable(x) else x[start: end]
+                        h = torch.as_tensor(np.asarray(h, dtype=np.float32) if not isinstance(h, torch.Tensor) else h).float().to(device)
+                    else:
+                        h = self._node_ft_from_hyedge(hyconvs[layer - 1], hyedge_fts[layer - 1], chunk_node_idx, chunk_hyedge_idx,
+                                                      chunk_node_norm, end - start, last=False)
+                    h = h.matmul(hyconv.theta)
+                    hyedge_ft.index_add_(0, chunk_hyedge_idx, h[chunk_node_idx] * hyedge_norm[chunk_hyedge_idx].unsqueeze(1))
+                hyedge_fts.append(hyedge_ft)
+        return hyedge_fts
+
+    def forward_inductive(self, H_new, hyedge_fts):
+        '''
+        embed new nodes without retraining: H_new attaches them to hyperedges of the training hypergraph
+        (e.g. by hyedge.neighbor_attach), and the cached hyperedge features are aggregated layer by layer.
+        The new nodes do not change the hyperedge features of the training hypergraph.
+        @return:
+            1. log-probabilities, M x n_class
+            2. hidden embeddings (output of the last hidden HyConv), M x hiddens[-1]
+        '''
+        hyconvs = list(self.hyconvs) + [self.last_hyconv]
+        H_new = torch.stack(list(H_new)).to(hyedge_fts[0].device)
+        node_idx, hyedge_idx = H_new
+        node_num = count_node(H_new)
+        node_norm = (1.0 / degree_node(H_new).float())[node_idx]
+        hidden = None
+        with torch.no_grad():
+            for layer, hyconv in enumerate(hyconvs):
+                x = self._node_ft_from_hyedge(hyconv, hyedge_fts[layer], node_idx, hyedge_idx, node_norm, node_num,
+                                              last=(hyconv is self.last_hyconv))
+                if hyconv is not self.last_hyconv:
+                    hidden = x
+        return F.log_softmax(x, dim=1), hidden
+
 def main(learning_rate=0.001, epoch=100):
     '''
 
@@ -50,7 +125,7 @@ def main(learning_rate=0.001, epoch=100):
     install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     sys.path.append(install_path)
 
-    from models.hyedge import neighbor_distance
+    from models.hyedge import neighbor_distance, neighbor_group, select_node_index, count_hyedge, count_node
     from models.hygraph import hyedge_concat
     # from models import HGEnTrans
     from models.utils.meter import trans_class_acc
@@ -78,22 +153,22 @@ def main(learning_rate=0.001, epoch=100):
             ba_target += [i] * en_ba_dim[1, i]
         return np.array(en_target + ba_target)
 
-    def H2idx(H):
-        node_len, edge_len = H.size()
-        node_indices = []
-        edge_indices = []
-        for i in range(node_len):
-            for j in range(edge_len):
-                if H[i, j]:
-                    node_indices.append(i)
-                    edge_indices.append(j)
-        return torch.LongTensor([node_indices, edge_indices])
+    def load_H(d, en_ba_dim):
+        '''
+        incidence matrix in index form [node_idx, hyedge_idx], read from H_idx.npy (see data_processing/en_bert_feature_extract.generate_H);
+        if it is absent, H is generated from en_ba_sen_nums_metadata, no dense N x E matrix is built
+        '''
+        H_path = os.path.join(d, 'H_idx.npy')
+        if os.path.exists(H_path):
+            return torch.from_numpy(np.load(H_path)).long()
+        return neighbor_group(en_ba_dim)
 
     d = '/users6/kyzhang/tk/bert/HG_data/restaurant'
-    H_all = np.load(os.path.join(d, 'H.npy'))
     en_ba_dim = np.load(os.path.join(d, 'en_ba_sen_nums_metadata.npy'))
-    X_1d = np.load(os.path.join(d, 'X_1d.npy'))
-    n_class = H_all.shape[1]
+    H_all = load_H(d, en_ba_dim) # H (incidence matrix, index form)
+    X_2d = np.load(os.path.join(d, 'X_2d.npy'), mmap_mode='r')
+    X_1d = X_2d.reshape(X_2d.shape[0], -1)
+    n_class = count_hyedge(H_all)
     target = generate_target(en_ba_dim)
     print(en_ba_dim)
 
@@ -105,16 +180,19 @@ def main(learning_rate=0.001, epoch=100):
     ba_c_num = ba_cum_num[i]
 
     X_c = np.row_stack((X_1d[: en_c_num], X_1d[en_nums: en_nums + ba_c_num]))
-    H_c = np.row_stack((H_all[: en_c_num], H_all[en_nums: en_nums + ba_c_num]))
+    node_mask = torch.zeros(count_node(H_all), dtype=torch.bool)
+    node_mask[: en_c_num] = True
+    node_mask[en_nums: en_nums + ba_c_num] = True
+    H_c = select_node_index(H_all, node_mask)
     target_c = np.concatenate((target[: en_c_num], target[en_nums: en_nums + ba_c_num]))
 
-    X_c, H_c, target_c = torch.FloatTensor(X_c), torch.from_numpy(H_c), torch.from_numpy(target_c)
-    ft, H, target_c = X_c.to(device), H2idx(H_c.to(device)), target_c.to(device)
+    X_c, target_c = torch.FloatTensor(X_c), torch.from_numpy(target_c)
+    ft, H, target_c = X_c.to(device), H_c.to(device), target_c.to(device)
 
     # construct model
     n_class_c = i + 1
     in_ft = ft.size(1)
-    model = HGTransEnNet(in_ft, n_class_c, hiddens=(8,))
+    model = HGTransEnNet(in_ft, n_class_c, hiddens=(8,), sparse_conv=True)
     model = model.to(device)
     # model = HGEnTrans()
     optimizer = torch.optim.Adam(model.parameters(), lr=0.020)
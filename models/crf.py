@@ -4,6 +4,7 @@
 # @Last Modified by:   Jie Yang,     Contact: jieynlp@gmail.com
 # @Last Modified time: 2018-12-16 22:15:56
 # https://github.com/jiesutd/NCRFpp/blob/master/model/crf.py
+import functools
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -27,6 +28,17 @@ def log_sum_exp(vec, m_size):
     max_score = torch.gather(vec, 1, idx.view(-1, 1, m_size)).view(-1, 1, m_size)  # B * M
     return max_score.view(-1, m_size) + torch.log(torch.sum(torch.exp(vec - max_score.expand_as(vec)), 1)).view(-1, m_size)  # B * M
 
+def float32_feats(crf_function):
+    """
+    run crf_function(self, feats, ...) on float32 feats with autocast disabled:
+    the log-sum-exp of the partition and the Viterbi scores are too coarse in bfloat16/float16
+    """
+    @functools.wraps(crf_function)
+    def wrapper(self, feats, *args, **kwargs):
+        with torch.autocast(device_type=feats.device.type, enabled=False):
+            return crf_function(self, feats.float(), *args, **kwargs)
+    return wrapper
+
 class CRF(nn.Module):
 
     def __init__(self, tagset_size, device):
@@ -55,7 +67,7 @@ class CRF(nn.Module):
         seq_len = feats.size(1)
         tag_size = feats.size(2)
         assert(tag_size == self.tagset_size+2)
-        mask = mask.transpose(1,0).contiguous()
+        mask = mask.bool().transpose(1,0).contiguous()
 
         ins_num = seq_len * batch_size
         ## be careful the view shape, it is .view(ins_num, 1, tag_size) but not .view(ins_num, tag_size, 1)
@@ -93,6 +105,7 @@ class CRF(nn.Module):
         return final_partition.sum(), scores
 
 
+    @float32_feats
     def _viterbi_decode(self, feats, mask):
         """
             input:
@@ -109,7 +122,7 @@ class CRF(nn.Module):
         ## calculate sentence length for each sentence
         length_mask = torch.sum(mask, dim = 1).view(batch_size,1).long()
         ## mask to (seq_len, batch_size)
-        mask = mask.transpose(1,0).contiguous()
+        mask = mask.bool().transpose(1,0).contiguous()
         ins_num = seq_len * batch_size
         ## be careful the view shape, it is .view(ins_num, 1, tag_size) but not .view(ins_num, tag_size, 1)
         feats = feats.transpose(1,0).contiguous().view(ins_num, 1, tag_size).expand(ins_num, tag_size, tag_size)
@@ -124,7 +137,7 @@ class CRF(nn.Module):
         partition_history = list()
         ##  reverse mask (bug for mask = 1- mask, use this as alternative choice)
         # mask = 1 + (-1)*mask
-        mask =  (1 - mask.long()).byte()
+        mask = ~mask.bool()
         _, inivalues = seq_iter.__next__()  # bat_size * from_target_size * to_target_size
         # only need start from start_tag
         partition = inivalues[:, START_TAG, :].clone().view(batch_size, tag_size)  # bat_size * to_target_size
@@ -215,7 +228,7 @@ class CRF(nn.Module):
         ### need convert tags id to search from 400 positions of scores
         tg_energy = torch.gather(scores.view(seq_len, batch_size, -1), 2, new_tags).view(seq_len, batch_size)  # seq_len * bat_size
         ## mask transpose to (seq_len, batch_size)
-        tg_energy = tg_energy.masked_select(mask.transpose(1,0))
+        tg_energy = tg_energy.masked_select(mask.bool().transpose(1,0))
 
         ## calculate the score from START_TAG to first label
         # #start_transition = self.transitions[START_TAG,:].view(1, tag_size).expand(batch_size, tag_size)
@@ -226,6 +239,7 @@ class CRF(nn.Module):
         gold_score = tg_energy.sum() + end_energy.sum()
         return gold_score
 
+    @float32_feats
     def neg_log_likelihood_loss(self, feats, mask, tags):
         # nonegative log likelihood
         # batch_size = feats.size(0)
@@ -233,6 +247,7 @@ class CRF(nn.Module):
         gold_score = self._score_sentence(scores, mask, tags)
         return forward_score - gold_score
 
+    @float32_feats
     def _viterbi_decode_nbest(self, feats, mask, nbest):
         """
             input:
@@ -250,7 +265,7 @@ class CRF(nn.Module):
         ## calculate sentence length for each sentence
         length_mask = torch.sum(mask, dim = 1).view(batch_size,1).long()
         ## mask to (seq_len, batch_size)
-        mask = mask.transpose(1,0).contiguous()
+        mask = mask.bool().transpose(1,0).contiguous()
         ins_num = seq_len * batch_size
         ## be careful the view shape, it is .view(ins_num, 1, tag_size) but not .view(ins_num, tag_size, 1)
         feats = feats.transpose(1,0).contiguous().view(ins_num, 1, tag_size).expand(ins_num, tag_size, tag_size)
@@ -265,7 +280,7 @@ class CRF(nn.Module):
         partition_history = list()
         ##  reverse mask (bug for mask = 1- mask, use this as alternative choice)
         # mask = 1 + (-1)*mask
-        mask =  (1 - mask.long()).byte()
+        mask = ~mask.bool()
         _, inivalues = seq_iter.__next__()  # bat_size * from_target_size * to_target_size
         # only need start from start_tag
         partition = inivalues[:, START_TAG, :].clone()  # bat_size * to_target_size
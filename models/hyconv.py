@@ -66,3 +66,48 @@ class HyConv(nn.Module):
             return x + self.bias
         else:
             return x
+
+
+def hyconv_operator(H: torch.Tensor, hyedge_weight=None):
+    """
+    normalized sparse operator of HyConv, D_v^-1 H W D_e^-1 H^T, kept in factored form
+    (D_v^-1 H: N x E, W D_e^-1 H^T: E x N), since a hyperedge with many nodes makes the N x N product dense.
+    Without hyedge_weight, the operator is cached on H and rebuilt only if H is modified in place.
+    :return: (node_op, hyedge_op), sparse COO tensors
+    """
+    cached = getattr(H, '_hyconv_operator', None)
+    if hyedge_weight is None and cached is not None and cached[0] == H._version:
+        return cached[1]
+
+    node_idx, hyedge_idx = H
+    node_num, hyedge_num = count_node(H), count_hyedge(H)
+
+    hyedge_norm = 1.0 / degree_hyedge(H).float()
+    if hyedge_weight is not None:
+        hyedge_norm = hyedge_norm * hyedge_weight.to(H.device)
+    hyedge_op = torch.sparse_coo_tensor(torch.stack([hyedge_idx, node_idx]), hyedge_norm[hyedge_idx],
+                                        (hyedge_num, node_num)).coalesce()
+
+    node_norm = 1.0 / degree_node(H).float()
+    node_op = torch.sparse_coo_tensor(torch.stack([node_idx, hyedge_idx]), node_norm[node_idx],
+                                      (node_num, hyedge_num)).coalesce()
+
+    if hyedge_weight is None:
+        H._hyconv_operator = (H._version, (node_op, hyedge_op))
+    return node_op, hyedge_op
+
+
+class HyConvSparse(HyConv):
+    """HyConv applied by torch.sparse.mm with the cached normalized operator, the output is identical to HyConv"""
+
+    def forward(self, x: torch.Tensor, H: torch.Tensor, hyedge_weight=None):
+        assert len(x.shape) == 2, 'the input of HyperConv should be N x C'
+        node_op, hyedge_op = hyconv_operator(H, hyedge_weight)
+        x = x.matmul(self.theta)
+        x = torch.sparse.mm(hyedge_op.to(x.device), x)
+        x = torch.sparse.mm(node_op.to(x.device), x)
+
+        if self.bias is not None:
+            return x + self.bias
+        else:
+            return x
@@ -1,15 +1,17 @@
 
 from .distance_metric import pairwise_euclidean_distance
 from .utils.degree import degree_node, degree_hyedge
-from .utils.verify import contiguous_hyedge_idx, filter_node_index, remove_negative_index
+from .utils.verify import contiguous_hyedge_idx, filter_node_index, select_node_index, remove_negative_index
 from .utils.self_loop import self_loop_add, self_loop_remove
-from .gather_neighbor import neighbor_grid, neighbor_distance, gather_patch_ft
+from .gather_neighbor import neighbor_grid, neighbor_distance, neighbor_distance_chunked, neighbor_distance_lsh, \
+    neighbor_attach, neighbor_group, gather_patch_ft
 from .utils.count import count_hyedge, count_node
 
 __all__ = ['pairwise_euclidean_distance',
            'count_hyedge', 'count_node',
            'degree_node', 'degree_hyedge',
            'self_loop_add', 'self_loop_remove',
-           'contiguous_hyedge_idx', 'filter_node_index', 'remove_negative_index',
-           'neighbor_grid', 'neighbor_distance', 'gather_patch_ft',
+           'contiguous_hyedge_idx', 'filter_node_index', 'select_node_index', 'remove_negative_index',
+           'neighbor_grid', 'neighbor_distance', 'neighbor_distance_chunked', 'neighbor_distance_lsh',
+           'neighbor_attach', 'neighbor_group', 'gather_patch_ft',
            ]
\ No newline at end of file
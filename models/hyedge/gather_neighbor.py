@@ -3,6 +3,7 @@ from itertools import product
 import torch
 
 from . import remove_negative_index, self_loop_add, pairwise_euclidean_distance
+from .utils.count import count_hyedge
 
 
 def neighbor_grid(input_size, self_loop=False, neigh_funs__mask_funs=None):
@@ -88,6 +89,150 @@ def neighbor_distance(x: torch.Tensor, k_nearest, dis_metric=pairwise_euclidean_
     return H
 
 
+def _merge_topk(best_dis, best_idx, dis, idx, k_nearest, dedup=False):
+    """merge candidate neighbors (dis, idx) into the running k nearest (best_dis, best_idx) of each row"""
+    dis = torch.cat([best_dis, dis], dim=1)
+    idx = torch.cat([best_idx, idx], dim=1)
+    if dedup:
+        # the same neighbor may be found in several hash tables; a repeated one becomes padding (inf, -1),
+        # since topk may still pick it when a row has less than k_nearest distinct candidates
+        idx, order = idx.sort(dim=1)
+        dis = dis.gather(1, order)
+        dup = torch.zeros_like(idx, dtype=torch.bool)
+        dup[:, 1:] = (idx[:, 1:] == idx[:, :-1]) & (idx[:, 1:] >= 0)
+        dis = dis.masked_fill(dup, float('inf'))
+        idx = idx.masked_fill(dup, -1)
+    best_dis, top = torch.topk(dis, k_nearest, dim=1, largest=False)
+    return best_dis, idx.gather(1, top)
+
+
+def _square_distance(x_row, x_col, x_row_square, x_col_square):
+    return x_row_square.unsqueeze(1) - 2 * x_row.matmul(x_col.t()) + x_col_square.unsqueeze(0)
+
+
+def neighbor_distance_chunked(x: torch.Tensor, k_nearest, chunk_size=1024):
+    """
+    the same hyperedges as neighbor_distance (up to ties), but the distance matrix is computed block by block
+    with a running topk, so only chunk_size x chunk_size distances are held at once.
+    :param x: N x C matrix. N denotes node number, and C is the feature dimension.
+    :param k_nearest:
+    :param chunk_size: number of rows (and columns) of each distance block
+    :return:
+    """
+    assert len(x.shape) == 2, 'should be a tensor with dimension (N x C)'
+    node_num = x.size(0)
+    assert k_nearest <= node_num
+    x = x.float()
+    x_square = torch.sum(x ** 2, dim=1)
+
+    nn_idx = []
+    for row_start in range(0, node_num, chunk_size):
+        x_row, x_row_square = x[row_start: row_start + chunk_size], x_square[row_start: row_start + chunk_size]
+        best_dis = torch.full((x_row.size(0), 0), float('inf'), device=x.device)
+        best_idx = torch.full((x_row.size(0), 0), -1, dtype=torch.long, device=x.device)
+        for col_start in range(0, node_num, chunk_size):
+            x_col, x_col_square = x[col_start: col_start + chunk_size], x_square[col_start: col_start + chunk_size]
+            dis = _square_distance(x_row, x_col, x_row_square, x_col_square)
+            top_dis, top = torch.topk(dis, min(k_nearest, dis.size(1)), dim=1, largest=False)
+            best_dis, best_idx = _merge_topk(best_dis, best_idx, top_dis, top + col_start,
+                                             min(k_nearest, best_dis.size(1) + top.size(1)))
+        nn_idx.append(best_idx)
+    nn_idx = torch.cat(nn_idx, dim=0)
+
+    hyedge_idx = torch.arange(node_num).to(x.device).unsqueeze(0).repeat(k_nearest, 1).transpose(1, 0).reshape(-1)
+    H = torch.stack([nn_idx.reshape(-1), hyedge_idx])
+    return H
+
+
+def neighbor_distance_lsh(x: torch.Tensor, k_nearest, hash_bits=8, hash_tables=4, chunk_size=1024, seed=0):
+    """
+    approximate neighbor_distance by random-hyperplane LSH: the candidates of a node are the nodes sharing a bucket
+    with it in any of the hash tables, and exact distances are only computed within buckets.
+    A node with less than k_nearest candidates gets a smaller hyperedge (it always contains the node itself).
+    :param x: N x C matrix. N denotes node number, and C is the feature dimension.
+    :param k_nearest:
+    :param hash_bits: 2^hash_bits buckets per table, more bits give smaller buckets (faster, less accurate)
+    :param hash_tables: more tables give more candidates (slower, more accurate)
+    :return:
+    """
+    assert len(x.shape) == 2, 'should be a tensor with dimension (N x C)'
+    node_num = x.size(0)
+    x = x.float()
+    x_square = torch.sum(x ** 2, dim=1)
+    x_center = x - x.mean(dim=0, keepdim=True)
+    generator = torch.Generator().manual_seed(seed)
+    bit_weight = (2 ** torch.arange(hash_bits)).to(x.device)
+
+    best_dis = torch.full((node_num, k_nearest), float('inf'), device=x.device)
+    best_idx = torch.full((node_num, k_nearest), -1, dtype=torch.long, device=x.device)
+    for _ in range(hash_tables):
+        planes = torch.randn(x.size(1), hash_bits, generator=generator).to(x.device)
+        codes = ((x_center.matmul(planes) > 0).long() * bit_weight).sum(dim=1)
+        codes, order = codes.sort()
+        _, bucket_sizes = torch.unique_consecutive(codes, return_counts=True)
+        for members in torch.split(order, bucket_sizes.tolist()):
+            x_col, x_col_square = x[members], x_square[members]
+            for row_start in range(0, members.size(0), chunk_size):
+                rows = members[row_start: row_start + chunk_size]
+                dis = _square_distance(x[rows], x_col, x_square[rows], x_col_square)
+                top_dis, top = torch.topk(dis, min(k_nearest, dis.size(1)), dim=1, largest=False)
+                best_dis[rows], best_idx[rows] = _merge_topk(best_dis[rows], best_idx[rows], top_dis, members[top],
+                                                             k_nearest, dedup=True)
+
+    hyedge_idx = torch.arange(node_num).to(x.device).unsqueeze(0).repeat(k_nearest, 1).transpose(1, 0).reshape(-1)
+    H = torch.stack([best_idx.reshape(-1), hyedge_idx])
+    return remove_negative_index(H)
+
+
+def neighbor_attach(x_new: torch.Tensor, x, H: torch.Tensor, k_nearest, chunk_size=1024):
+    """
+    attach new nodes to the hyperedges of an existing hypergraph: a new node joins every hyperedge of its
+    k nearest existing nodes (inductive inference).
+    :param x_new: M x C features of the new nodes
+    :param x: N x C features of the nodes of H (tensor or numpy array/memmap, read chunk by chunk)
+    :param H: existing hypergraph in index form
+    :return: H_new, [new node idx (0..M-1), hyedge idx of H]
+    """
+    x_new = x_new.float()
+    x_new_square = torch.sum(x_new ** 2, dim=1)
+    node_num = len(x)
+    best_dis = torch.full((x_new.size(0), 0), float('inf'), device=x_new.device)
+    best_idx = torch.full((x_new.size(0), 0), -1, dtype=torch.long, device=x_new.device)
+    for col_start in range(0, node_num, chunk_size):
+        x_col = torch.as_tensor(x[col_start: col_start + chunk_size]).float().to(x_new.device)
+        dis = _square_distance(x_new, x_col, x_new_square, torch.sum(x_col ** 2, dim=1))
+        top_dis, top = torch.topk(dis, min(k_nearest, dis.size(1)), dim=1, largest=False)
+        best_dis, best_idx = _merge_topk(best_dis, best_idx, top_dis, top + col_start,
+                                         min(k_nearest, best_dis.size(1) + top.size(1)))
+
+    # (new node -> nearest nodes) x (node -> hyedge)
+    new_num, hyedge_num = x_new.size(0), count_hyedge(H)
+    new_idx = torch.arange(new_num, device=x_new.device).unsqueeze(1).expand_as(best_idx)
+    knn = torch.sparse_coo_tensor(torch.stack([new_idx.reshape(-1), best_idx.reshape(-1)]),
+                                  torch.ones(best_idx.numel(), device=x_new.device), (new_num, node_num))
+    H = torch.stack(list(H)).to(x_new.device)
+    incidence = torch.sparse_coo_tensor(H, torch.ones(H.size(1), device=x_new.device), (node_num, hyedge_num))
+    H_new = torch.sparse.mm(knn, incidence).coalesce().indices()
+    return H_new
+
+
+def neighbor_group(group_nums):
+    """
+    construct one hyperedge for each group (e.g. intent), nodes are numbered group by group.
+    :param group_nums: R x E matrix (e.g. en_ba_sen_nums_metadata), group_nums[r, e] nodes of the r-th block belong to hyperedge e;
+                       blocks are numbered one after another (e.g. all En sentences, then all Ba sentences)
+    :return: H in index form, each node belongs to exactly one hyperedge
+    """
+    group_nums = torch.as_tensor(group_nums).long()
+    if len(group_nums.shape) == 1:
+        group_nums = group_nums.unsqueeze(0)
+    hyedge_idx = torch.arange(group_nums.size(1)).repeat(group_nums.size(0))
+    hyedge_idx = torch.repeat_interleave(hyedge_idx, group_nums.reshape(-1))
+    node_idx = torch.arange(hyedge_idx.size(0))
+    H = torch.stack([node_idx, hyedge_idx])
+    return H
+
+
 def gather_patch_ft(x: torch.Tensor, patch_size):
     """
 
@@ -1,6 +1,13 @@
 def count_node(H):
+    # numbers cached by models.hygraph.Hypergraph avoid a device sync
+    node_num = getattr(H, 'node_num', None)
+    if node_num is not None:
+        return node_num
     return H[0].max().item() + 1
 
 
 def count_hyedge(H):
+    hyedge_num = getattr(H, 'hyedge_num', None)
+    if hyedge_num is not None:
+        return hyedge_num
     return H[1].max().item() + 1
@@ -4,6 +4,8 @@ from .count import count_hyedge, count_node
 
 
 def degree_node(H):
+    if hasattr(H, 'node_degree'):
+        return H.node_degree
     node_idx, edge_idx = H
     node_num = count_node(H)
     src = torch.ones_like(node_idx).float().to(H.device)
@@ -13,6 +15,8 @@ def degree_node(H):
 
 
 def degree_hyedge(H: torch.Tensor):
+    if hasattr(H, 'hyedge_degree'):
+        return H.hyedge_degree
     node_idx, hyedge_idx = H
     edge_num = count_hyedge(H)
     src = torch.ones_like(hyedge_idx).float().to(H.device)
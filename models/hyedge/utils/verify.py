@@ -6,13 +6,10 @@ from .degree import degree_hyedge
 def contiguous_hyedge_idx(H):
     node_idx, hyedge_idx = H
     DE = degree_hyedge(H)
-    zero_idx = torch.where(DE == 0)[0]
+    # new index of each hyperedge = number of non-empty hyperedges before it
+    new_hyedge_idx = torch.cumsum((DE > 0).long(), dim=0) - 1
 
-    bias = torch.zeros_like(hyedge_idx)
-    for _idx in zero_idx:
-        bias[hyedge_idx > _idx] -= 1
-
-    hyedge_idx += bias
+    hyedge_idx = new_hyedge_idx[hyedge_idx]
     return torch.stack([node_idx, hyedge_idx])
 
 
@@ -22,6 +19,16 @@ def filter_node_index(H, idx_range):
     return contiguous_hyedge_idx(H[:, mask])
 
 
+def select_node_index(H, node_mask):
+    """keep the incidences of the selected nodes (bool mask over all nodes), nodes are renumbered in their original order"""
+    node_idx, _ = H
+    node_mask = node_mask.to(H.device)
+    new_node_idx = torch.cumsum(node_mask.long(), dim=0) - 1
+    H = H[:, node_mask[node_idx]]
+    H = torch.stack([new_node_idx[H[0]], H[1]])
+    return contiguous_hyedge_idx(H)
+
+
 def remove_negative_index(H):
     node_idx, _ = H
     mask = node_idx >= 0
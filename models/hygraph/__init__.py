@@ -1,5 +1,9 @@
 from .fusion import hyedge_concat
+from .sampling import node_batches
+from .hypergraph import Hypergraph
 
 __all__ = [
-    'hyedge_concat'
+    'hyedge_concat',
+    'node_batches',
+    'Hypergraph',
 ]
\ No newline at end of file
@@ -10,12 +10,8 @@ def hyedge_concat(Hs: Union[Tuple[torch.Tensor, ...], List[torch.Tensor]], same_
     hyedge_num = 0
     Hs_new = []
     for H in Hs:
-        _H = H.clone()
-        if not same_node:
-            _H[0, :] += node_num
-        _H[1, :] += hyedge_num
-
-        Hs_new.append(_H)
+        offset = torch.tensor([[0 if same_node else node_num], [hyedge_num]], device=H.device)
+        Hs_new.append(H + offset)
 
         hyedge_num += count_hyedge(H)
         node_num += count_node(H)
@@ -0,0 +1,81 @@
+from typing import Union, Tuple, List
+
+import torch
+
+from models.hyedge import count_hyedge, count_node
+
+
+class Hypergraph(object):
+    """
+    H in index form ([node_idx, hyedge_idx], 2 x nnz) with cached node/hyperedge numbers and degrees,
+    so they are computed (and synchronized with the device) once instead of in every HyConv.
+    It can be passed wherever H is expected: it unpacks and indexes like H, and count_node/count_hyedge/
+    degree_node/degree_hyedge return the cached values.
+    """
+
+    def __init__(self, H: torch.Tensor, node_num=None, hyedge_num=None):
+        self.H = H
+        self.node_num = count_node(H) if node_num is None else node_num
+        self.hyedge_num = count_hyedge(H) if hyedge_num is None else hyedge_num
+        self._node_degree = None
+        self._hyedge_degree = None
+
+    def __iter__(self):
+        return iter(self.H)
+
+    def __getitem__(self, item):
+        return self.H[item]
+
+    @property
+    def device(self):
+        return self.H.device
+
+    @property
+    def nnz(self):
+        return self.H.size(1)
+
+    @property
+    def _version(self):
+        # HyConvSparse caches its operator on the hypergraph and checks the version of H
+        return self.H._version
+
+    @property
+    def node_degree(self):
+        if self._node_degree is None:
+            node_idx, _ = self.H
+            self._node_degree = torch.zeros(self.node_num, device=self.device).scatter_add(
+                0, node_idx, torch.ones_like(node_idx).float()).long()
+        return self._node_degree
+
+    @property
+    def hyedge_degree(self):
+        if self._hyedge_degree is None:
+            _, hyedge_idx = self.H
+            self._hyedge_degree = torch.zeros(self.hyedge_num, device=self.device).scatter_add(
+                0, hyedge_idx, torch.ones_like(hyedge_idx).float()).long()
+        return self._hyedge_degree
+
+    def to(self, device):
+        hg = Hypergraph(self.H.to(device), self.node_num, self.hyedge_num)
+        if self._node_degree is not None:
+            hg._node_degree = self._node_degree.to(device)
+        if self._hyedge_degree is not None:
+            hg._hyedge_degree = self._hyedge_degree.to(device)
+        return hg
+
+    @staticmethod
+    def concat(hgs: Union[Tuple['Hypergraph', ...], List['Hypergraph']], same_node=True):
+        """
+        concatenate hypergraphs, e.g. the per-domain hypergraphs of hotel, attraction, taxi and restaurant.
+        Offsets come from the cached numbers, no index is scanned.
+        :param same_node: True: all hypergraphs are over the same nodes; False: nodes of each hypergraph are appended
+        """
+        node_offset, hyedge_offset = 0, 0
+        Hs = []
+        for hg in hgs:
+            offset = torch.tensor([[0 if same_node else node_offset], [hyedge_offset]], device=hg.device)
+            Hs.append(hg.H + offset)
+            node_offset += hg.node_num
+            hyedge_offset += hg.hyedge_num
+        node_num = max(hg.node_num for hg in hgs) if same_node else node_offset
+        return Hypergraph(torch.cat(Hs, dim=1), node_num, hyedge_offset)
@@ -0,0 +1,33 @@
+import math
+
+import torch
+
+from models.hyedge import count_node, select_node_index
+
+
+def node_batches(H: torch.Tensor, batch_size, shuffle=True):
+    """
+    split the nodes into batches of about batch_size nodes and induce a sub-hypergraph for each batch.
+    The nodes of each hyperedge are dealt evenly over the batches, so every sub-hypergraph keeps a sample of every hyperedge.
+    :param H: hypergraph in index form
+    :param batch_size: number of nodes in each batch
+    :param shuffle: a new random split for each call
+    :return: list of (node_idx, H_batch), node_idx are the sorted original indices of the nodes in H_batch
+    """
+    node_idx, hyedge_idx = H
+    node_num = count_node(H)
+    batch_num = max(1, math.ceil(node_num / batch_size))
+
+    # each node is dealt with the first hyperedge it belongs to
+    node_key = torch.full((node_num,), torch.iinfo(torch.long).max, dtype=torch.long, device=H.device)
+    node_key = node_key.scatter_reduce(0, node_idx, hyedge_idx, reduce='amin')
+    order = torch.randperm(node_num, device=H.device) if shuffle else torch.arange(node_num, device=H.device)
+    order = order[torch.sort(node_key[order], stable=True)[1]]
+    batch_idx = torch.empty_like(order)
+    batch_idx[order] = torch.arange(node_num, device=H.device) % batch_num
+
+    batches = []
+    for b in range(batch_num):
+        node_mask = batch_idx == b
+        batches.append((torch.where(node_mask)[0], select_node_index(H, node_mask)))
+    return batches
@@ -0,0 +1,172 @@
+"""Slot tagger + intent classifier in one TorchScript-able module, for inference."""
+from typing import List, Tuple
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.nn.utils.rnn as rnn_utils
+
+import models.slot_tagger as slot_tagger
+import models.slot_tagger_crf as slot_tagger_crf
+import models.snt_classifier as snt_classifier
+
+class _NoHead(nn.Module):
+    def forward(self, h_n, lstm_out, lengths, mask):
+        # type: (Tensor, Tensor, Tensor, Tensor) -> Tensor
+        return lstm_out.new_zeros(lstm_out.size(0), 0)
+
+class _TwoTailsHead(nn.Module):
+    def __init__(self, model_class):
+        super(_TwoTailsHead, self).__init__()
+        self.num_directions = model_class.num_directions
+        self.hidden2class = model_class.hidden2class
+
+    def forward(self, h_n, lstm_out, lengths, mask):
+        # type: (Tensor, Tensor, Tensor, Tensor) -> Tensor
+        h_t = h_n[h_n.size(0) - self.num_directions:].transpose(0, 1)
+        h_t = h_t.contiguous().view(h_t.size(0), h_t.size(1)*h_t.size(2))
+        return self.hidden2class(h_t)
+
+class _PoolingHead(nn.Module):
+    def __init__(self, model_class):
+        super(_PoolingHead, self).__init__()
+        self.mean_pooling = model_class.pooling == 'mean'
+        self.hidden2class = model_class.hidden2class
+
+    def forward(self, h_n, lstm_out, lengths, mask):
+        # type: (Tensor, Tensor, Tensor, Tensor) -> Tensor
+        # as snt_classifier.masked_pooling
+        masks = mask.unsqueeze(2)
+        if self.mean_pooling:
+            lstm_out_pool = torch.where(masks, lstm_out, lstm_out.new_zeros(())).sum(1) / lengths.to(lstm_out.dtype).unsqueeze(1)
+        else:
+            lstm_out_pool = torch.where(masks, lstm_out, lstm_out.new_full((), -float('inf'))).max(1)[0]
+        return self.hidden2class(lstm_out_pool)
+
+class _CNNHead(nn.Module):
+    def __init__(self, model_class):
+        super(_CNNHead, self).__init__()
+        self.conv2d = model_class.conv2d
+        self.cnn = model_class.cnn
+        self.batchnorm = model_class.batchnorm
+        self.hidden2class = model_class.hidden2class
+
+    def forward(self, h_n, lstm_out, lengths, mask):
+        # type: (Tensor, Tensor, Tensor, Tensor) -> Tensor
+        hiddens = lstm_out.transpose(1, 2)
+        if self.conv2d:
+            conv_hiddens = self.cnn(hiddens.unsqueeze(1)).squeeze(1)
+        else:
+            conv_hiddens = self.cnn(hiddens)
+        return self.hidden2class(self.batchnorm(conv_hiddens.max(2)[0]))
+
+class _AttentionHead(nn.Module):
+    def __init__(self, model_class):
+        super(_AttentionHead, self).__init__()
+        self.first_state = 2 * model_class.num_layers - 1 if model_class.bidirectional else 0
+        self.Wa, self.Ua, self.Va = model_class.Wa, model_class.Ua, model_class.Va
+        self.hidden2class = model_class.hidden2class
+
+    def forward(self, h_n, lstm_out, lengths, mask):
+        # type: (Tensor, Tensor, Tensor, Tensor) -> Tensor
+        h_t = h_n[self.first_state:].squeeze(0)
+        hiddens = lstm_out.transpose(1, 2)
+        c4 = torch.tanh(self.Wa(h_t).unsqueeze(2) + self.Ua(hiddens))
+        e = self.Va(c4).squeeze(1).masked_fill(~mask, -float('inf'))
+        a = F.softmax(e.float(), dim=1)
+        context_hidden = torch.bmm(hiddens, a.unsqueeze(2)).squeeze(2)
+        return self.hidden2class(context_hidden)
+
+CLASSIFIER_HEADS = [
+    (snt_classifier.sntClassifier_2tails, _TwoTailsHead),
+    (snt_classifier.sntClassifier_hiddenPooling, _PoolingHead),
+    (snt_classifier.sntClassifier_hiddenCNN, _CNNHead),
+    (snt_classifier.sntClassifier_hiddenAttention, _AttentionHead),
+    ]
+
+class JointSlotIntentInference(nn.Module):
+    '''
+    A trained word-level LSTMTagger / LSTMTagger_CRF and its snt_classifier as one module, which torch.jit.script
+    compiles (see utils/model_export.py): forward(tokens, lengths) returns
+        1. tag_ids: batch x max(lengths), greedy tags or the CRF Viterbi path (0 at the padded positions)
+        2. class_scores: batch x class_size, log_softmax (or sigmoid if multi_class) scores; batch x 0 without model_class
+    tokens are the padded word ids (batch x max_len), lengths the int64 sentence lengths (on CPU, any order).
+    The tagger must read word ids only (no ELMo / transformer / extFeats).
+    '''
+
+    def __init__(self, model_tag, model_class=None):
+        super(JointSlotIntentInference, self).__init__()
+        if type(model_tag) not in (slot_tagger.LSTMTagger, slot_tagger_crf.LSTMTagger_CRF):
+            raise ValueError('%s can not be exported, only LSTMTagger and LSTMTagger_CRF can' % (type(model_tag).__name__))
+        if model_tag.elmo_model is not None or model_tag.pretrained_model is not None or model_tag.extFeats_linear is not None:
+            raise ValueError('only taggers on word embeddings can be exported')
+        self.crf = type(model_tag) == slot_tagger_crf.LSTMTagger_CRF
+        self.word_embeddings = model_tag.word_embeddings
+        self.lstm = model_tag.lstm
+        self.hidden2tag = model_tag.hidden2tag
+        if self.crf:
+            self.register_buffer('transitions', model_tag.crf_layer.transitions.detach().clone())
+        else:
+            self.register_buffer('transitions', torch.zeros(0, 0))
+
+        self.multi_class = bool(model_class is not None and model_class.multi_class)
+        if model_class is None:
+            self.head = _NoHead()
+        else:
+            heads = [head for classifier, head in CLASSIFIER_HEADS if type(model_class) == classifier]
+            if not heads:
+                raise ValueError('%s can not be exported' % (type(model_class).__name__))
+            self.head = heads[0](model_class)
+        self.eval()
+
+    def _viterbi_decode(self, feats, lengths):
+        # type: (Tensor, Tensor) -> Tensor
+        '''the same path as models.crf.CRF._viterbi_decode (START_TAG = -2, STOP_TAG = -1), vectorized over the batch'''
+        batch_size, seq_len, tag_size = feats.size(0), feats.size(1), feats.size(2)
+        transitions = self.transitions
+        partition = feats[:, 0, :] + transitions[tag_size - 2, :]
+        partition_history = [partition]
+        back_points: List[torch.Tensor] = []
+        for idx in range(1, seq_len):
+            cur_values = (feats[:, idx, :].unsqueeze(1) + transitions.unsqueeze(0)) + partition.unsqueeze(2)
+            partition, cur_bp = torch.max(cur_values, 1)
+            partition_history.append(partition)
+            back_points.append(cur_bp)
+        last_position = (lengths - 1).view(batch_size, 1, 1).expand(batch_size, 1, tag_size)
+        last_partition = torch.gather(torch.stack(partition_history, 1), 1, last_position).squeeze(1)
+        last_values = last_partition.unsqueeze(2) + transitions.unsqueeze(0)
+        pointer = torch.max(last_values, 1)[1][:, tag_size - 1]
+
+        zeros = torch.zeros_like(pointer)
+        decode_idx = torch.zeros(batch_size, seq_len, dtype=torch.long, device=feats.device)
+        decode_idx[:, seq_len - 1] = torch.where(lengths == seq_len, pointer, zeros)
+        cur_tag = pointer
+        for idx in range(seq_len - 1, 0, -1):
+            cur_tag = torch.where(lengths - 1 == idx, pointer, cur_tag)
+            prev_tag = torch.gather(back_points[idx - 1], 1, cur_tag.unsqueeze(1)).squeeze(1)
+            decode_idx[:, idx - 1] = torch.where(lengths - 1 > idx - 1, prev_tag, torch.where(lengths - 1 == idx - 1, pointer, zeros))
+            cur_tag = prev_tag
+        return decode_idx
+
+    def forward(self, tokens, lengths):
+        # type: (Tensor, Tensor) -> Tuple[Tensor, Tensor]
+        lengths = lengths.cpu()
+        embeds = self.word_embeddings(tokens)
+        packed_embeds = rnn_utils.pack_padded_sequence(embeds, lengths, batch_first=True, enforce_sorted=False)
+        packed_lstm_out, h_t_c_t = self.lstm(packed_embeds)
+        lstm_out, _ = rnn_utils.pad_packed_sequence(packed_lstm_out, batch_first=True)
+        device_lengths = lengths.to(tokens.device)
+        mask = torch.arange(lstm_out.size(1), device=tokens.device).unsqueeze(0) < device_lengths.unsqueeze(1)
+
+        tag_space = self.hidden2tag(lstm_out)
+        if self.crf:
+            tag_ids = self._viterbi_decode(tag_space.float(), device_lengths)
+        else:
+            tag_ids = F.log_softmax(tag_space.float(), dim=2).argmax(2).masked_fill(~mask, 0)
+
+        class_space = self.head(h_t_c_t[0], lstm_out, device_lengths, mask)
+        if self.multi_class:
+            class_scores = torch.sigmoid(class_space.float())
+        else:
+            class_scores = F.log_softmax(class_space.float(), dim=1)
+        return tag_ids, class_scores
@@ -0,0 +1,69 @@
+"""slot tagger and intent classifier in one module, sharing the encoder states and the per-batch tensors"""
+import torch
+import torch.nn as nn
+
+class JointSlotIntent(nn.Module):
+    '''
+    A slot tagger (LSTMTagger | LSTMTagger_focus | LSTMTagger_CRF | ...) and its intent classifier (snt_classifier)
+    as one module: forward runs the encoder of model_tag once and feeds encoder_info_filter(encoder_info) to
+    model_class, returning the tag loss, the class scores and the decoded tags.
+    The length mask of the batch is built once, from cached positions, and shared by the CRF and the classifier.
+    The positions only depend on the batch shape and are reused.
+    '''
+
+    def __init__(self, model_tag, model_class, encoder_info_filter, tag_loss_function, enc_dec=False, crf=False, device=None):
+        super(JointSlotIntent, self).__init__()
+        self.model_tag, self.model_class, self.encoder_info_filter = model_tag, model_class, encoder_info_filter
+        self.tag_loss_function = tag_loss_function
+        self.enc_dec, self.crf, self.device = enc_dec, crf, device
+        self.positions = None
+
+    def length_mask(self, lens):
+        '''batch x max(lens) bool mask of the real tokens'''
+        max_len = max(lens)
+        if self.positions is None or self.positions.size(1) < max_len:
+            self.positions = torch.arange(max_len, device=self.device).unsqueeze(0)
+        lens_tensor = torch.tensor(lens, dtype=torch.long, device=self.device)
+        return self.positions[:, :max_len] < lens_tensor.unsqueeze(1)
+
+    def _tag_loss(self, tag_scores, tags):
+        return self.tag_loss_function(tag_scores.contiguous().view(-1, tag_scores.size(-1)), tags.contiguous().view(-1))
+
+    def forward(self, inputs, tags, lens, extFeats=None, decoding=False):
+        '''
+        @params:
+            1. inputs: inputs of model_tag
+            2. tags: batch x max(lens) gold tag ids (with <s> and </s> for enc_dec)
+            3. lens: lengths of the sentences
+        @return:
+            1. tag_loss
+            2. class_scores (None without model_class)
+            3. top_pred_slots (None if not decoding)
+        '''
+        model_tag = self.model_tag
+        kwargs = {'extFeats': extFeats} if extFeats is not None else {}
+        top_pred_slots = None
+        masks = self.length_mask(lens) if self.crf or self.model_class is not None else None
+        if self.enc_dec:
+            if decoding:
+                tag_scores_1best, outputs_1best, encoder_info = model_tag.decode_greed(inputs, tags[:, 0:1], lens, with_snt_classifier=True, **kwargs)
+                tag_loss = self._tag_loss(tag_scores_1best, tags[:, 1:])
+                top_pred_slots = outputs_1best.cpu().numpy()
+            else:
+                tag_scores, encoder_info = model_tag(inputs, tags[:, :-1], lens, with_snt_classifier=True, **kwargs)
+                tag_loss = self._tag_loss(tag_scores, tags[:, 1:])
+        elif self.crf:
+            crf_feats, encoder_info = model_tag._get_lstm_features(inputs, lens, with_snt_classifier=True, **kwargs)
+            tag_loss = model_tag.neg_log_likelihood(crf_feats, masks, tags)
+            if decoding:
+                tag_path_scores, tag_path = model_tag.forward(crf_feats, masks)
+                top_pred_slots = tag_path.data.cpu().numpy()
+        else:
+            tag_scores, encoder_info = model_tag(inputs, lens, with_snt_classifier=True, **kwargs)
+            tag_loss = self._tag_loss(tag_scores, tags)
+            if decoding:
+                top_pred_slots = tag_scores.data.cpu().numpy().argmax(axis=-1)
+        class_scores = None
+        if self.model_class is not None:
+            class_scores = self.model_class(self.encoder_info_filter(encoder_info), masks=masks)
+        return tag_loss, class_scores, top_pred_slots
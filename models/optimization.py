@@ -185,8 +185,9 @@ class BertAdam(Optimizer):
     Params:
         lr: learning rate
         warmup: portion of t_total for the warmup, -1  means no warmup. Default: -1
-        t_total: total number of training steps for the learning
-            rate schedule, -1  means constant learning rate of 1. (no warmup regardless of warmup setting). Default: -1
+        t_total: total number of training steps (calls of step(), i.e. optimizer updates, not minibatches when
+            gradients are accumulated) for the learning rate schedule, -1  means constant learning rate of 1.
+            (no warmup regardless of warmup setting). Default: -1
         schedule: schedule to use for the warmup (see above).
             Can be `'warmup_linear'`, `'warmup_constant'`, `'warmup_cosine'`, `'none'`, `None` or a `_LRSchedule` object (see below).
             If `None` or `'none'`, learning rate is always kept constant.
@@ -225,13 +226,11 @@ class BertAdam(Optimizer):
     def get_lr(self):
         lr = []
         for group in self.param_groups:
-            for p in group['params']:
-                state = self.state[p]
-                if len(state) == 0:
-                    return [0]
-                lr_scheduled = group['lr']
-                lr_scheduled *= group['schedule'].get_lr(state['step'])
-                lr.append(lr_scheduled)
+            if group.get('step', 0) == 0:
+                return [0]
+            lr_scheduled = group['lr']
+            lr_scheduled *= group['schedule'].get_lr(group['step'])
+            lr.extend([lr_scheduled] * len(group['params']))
         return lr
 
     def step(self, closure=None):
@@ -246,6 +245,12 @@ class BertAdam(Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            # the schedule follows the number of updates of the group, also for parameters without gradients
+            # in some updates (their per-parameter state['step'] lags behind)
+            group_step = group.get('step', 0)
+            group['step'] = group_step + 1
+            lr_scheduled = group['lr']
+            lr_scheduled *= group['schedule'].get_lr(group_step)
             for p in group['params']:
                 if p.grad is None:
                     continue
@@ -286,9 +291,6 @@ class BertAdam(Optimizer):
                 if group['weight_decay'] > 0.0:
                     update += group['weight_decay'] * p.data
 
-                lr_scheduled = group['lr']
-                lr_scheduled *= group['schedule'].get_lr(state['step'])
-
                 update_with_lr = lr_scheduled * update
                 p.data.add_(-update_with_lr)
 
@@ -6,7 +6,7 @@ import torch.nn.utils.rnn as rnn_utils
 
 class LSTMTagger(nn.Module):
     
-    def __init__(self, embedding_dim, hidden_dim, vocab_size, tagset_size, bidirectional=True, num_layers=1, dropout=0., device=None, extFeats_dim=None, elmo_model=None, pretrained_model=None, pretrained_model_type=None, fix_pretrained_model=False):
+    def __init__(self, embedding_dim, hidden_dim, vocab_size, tagset_size, bidirectional=True, num_layers=1, dropout=0., device=None, extFeats_dim=None, elmo_model=None, pretrained_model=None, pretrained_model_type=None, fix_pretrained_model=False, sparse_embedding=False):
         """Initialize model."""
         super(LSTMTagger, self).__init__()
         self.embedding_dim = embedding_dim
@@ -19,6 +19,7 @@ class LSTMTagger(nn.Module):
         self.dropout = dropout
         self.device = device
         self.extFeats_dim = extFeats_dim
+        self.sparse_embedding = sparse_embedding # sparse gradients of word embeddings, see utils/sparse_optimizer.py
 
         self.num_directions = 2 if self.bidirectional else 1
         self.dropout_layer = nn.Dropout(p=self.dropout)
@@ -41,7 +42,7 @@ class LSTMTagger(nn.Module):
         elif self.pretrained_model:
             self.embedding_dim = self.pretrained_model.config.hidden_size
         else:
-            self.word_embeddings = nn.Embedding(self.vocab_size, self.embedding_dim)
+            self.word_embeddings = nn.Embedding(self.vocab_size, self.embedding_dim, sparse=self.sparse_embedding)
 
         # The LSTM takes word embeddings as inputs, and outputs hidden states
         self.append_feature_dim = 0
@@ -90,7 +91,7 @@ class LSTMTagger(nn.Module):
                 pretrained_top_hiddens = outputs[0]
             batch_size, pretrained_seq_length, hidden_size = pretrained_top_hiddens.size(0), pretrained_top_hiddens.size(1), pretrained_top_hiddens.size(2)
             chosen_encoder_hiddens = pretrained_top_hiddens.view(-1, hidden_size).index_select(0, selects)
-            pretrained_embeds = torch.zeros(len(lengths) * max(lengths), hidden_size, device=self.device)
+            pretrained_embeds = torch.zeros(len(lengths) * max(lengths), hidden_size, dtype=chosen_encoder_hiddens.dtype, device=self.device)
             pretrained_embeds = pretrained_embeds.index_copy_(0, copies, chosen_encoder_hiddens).view(len(lengths), max(lengths), -1)
             embeds = torch.cat((elmo_embeds, pretrained_embeds), dim=2)
         elif self.elmo_model:
@@ -107,7 +108,7 @@ class LSTMTagger(nn.Module):
                 pretrained_top_hiddens = outputs[0]
             batch_size, pretrained_seq_length, hidden_size = pretrained_top_hiddens.size(0), pretrained_top_hiddens.size(1), pretrained_top_hiddens.size(2)
             chosen_encoder_hiddens = pretrained_top_hiddens.view(-1, hidden_size).index_select(0, selects)
-            embeds = torch.zeros(len(lengths) * max(lengths), hidden_size, device=self.device)
+            embeds = torch.zeros(len(lengths) * max(lengths), hidden_size, dtype=chosen_encoder_hiddens.dtype, device=self.device)
             embeds = embeds.index_copy_(0, copies, chosen_encoder_hiddens).view(len(lengths), max(lengths), -1)
         else:
             embeds = self.word_embeddings(sentences)
@@ -125,7 +126,7 @@ class LSTMTagger(nn.Module):
         # step 3: slot tagger
         lstm_out_reshape = lstm_out.contiguous().view(lstm_out.size(0)*lstm_out.size(1), lstm_out.size(2))
         tag_space = self.hidden2tag(self.dropout_layer(lstm_out_reshape))
-        tag_scores = F.log_softmax(tag_space, dim=1)
+        tag_scores = F.log_softmax(tag_space.float(), dim=1)
         tag_scores = tag_scores.view(lstm_out.size(0), lstm_out.size(1), tag_space.size(1))
         
         if with_snt_classifier:
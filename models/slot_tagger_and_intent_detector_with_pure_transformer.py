@@ -75,7 +75,7 @@ class Transformers_joint_slot_and_intent(nn.Module):
             transformer_cls_hidden = self.sequence_summary(transformer_top_hiddens)
         batch_size, transformer_seq_length, hidden_size = transformer_top_hiddens.size(0), transformer_top_hiddens.size(1), transformer_top_hiddens.size(2)
         chosen_encoder_hiddens = transformer_top_hiddens.view(-1, hidden_size).index_select(0, selects)
-        embeds = torch.zeros(len(lengths) * max(lengths), hidden_size, device=self.device)
+        embeds = torch.zeros(len(lengths) * max(lengths), hidden_size, dtype=chosen_encoder_hiddens.dtype, device=self.device)
         embeds = embeds.index_copy_(0, copies, chosen_encoder_hiddens).view(len(lengths), max(lengths), -1)
         if type(extFeats) != type(None):
             concat_input = torch.cat((embeds, self.extFeats_linear(extFeats)), 2)
@@ -86,7 +86,7 @@ class Transformers_joint_slot_and_intent(nn.Module):
         concat_input_reshape = concat_input.contiguous().view(concat_input.size(0)*concat_input.size(1), concat_input.size(2))
         tag_space = self.hidden2tag(self.dropout_layer(concat_input_reshape))
         if self.task_st == 'NN':
-            tag_scores = F.log_softmax(tag_space, dim=1)
+            tag_scores = F.log_softmax(tag_space.float(), dim=1)
         else:
             tag_scores = tag_space
         tag_scores = tag_scores.view(concat_input.size(0), concat_input.size(1), tag_space.size(1))
@@ -101,11 +101,11 @@ class Transformers_joint_slot_and_intent(nn.Module):
                 hidden_for_intent = torch.cat((transformer_cls_hidden, embeds.max(1)[0]), dim=1)
             class_space = self.hidden2class(self.dropout_layer(transformer_cls_hidden))
             if self.multi_class:
-                class_scores = torch.sigmoid(class_space)
+                class_scores = torch.sigmoid(class_space.float())
                 if type(masked_output) != type(None):
                     class_scores.index_fill_(1, masked_output, 0)
             else:
-                class_scores = F.log_softmax(class_space, dim=1)
+                class_scores = F.log_softmax(class_space.float(), dim=1)
         else:
             class_scores = None
         
@@ -8,12 +8,13 @@ from models.Beam import Beam
 
 class LSTMTagger_focus(nn.Module):
     
-    def __init__(self, embedding_dim, tag_embedding_dim, hidden_dim, vocab_size, tagset_size, bidirectional=True, num_layers=1, dropout=0., device=None, extFeats_dim=None, decoder_tied=False, elmo_model=None, pretrained_model=None, pretrained_model_type=None, fix_pretrained_model=False):
+    def __init__(self, embedding_dim, tag_embedding_dim, hidden_dim, vocab_size, tagset_size, bidirectional=True, num_layers=1, dropout=0., device=None, extFeats_dim=None, decoder_tied=False, elmo_model=None, pretrained_model=None, pretrained_model_type=None, fix_pretrained_model=False, sparse_embedding=False):
         """Initialize model."""
         super(LSTMTagger_focus, self).__init__()
         self.embedding_dim = embedding_dim
         self.tag_embedding_dim = tag_embedding_dim
         self.extFeats_dim = extFeats_dim
+        self.sparse_embedding = sparse_embedding # sparse gradients of word embeddings, see utils/sparse_optimizer.py
         self.hidden_dim = hidden_dim
         self.vocab_size = vocab_size
         self.tagset_size = tagset_size
@@ -47,7 +48,7 @@ class LSTMTagger_focus(nn.Module):
         elif self.pretrained_model:
             self.embedding_dim = self.pretrained_model.config.hidden_size
         else:
-            self.word_embeddings = nn.Embedding(self.vocab_size, self.embedding_dim)
+            self.word_embeddings = nn.Embedding(self.vocab_size, self.embedding_dim, sparse=self.sparse_embedding)
         # The LSTM takes word embeddings as inputs, and outputs hidden states
         self.append_feature_dim = 0
         if self.extFeats_dim:
@@ -101,7 +102,7 @@ class LSTMTagger_focus(nn.Module):
                 pretrained_top_hiddens = outputs[0]
             batch_size, pretrained_seq_length, hidden_size = pretrained_top_hiddens.size(0), pretrained_top_hiddens.size(1), pretrained_top_hiddens.size(2)
             chosen_encoder_hiddens = pretrained_top_hiddens.view(-1, hidden_size).index_select(0, selects)
-            pretrained_embeds = torch.zeros(len(lengths) * max(lengths), hidden_size, device=self.device)
+            pretrained_embeds = torch.zeros(len(lengths) * max(lengths), hidden_size, dtype=chosen_encoder_hiddens.dtype, device=self.device)
             pretrained_embeds = pretrained_embeds.index_copy_(0, copies, chosen_encoder_hiddens).view(len(lengths), max(lengths), -1)
             embeds = torch.cat((elmo_embeds, pretrained_embeds), dim=2)
         elif self.elmo_model:
@@ -118,7 +119,7 @@ class LSTMTagger_focus(nn.Module):
                 pretrained_top_hiddens = outputs[0]
             batch_size, pretrained_seq_length, hidden_size = pretrained_top_hiddens.size(0), pretrained_top_hiddens.size(1), pretrained_top_hiddens.size(2)
             chosen_encoder_hiddens = pretrained_top_hiddens.view(-1, hidden_size).index_select(0, selects)
-            embeds = torch.zeros(len(lengths) * max(lengths), hidden_size, device=self.device)
+            embeds = torch.zeros(len(lengths) * max(lengths), hidden_size, dtype=chosen_encoder_hiddens.dtype, device=self.device)
             embeds = embeds.index_copy_(0, copies, chosen_encoder_hiddens).view(len(lengths), max(lengths), -1)
         else:
             embeds = self.word_embeddings(word_seqs)
@@ -139,10 +140,9 @@ class LSTMTagger_focus(nn.Module):
 
         # decoder
         if self.bidirectional:
-            index_slices = [2*i+1 for i in range(self.num_layers)]  # generated from the reversed path
-            index_slices = torch.tensor(index_slices, dtype=torch.long, device=self.device)
-            h_t = torch.index_select(enc_h_t, 0, index_slices)
-            c_t = torch.index_select(enc_c_t, 0, index_slices)
+            # generated from the reversed path, i.e. the odd states of each layer
+            h_t = enc_h_t[1::2].contiguous()
+            c_t = enc_c_t[1::2].contiguous()
         else:
             h_t = enc_h_t
             c_t = enc_c_t
@@ -155,9 +155,9 @@ class LSTMTagger_focus(nn.Module):
         tag_lstm_out_reshape = tag_lstm_out.contiguous().view(tag_lstm_out.size(0)*tag_lstm_out.size(1), tag_lstm_out.size(2))
         tag_space = self.hidden2tag(self.dropout_layer(tag_lstm_out_reshape))
         if masked_output is None:
-            tag_scores = F.log_softmax(tag_space, dim=1)
+            tag_scores = F.log_softmax(tag_space.float(), dim=1)
         else:
-            tag_scores = masked_function.index_masked_log_softmax(tag_space, masked_output, dim=1)
+            tag_scores = masked_function.index_masked_log_softmax(tag_space.float(), masked_output, dim=1)
         tag_scores = tag_scores.view(tag_lstm_out.size(0), tag_lstm_out.size(1), tag_space.size(1))
         
         if with_snt_classifier:
@@ -181,10 +181,9 @@ class LSTMTagger_focus(nn.Module):
 
         # decoder
         if self.bidirectional:
-            index_slices = [2*i+1 for i in range(self.num_layers)]  # generated from the reversed path
-            index_slices = torch.tensor(index_slices, dtype=torch.long, device=self.device)
-            h_t = torch.index_select(enc_h_t, 0, index_slices)
-            c_t = torch.index_select(enc_c_t, 0, index_slices)
+            # generated from the reversed path, i.e. the odd states of each layer
+            h_t = enc_h_t[1::2].contiguous()
+            c_t = enc_c_t[1::2].contiguous()
         else:
             h_t = enc_h_t
             c_t = enc_c_t
@@ -206,9 +205,9 @@ class LSTMTagger_focus(nn.Module):
             tag_lstm_out_reshape = tag_lstm_out.contiguous().view(tag_lstm_out.size(0)*tag_lstm_out.size(1), tag_lstm_out.size(2))
             tag_space = self.hidden2tag(self.dropout_layer(tag_lstm_out_reshape))
             if masked_output is None:
-                tag_scores = F.log_softmax(tag_space, dim=1) # bsize x outsize
+                tag_scores = F.log_softmax(tag_space.float(), dim=1) # bsize x outsize
             else:
-                tag_scores = masked_function.index_masked_log_softmax(tag_space, masked_output, dim=1)
+                tag_scores = masked_function.index_masked_log_softmax(tag_space.float(), masked_output, dim=1)
             top_path_tag_scores.append(torch.unsqueeze(tag_scores.data, 1))
 
             max_probs, decoder_argmax = torch.max(tag_scores, 1)
@@ -244,10 +243,9 @@ class LSTMTagger_focus(nn.Module):
 
         # decoder
         if self.bidirectional:
-            index_slices = [2*i+1 for i in range(self.num_layers)]  # generated from the reversed path
-            index_slices = torch.tensor(index_slices, dtype=torch.long, device=self.device)
-            h_t = torch.index_select(enc_h_t, 0, index_slices)
-            c_t = torch.index_select(enc_c_t, 0, index_slices)
+            # generated from the reversed path, i.e. the odd states of each layer
+            h_t = enc_h_t[1::2].contiguous()
+            c_t = enc_c_t[1::2].contiguous()
         else:
             h_t = enc_h_t
             c_t = enc_c_t
@@ -271,9 +269,9 @@ class LSTMTagger_focus(nn.Module):
             tag_lstm_out_reshape = tag_lstm_out.contiguous().view(tag_lstm_out.size(0)*tag_lstm_out.size(1), tag_lstm_out.size(2))
             tag_space = self.hidden2tag(self.dropout_layer(tag_lstm_out_reshape))
             if masked_output is None:
-                out = F.log_softmax(tag_space) # (batch*beam) x outsize
+                out = F.log_softmax(tag_space.float()) # (batch*beam) x outsize
             else:
-                out = masked_function.index_masked_log_softmax(tag_space, masked_output, dim=1)
+                out = masked_function.index_masked_log_softmax(tag_space.float(), masked_output, dim=1)
             
             word_lk = out.view(beam_size, remaining_sents, -1).transpose(0, 1).contiguous()
             
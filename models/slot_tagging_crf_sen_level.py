@@ -1,4 +1,5 @@
 """Slot Tagger models."""
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -7,7 +8,7 @@ import torch.nn.utils.rnn as rnn_utils
 import models.crf as crf
 
 class LSTMTagger_CRF_sen_level(nn.Module):
-    def __init__(self, embedding_dim, max_sen_len, sen_size, hidden_dim, tagset_size, bidirectional=True, num_layers=1, dropout=0., device=None):
+    def __init__(self, embedding_dim, max_sen_len, sen_size, hidden_dim, tagset_size, bidirectional=True, num_layers=1, dropout=0., device=None, frozen_sen_embeddings=None):
         """Initialize model."""
         super(LSTMTagger_CRF_sen_level, self).__init__()
 
@@ -27,7 +28,14 @@ class LSTMTagger_CRF_sen_level(nn.Module):
         self.dropout_layer = nn.Dropout(p=self.dropout)
 
 
-        self.sen_embeddings = nn.Embedding(self.sen_size, self.embedding_dim * self.max_sen_len)
+        # frozen_sen_embeddings: read-only (memory-mapped) array of sen_size x (max_sen_len * embedding_dim),
+        # rows are gathered per batch, so it is neither a parameter nor in the state_dict
+        self.frozen_sen_embeddings = frozen_sen_embeddings
+        if self.frozen_sen_embeddings is None:
+            self.sen_embeddings = nn.Embedding(self.sen_size, self.embedding_dim * self.max_sen_len)
+        else:
+            assert frozen_sen_embeddings.shape[0] == self.sen_size
+            self.frozen_sen_embeddings = frozen_sen_embeddings.reshape(self.sen_size, -1)
 
         # The LSTM takes word embeddings as inputs, and outputs hidden states
 
@@ -53,8 +61,13 @@ class LSTMTagger_CRF_sen_level(nn.Module):
     def _get_lstm_features(self, sentences, lengths, with_snt_classifier=False):
         # step 1: word embedding
 
-        # sentence embedding
-        sen_embeds = self.sen_embeddings(sentences)
+        # sentence embedding, only the first max(lengths) positions of each sentence are gathered
+        max_len = max(lengths)
+        if self.frozen_sen_embeddings is None:
+            sen_embeds = self.sen_embeddings.weight.view(self.sen_size, self.max_sen_len, self.embedding_dim)[:, :max_len]
+            sen_embeds = sen_embeds[sentences]
+        else:
+            sen_embeds = self._gather_frozen_sen_embeddings(sentences, max_len)
 
         # reshape to max_len * embedding_dim
         embeds = sen_embeds.reshape((sen_embeds.shape[0], -1, self.embedding_dim))
@@ -77,6 +90,12 @@ class LSTMTagger_CRF_sen_level(nn.Module):
         else:
             return tag_space
 
+    def _gather_frozen_sen_embeddings(self, sentences, max_len):
+        sen_idxs = sentences.cpu().numpy()
+        uniq_idxs, inverse = np.unique(sen_idxs, return_inverse=True)  # sorted reads on the memmap
+        rows = np.asarray(self.frozen_sen_embeddings[uniq_idxs, :max_len * self.embedding_dim], dtype=np.float32)
+        return torch.from_numpy(rows[inverse.reshape(-1)]).to(self.device)
+
     def neg_log_likelihood(self, feats, masks, tags):
         return self.crf_layer.neg_log_likelihood_loss(feats, masks, tags)
 
@@ -4,6 +4,41 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.nn.utils.rnn as rnn_utils
 
+def length_masks(lens, max_len, device=None):
+    '''bsize x max_len bool mask of the real tokens'''
+    lens = torch.as_tensor(lens, dtype=torch.long, device=device)
+    return torch.arange(max_len, device=device).unsqueeze(0) < lens.unsqueeze(1)
+
+def masked_pooling(hiddens, masks, pooling='mean'):
+    '''
+    mean or max of hiddens (bsize x seqlen x hsize) over the real tokens, i.e. where masks (bsize x seqlen, bool) is True
+    '''
+    masks = masks.unsqueeze(2)
+    if pooling == 'mean':
+        hiddens_sum = torch.where(masks, hiddens, hiddens.new_zeros(())).sum(1)
+        return hiddens_sum / masks.sum(1).to(hiddens.dtype)
+    else:
+        return torch.where(masks, hiddens, hiddens.new_full((), -float('inf'))).max(1)[0]
+
+def packed_pooling(packed_hiddens, pooling='mean'):
+    '''
+    mean or max of a PackedSequence over its real tokens, in the order of the sentences before packing;
+    only the packed rows are read, no padded tensor is built
+    '''
+    hiddens, batch_sizes = packed_hiddens.data, packed_hiddens.batch_sizes
+    # the packed rows are time-major: at step t, sentences 0 .. batch_sizes[t]-1 (sorted by length)
+    steps = torch.arange(int(batch_sizes[0])).unsqueeze(0) < batch_sizes.unsqueeze(1)
+    sentence_ids = steps.nonzero()[:, 1].to(hiddens.device)
+    shape = (int(batch_sizes[0]), hiddens.size(1))
+    if pooling == 'mean':
+        lens = steps.sum(0).to(hiddens.device, hiddens.dtype).unsqueeze(1)
+        pooled = hiddens.new_zeros(shape).index_add_(0, sentence_ids, hiddens) / lens
+    else:
+        pooled = hiddens.new_full(shape, -float('inf')).scatter_reduce_(0, sentence_ids.unsqueeze(1).expand_as(hiddens), hiddens, 'amax')
+    if packed_hiddens.unsorted_indices is not None:
+        pooled = pooled.index_select(0, packed_hiddens.unsorted_indices)
+    return pooled
+
 class sntClassifier_2tails(nn.Module):
     '''sentence classification'''
         
@@ -45,19 +80,21 @@ class sntClassifier_2tails(nn.Module):
         for weight in self.hidden2class.parameters():
             weight.data.uniform_(-initrange, initrange)
         
-    def forward(self, packed_h_t_c_t, masked_output=None):
-        index_slices = [self.num_layers*2-2, self.num_layers*2-1] if self.bidirectional else [self.num_layers*1-1]
-        index_slices = torch.tensor(index_slices, dtype=torch.long, device=self.device)
-        h_t = torch.index_select(packed_h_t_c_t[0], 0, index_slices)
+    def forward(self, packed_h_t_c_t, masked_output=None, masks=None):
+        '''
+        masks : unused, the last hidden states do not see the padding
+        '''
+        # the last layer, i.e. the last num_directions states of h_n (a view, no index tensor)
+        h_t = packed_h_t_c_t[0][-self.num_directions:]
         h_t = h_t.transpose(0,1)
         h_t = h_t.contiguous().view(h_t.size(0), self.num_directions*h_t.size(2))
         class_space = self.hidden2class(self.dropout_layer(h_t))
         if self.multi_class:
-            class_scores = torch.sigmoid(class_space)
+            class_scores = torch.sigmoid(class_space.float())
             if type(masked_output) != type(None):
                 class_scores.index_fill_(1, masked_output, 0)
         else:
-            class_scores = F.log_softmax(class_space, dim=1)
+            class_scores = F.log_softmax(class_space.float(), dim=1)
         
         return class_scores
     
@@ -117,33 +154,25 @@ class sntClassifier_hiddenPooling(nn.Module):
         for weight in self.hidden2class.parameters():
             weight.data.uniform_(-initrange, initrange)
         
-    def forward(self, inputs, masked_output=None):
+    def forward(self, inputs, masked_output=None, masks=None):
         '''
-        lstm_out : bsize x seqlen x hsize
+        lstm_out : bsize x seqlen x hsize, or a PackedSequence (lens is then unused)
+        masks : bsize x seqlen bool mask of the real tokens, built from lens if None
         '''
         lstm_out, lens = inputs
-        if self.pooling == 'mean':
-            len_sum = torch.tensor(lens, dtype=torch.float, device=self.device).unsqueeze(1)
-            lstm_out_pool = lstm_out.sum(1).squeeze(1)
-            lens_sum = len_sum.repeat(1, lstm_out.size(2))
-            lstm_out_pool = lstm_out_pool / lens_sum
-        elif self.pooling == 'max':
-            max_len = max(lens)
-            mask = [
-                ([0] * l) + ([1] * (max_len - l))
-                for l in lens
-                ]
-            mask = torch.tensor(mask, dtype=torch.uint8, device=self.device)
-            mask = mask.unsqueeze(2).repeat(1, 1, lstm_out.size(2))
-            #lstm_out.data.masked_fill_(mask, -float('inf'))
-            lstm_out_pool = lstm_out.max(1)[0].squeeze(1)
+        if isinstance(lstm_out, rnn_utils.PackedSequence):
+            lstm_out_pool = packed_pooling(lstm_out, self.pooling)
+        else:
+            if masks is None:
+                masks = length_masks(lens, lstm_out.size(1), lstm_out.device)
+            lstm_out_pool = masked_pooling(lstm_out, masks, self.pooling)
         class_space = self.hidden2class(self.dropout_layer(lstm_out_pool))
         if self.multi_class:
-            class_scores = torch.sigmoid(class_space)
+            class_scores = torch.sigmoid(class_space.float())
             if type(masked_output) != type(None):
                 class_scores.index_fill_(1, masked_output, 0)
         else:
-            class_scores = F.log_softmax(class_space, dim=1)
+            class_scores = F.log_softmax(class_space.float(), dim=1)
         
         return class_scores
     
@@ -234,9 +263,10 @@ class sntClassifier_hiddenCNN(nn.Module):
         for weight in self.hidden2class.parameters():
             weight.data.uniform_(-initrange, initrange)
         
-    def forward(self, inputs, masked_output=None):
+    def forward(self, inputs, masked_output=None, masks=None):
         '''
         lstm_out : bsize x seqlen x hsize
+        masks : unused, the convolution reads the zero padding of lstm_out
         '''
         lstm_out, lens = inputs
         hiddens = lstm_out.transpose(1, 2)
@@ -259,11 +289,11 @@ class sntClassifier_hiddenCNN(nn.Module):
         conv_hiddens_pool = self.batchnorm(conv_hiddens_pool)
         class_space = self.hidden2class(self.dropout_layer(conv_hiddens_pool))
         if self.multi_class:
-            class_scores = torch.sigmoid(class_space)
+            class_scores = torch.sigmoid(class_space.float())
             if type(masked_output) != type(None):
                 class_scores.index_fill_(1, masked_output, 0)
         else:
-            class_scores = F.log_softmax(class_space, dim=1)
+            class_scores = F.log_softmax(class_space.float(), dim=1)
         
         return class_scores
     
@@ -311,17 +341,22 @@ class sntClassifier_hiddenAttention(nn.Module):
         self.hidden2class.weight.data.uniform_(-initrange, initrange)
         self.hidden2class.bias.data.uniform_(-initrange, initrange)
         
-    def forward(self, inputs, masked_output=None):
+    def forward(self, inputs, masked_output=None, masks=None):
         '''
-        lstm_out : bsize x seqlen x hsize
+        lstm_out : bsize x seqlen x hsize, or a PackedSequence (lens is then unused)
+        masks : bsize x seqlen bool mask of the real tokens, built from lens if None
         '''
         packed_h_t_c_t, lstm_out, lens = inputs
+        if isinstance(lstm_out, rnn_utils.PackedSequence):
+            lstm_out, lens = rnn_utils.pad_packed_sequence(lstm_out, batch_first=True)
+            masks = None
+        if masks is None:
+            masks = length_masks(lens, lstm_out.size(1), lstm_out.device)
         enc_h_t, enc_c_t = packed_h_t_c_t
         if self.bidirectional:
-            index_slices = [2 * self.num_layers - 1]  # generated from the reversed path
-            index_slices = torch.tensor(index_slices, dtype=torch.long, device=self.device)
-            h_t = torch.index_select(enc_h_t, 0, index_slices)
-            c_t = torch.index_select(enc_c_t, 0, index_slices)
+            # generated from the reversed path of the last layer
+            h_t = enc_h_t[-1:]
+            c_t = enc_c_t[-1:]
         else:
             h_t = enc_h_t
             c_t = enc_c_t
@@ -332,28 +367,21 @@ class sntClassifier_hiddenAttention(nn.Module):
         #c1 = self.Wa2(self.dropout_layer(c1))
         c2 = self.Ua(self.dropout_layer(hiddens))
 
-        c3 = c1.unsqueeze(2).repeat(1, 1, lstm_out.size(1))
-        c4 = torch.tanh(c3 + c2)
+        c4 = torch.tanh(c1.unsqueeze(2) + c2)
 
         e = self.Va(c4).squeeze(1)
-        max_len = max(lens)
-        mask = [
-            ([0] * l) + ([1] * (max_len - l))
-            for l in lens
-            ]
-        mask = torch.tensor(mask, dtype=torch.uint8, device=self.device)
-        e.masked_fill_(mask, -float('inf'))
-        a = F.softmax(e, dim=1)
+        e = e.masked_fill(~masks, -float('inf'))
+        a = F.softmax(e.float(), dim=1)
 
         context_hidden = torch.bmm(hiddens, a.unsqueeze(2)).squeeze(2)
 
         class_space = self.hidden2class(self.dropout_layer(context_hidden))
         if self.multi_class:
-            class_scores = torch.sigmoid(class_space)
+            class_scores = torch.sigmoid(class_space.float())
             if type(masked_output) != type(None):
                 class_scores.index_fill_(1, masked_output, 0)
         else:
-            class_scores = F.log_softmax(class_space, dim=1)
+            class_scores = F.log_softmax(class_space.float(), dim=1)
         
         return class_scores
     
@@ -0,0 +1,59 @@
+#!/bin/bash
+
+# float32 vs bfloat16 autocast (--bf16) on CPU: training throughput and best valid/test F1
+# of LSTMTagger, LSTMTagger_CRF and the pure transformer model on ATIS and SNIPS.
+# usage: bash run/benchmark_bf16.sh [max_epoch]
+
+source ./path.sh
+
+max_epoch=${1:-10}
+device=-1 # cpu
+experiment_output_path=exp_benchmark_bf16
+
+task_intent_detection=hiddenAttention # for LSTMTagger and LSTMTagger_CRF
+transformer_task_intent_detection=CLS
+pretrained_model_type=bert
+pretrained_model_name=bert-base-uncased
+
+precision_flag() {
+  if [[ $1 == bf16 ]]; then
+    echo --bf16
+  fi
+}
+
+run_lstm() {
+  # $1: dataset, $2: dataroot, $3: task_st, $4: precision
+  python scripts/slot_tagging_and_intent_detection.py --task_st $3 --task_sc $task_intent_detection --dataset $1 --dataroot $2 --bidirectional --lr 0.001 --dropout 0.5 --batchSize 20 --optim adam --max_norm 5 --experiment $experiment_output_path/$1/$3/$4 --deviceId $device --max_epoch $max_epoch --emb_size 100 --hidden_size 200 --num_layers 1 --st_weight 0.5 --noStdout $(precision_flag $4)
+}
+
+run_transformer() {
+  # $1: dataset, $2: dataroot, $3: task_st, $4: precision
+  python scripts/slot_tagging_and_intent_detection_with_pure_transformer.py --task_st $3 --task_sc $transformer_task_intent_detection --dataset $1 --dataroot $2 --lr 5e-5 --dropout 0.1 --batchSize 32 --optim bertadam --max_norm 1 --experiment $experiment_output_path/$1/$3/$4 --deviceId $device --max_epoch $max_epoch --st_weight 0.5 --pretrained_model_type ${pretrained_model_type} --pretrained_model_name ${pretrained_model_name} --noStdout $(precision_flag $4)
+}
+
+summarize() {
+  # mean training throughput over the epochs, and the BEST RESULT line of log_train.txt
+  log=$(ls -t $(find $experiment_output_path/$1/$3/$4 -name log_train.txt) | head -1)
+  throughput=$(grep "Throughput:" $log | awk -F'\t' '{split($3, a, " "); s += a[1]; n += 1} END {if (n > 0) printf "%.1f", s / n}')
+  f1=$(grep "BEST RESULT" $log | sed -e 's/.*best valid P: [0-9.]*, R: [0-9.]*, F1 : \([0-9.]*\); cls-P: [0-9.]*, cls-R: [0-9.]*, cls-F1 : \([0-9.]*\)).*best test P: [0-9.]*, R: [0-9.]*, F1 : \([0-9.]*\); cls-P: [0-9.]*, cls-R: [0-9.]*, cls-F1 : \([0-9.]*\)).*/\1\t\2\t\3\t\4/')
+  echo -e "$1\t$3\t$4\t${throughput}\t${f1}"
+}
+
+results=()
+for data in atis:data/atis-2 snips:data/snips; do
+  dataset=${data%%:*}
+  dataroot=${data#*:}
+  for precision in fp32 bf16; do
+    run_lstm $dataset $dataroot slot_tagger $precision
+    results+=("$(summarize $dataset $dataroot slot_tagger $precision)")
+    run_lstm $dataset $dataroot slot_tagger_with_crf $precision
+    results+=("$(summarize $dataset $dataroot slot_tagger_with_crf $precision)")
+    run_transformer $dataset $dataroot NN $precision
+    results+=("$(summarize $dataset $dataroot NN $precision)")
+  done
+done
+
+echo -e "dataset\tmodel\tprecision\tsentences/s\tvalid F1\tvalid cls-F1\ttest F1\ttest cls-F1"
+for line in "${results[@]}"; do
+  echo -e "$line"
+done
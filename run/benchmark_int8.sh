@@ -0,0 +1,66 @@
+#!/bin/bash
+
+# float32 vs dynamic int8 quantization (--quantize_int8) on CPU: test F1, decoding latency and model size
+# of LSTMTagger, LSTMTagger_focus, LSTMTagger_CRF (with the hiddenAttention classifier) and the pure transformer model
+# on ATIS and SNIPS. Models are trained first, unless they already exist in the experiment path.
+# usage: bash run/benchmark_int8.sh [max_epoch]
+
+source ./path.sh
+
+max_epoch=${1:-10}
+device=-1 # cpu
+experiment_output_path=exp_benchmark_int8
+
+task_intent_detection=hiddenAttention # for the LSTM taggers
+transformer_task_intent_detection=CLS
+pretrained_model_type=bert
+pretrained_model_name=bert-base-uncased
+
+lstm_args() {
+  # $1: dataset, $2: dataroot, $3: task_st
+  echo --task_st $3 --task_sc $task_intent_detection --dataset $1 --dataroot $2 --bidirectional --lr 0.001 --dropout 0.5 --batchSize 20 --optim adam --max_norm 5 --deviceId $device --max_epoch $max_epoch --emb_size 100 --hidden_size 200 --num_layers 1 --st_weight 0.5 --noStdout
+}
+
+transformer_args() {
+  # $1: dataset, $2: dataroot, $3: task_st
+  echo --task_st $3 --task_sc $transformer_task_intent_detection --dataset $1 --dataroot $2 --lr 5e-5 --dropout 0.1 --batchSize 32 --optim bertadam --max_norm 1 --deviceId $device --max_epoch $max_epoch --st_weight 0.5 --pretrained_model_type ${pretrained_model_type} --pretrained_model_name ${pretrained_model_name} --noStdout
+}
+
+model_size() {
+  # total size (MB) of the model files <prefix>, <prefix>.tag and <prefix>.class
+  ls -l $1 $1.tag $1.class 2>/dev/null | awk '{s += $5} END {printf "%.1f", s / 1024 / 1024}'
+}
+
+summarize() {
+  # $1: dataset, $2: dataroot, $3: task_st, $4: precision, $5: log_test.txt, $6: model files
+  sentence_num=$(grep -c . $2/test)
+  echo -e "$1\t$3\t$4\t$(model_size $6)\t$(grep "^Evaluation:" $5 | sed -e 's/.*Time : \([0-9.]*\)s.*Fscore : \([0-9.]*\).*cls-F1 : \([0-9.]*\).*/\1\t\2\t\3/' | awk -F'\t' -v n=$sentence_num '{printf "%.3f\t%s\t%s", $1 * 1000 / n, $2, $3}')"
+}
+
+benchmark() {
+  # $1: dataset, $2: dataroot, $3: task_st, $4: script, $5: arguments
+  exp=$experiment_output_path/$1/$3
+  if [[ -z $(find $exp/train -name log_train.txt 2>/dev/null) ]]; then
+    python $4 $5 --experiment $exp/train
+  fi
+  model_dir=$(dirname $(find $exp/train -name log_train.txt | head -1))
+  python $4 $5 --testing --read_model $model_dir/model --read_vocab $model_dir/vocab --out_path $exp/fp32
+  python $4 $5 --testing --read_model $model_dir/model --read_vocab $model_dir/vocab --out_path $exp/int8 --quantize_int8
+  results+=("$(summarize $1 $2 $3 fp32 $exp/fp32/log_test.txt $model_dir/model)")
+  results+=("$(summarize $1 $2 $3 int8 $exp/int8/log_test.txt $exp/int8/model.int8)")
+}
+
+results=()
+for data in atis:data/atis-2 snips:data/snips; do
+  dataset=${data%%:*}
+  dataroot=${data#*:}
+  for task_slot_filling in slot_tagger slot_tagger_with_focus slot_tagger_with_crf; do
+    benchmark $dataset $dataroot $task_slot_filling scripts/slot_tagging_and_intent_detection.py "$(lstm_args $dataset $dataroot $task_slot_filling)"
+  done
+  benchmark $dataset $dataroot NN scripts/slot_tagging_and_intent_detection_with_pure_transformer.py "$(transformer_args $dataset $dataroot NN)"
+done
+
+echo -e "dataset\tmodel\tprecision\tmodel MB\ttest ms/sentence\ttest F1\ttest cls-F1"
+for line in "${results[@]}"; do
+  echo -e "$line"
+done
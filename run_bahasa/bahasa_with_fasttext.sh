@@ -7,6 +7,7 @@ task_intent_detection=hiddenAttention # none, hiddenAttention, hiddenCNN, maxPoo
 balance_weight=0.5
 
 cased_word_vectors=./local/word_embeddings/cc.id.300.vec
+#cased_word_vectors=./local/word_embeddings/cc.id.300.npy # binary, by: python scripts/convert_word2vec_to_bin.py --in_word2vec ./local/word_embeddings/cc.id.300.vec --out_prefix ./local/word_embeddings/cc.id.300
 #cased_word_vectors=./local/word_embeddings/glove-kazumachar_400_cased_for_atis.txt
 read_word2vec_inText=${cased_word_vectors}
 word_lowercase=false
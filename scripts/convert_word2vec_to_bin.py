@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+'''
+@Desc   : convert a word2vec text file (e.g. fastText cc.id.300.vec) into
+          out_prefix.vocab + out_prefix.npy, which can be memory-mapped by
+          utils/read_wordEmb.read_word2vec_inBin and passed to --read_input_word2vec
+'''
+
+import os, sys
+import argparse
+import time
+
+install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(install_path)
+
+import utils.read_wordEmb as read_wordEmb
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--in_word2vec', required=True, help='word2vec file in text format')
+    parser.add_argument('--out_prefix', required=True, help='write out_prefix.vocab and out_prefix.npy')
+    parser.add_argument('--dtype', default='float32', help='float32 | float16')
+    args = parser.parse_args()
+
+    assert args.dtype in {'float32', 'float16'}
+    start_time = time.time()
+    word_num, emb_dim = read_wordEmb.convert_word2vec_inText_to_bin(args.in_word2vec, args.out_prefix, dtype=args.dtype)
+    print('%d words x %d dims (%s) are converted in %.2f (sec)' % (word_num, emb_dim, args.dtype, time.time() - start_time))
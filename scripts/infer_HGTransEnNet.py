@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+'''
+@Desc   : inductive inference of a trained HGTransEnNet (HGTransEnNet.pt saved by scripts/train_HGTransEnNet.py):
+          new sentences are attached to the hyperedges of their k nearest training sentences and embedded
+          from the cached hyperedge features, without rebuilding the hypergraph or retraining.
+          The features of the new sentences must be built like X_in of the training (e.g. X_1d rows).
+'''
+
+import os, sys
+import argparse
+import numpy as np
+import torch
+
+install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(install_path)
+sys.path.append(os.path.join(install_path, 'models'))
+
+from models.hyedge import neighbor_attach
+from models.HGTransEnNet import HGTransEnNet
+
+class RowView(object):
+    '''rows x_rows of a (memory-mapped) feature matrix, read chunk by chunk'''
+    def __init__(self, X, rows):
+        self.X, self.rows = X, rows
+    def __len__(self):
+        return len(self.rows)
+    def __getitem__(self, item):
+        return np.asarray(self.X[self.rows[item]], dtype=np.float32)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='HGTransEnNet.pt')
+    parser.add_argument('--features', required=True, help='.npy, M x in_ch features of the new sentences')
+    parser.add_argument('--out_prefix', required=True, help='write out_prefix.emb.npy (hidden embeddings) and out_prefix.intent.npy')
+    parser.add_argument('--k', type=int, default=5, help='number of nearest training sentences')
+    parser.add_argument('--deviceId', type=int, default=-1, help='run on ith gpu. -1:cpu')
+    args = parser.parse_args()
+
+    device = torch.device('cuda:%d' % args.deviceId if args.deviceId >= 0 and torch.cuda.is_available() else 'cpu')
+    checkpoint = torch.load(args.model, map_location=device, weights_only=False)
+    model = HGTransEnNet(checkpoint['in_ch'], checkpoint['n_class'], hiddens=checkpoint['hiddens'])
+    model.load_state_dict(checkpoint['model'])
+    model = model.to(device).eval()
+    hyedge_fts = [ft.to(device) for ft in checkpoint['hyedge_fts']]
+
+    X_in = np.load(checkpoint['x_in_path'], mmap_mode='r')
+    X_train = RowView(X_in.reshape(X_in.shape[0], -1), checkpoint['x_rows'])
+    x_new = torch.from_numpy(np.array(np.load(args.features, mmap_mode='r'), dtype=np.float32)).to(device)
+    x_new = x_new.reshape(x_new.size(0), -1)
+    H_new = neighbor_attach(x_new, X_train, checkpoint['H'], args.k)
+    pred, hidden = model.forward_inductive(H_new, hyedge_fts)
+
+    np.save(args.out_prefix + '.emb.npy', hidden.cpu().numpy())
+    np.save(args.out_prefix + '.intent.npy', pred.max(1)[1].cpu().numpy())
+    print('%d sentences are embedded into %s.emb.npy' % (x_new.size(0), args.out_prefix))
@@ -6,7 +6,6 @@ import torch.optim as optim
 import numpy as np
 import os, sys, time
 import logging
-import gc
 
 install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(install_path)
@@ -20,7 +19,7 @@ import utils.vocab_reader as vocab_reader
 import utils.data_reader as data_reader
 import utils.read_wordEmb as read_wordEmb
 import utils.util as util
-import utils.acc as acc
+import utils.train_engine as train_engine
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--task_st', required=True,
@@ -65,6 +64,8 @@ parser.add_argument('--max_norm', type=float, default=5, help="threshold of grad
 parser.add_argument('--max_epoch', type=int, default=50, help='max number of epochs to train for')
 parser.add_argument('--experiment', default='exp', help='Where to store samples and models')
 parser.add_argument('--optim', default='sgd', help='choose an optimizer')
+parser.add_argument('--prefetch_batches', type=int, default=2, help='number of minibatches built ahead in a background thread, 0: no prefetching')
+parser.add_argument('--bf16', action='store_true', help='run the forward passes of training and decoding under bfloat16 autocast (CRF and softmax layers stay in float32)')
 
 opt = parser.parse_args()
 
@@ -274,266 +275,29 @@ elif opt.optim.lower() == 'adadelta':
 elif opt.optim.lower() == 'rmsprop':
     optimizer = optim.RMSprop(params, lr=opt.lr)
 
-def decode(sen_feats, data_feats, data_tags, data_class, output_path):
-    data_index = np.arange(len(data_feats))
-    losses = []
-    TP, FP, FN, TN = 0.0, 0.0, 0.0, 0.0
-    TP2, FP2, FN2, TN2 = 0.0, 0.0, 0.0, 0.0
-    with open(output_path, 'w') as f:
-        for j in range(0, len(data_index), opt.test_batchSize):
-            if opt.testing:
-                inputs, tags, raw_tags, classes, raw_classes, lens, line_nums = data_reader.get_minibatch_with_class(
-                    data_feats, data_tags, data_class, word_to_idx, tag_to_idx, class_to_idx, data_index, j,
-                    opt.test_batchSize, add_start_end=False, multiClass=opt.multiClass, keep_order=opt.testing,
-                    enc_dec_focus=False, device=opt.device)
-                input_sens = data_reader.get_sen_minibatch(sen_feats, train_data_index, j, opt.batchSize, device=opt.device)
-            else:
-                inputs, tags, raw_tags, classes, raw_classes, lens = data_reader.get_minibatch_with_class(data_feats,
-                                                                                                          data_tags,
-                                                                                                          data_class,
-                                                                                                          word_to_idx,
-                                                                                                          tag_to_idx,
-                                                                                                          class_to_idx,
-                                                                                                          data_index, j,
-                                                                                                          opt.test_batchSize,
-                                                                                                          add_start_end=False,
-                                                                                                          multiClass=opt.multiClass,
-                                                                                                          keep_order=opt.testing,
-                                                                                                          enc_dec_focus=False,
-                                                                                                          device=opt.device)
-                input_sens = data_reader.get_sen_minibatch(sen_feats, data_index, j, opt.batchSize, device=opt.device)
-
-            if opt.crf:
-                max_len = max(lens)
-                masks = [([1] * l) + ([0] * (max_len - l)) for l in lens]
-                masks = torch.tensor(masks, dtype=torch.uint8, device=opt.device)
-
-                crf_feats, encoder_info = model_tag._get_lstm_features(input_sens, lens, with_snt_classifier=True)
-                tag_path_scores, tag_path = model_tag.forward(crf_feats, masks)
-                tag_loss = model_tag.neg_log_likelihood(crf_feats, masks, tags)
-                top_pred_slots = tag_path.data.cpu().numpy()
-            else:
-                tag_scores, encoder_info = model_tag(inputs, lens, with_snt_classifier=True)
-                tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)), tags.view(-1))
-                top_pred_slots = tag_scores.data.cpu().numpy().argmax(axis=-1)
-                # tags = tags.data.cpu().numpy()
-            if opt.task_sc:
-                class_scores = model_class(encoder_info_filter(encoder_info))
-                class_loss = class_loss_function(class_scores, classes)
-                if opt.multiClass:
-                    snt_probs = class_scores.data.cpu().numpy()
-                else:
-                    snt_probs = class_scores.data.cpu().numpy().argmax(axis=-1)
-                losses.append([tag_loss.item() / sum(lens), class_loss.item() / len(lens)])
-            else:
-                losses.append([tag_loss.item() / sum(lens), 0])
-
-            inputs = inputs.data.cpu().numpy()
-            # classes = classes.data.cpu().numpy()
-            for idx, pred_line in enumerate(top_pred_slots):
-                length = lens[idx]
-                pred_seq = [idx_to_tag[tag] for tag in pred_line][:length]
-                lab_seq = [idx_to_tag[tag] if type(tag) == int else tag for tag in raw_tags[idx]]
-                pred_chunks = acc.get_chunks(['O'] + pred_seq + ['O'])
-                label_chunks = acc.get_chunks(['O'] + lab_seq + ['O'])
-                for pred_chunk in pred_chunks:
-                    if pred_chunk in label_chunks:
-                        TP += 1
-                    else:
-                        FP += 1
-                for label_chunk in label_chunks:
-                    if label_chunk not in pred_chunks:
-                        FN += 1
-
-                input_line = [idx_to_word[word] for word in inputs[idx]][:length]
-                word_tag_line = [input_line[_idx] + ':' + lab_seq[_idx] + ':' + pred_seq[_idx] for _idx in
-                                 range(len(input_line))]
-
-                if opt.task_sc:
-                    if opt.multiClass:
-                        pred_classes = [idx_to_class[i] for i, p in enumerate(snt_probs[idx]) if p > 0.5]
-                        gold_classes = [idx_to_class[i] for i in raw_classes[idx]]
-                        for pred_class in pred_classes:
-                            if pred_class in gold_classes:
-                                TP2 += 1
-                            else:
-                                FP2 += 1
-                        for gold_class in gold_classes:
-                            if gold_class not in pred_classes:
-                                FN2 += 1
-                        gold_class_str = ';'.join(gold_classes)
-                        pred_class_str = ';'.join(pred_classes)
-                    else:
-                        pred_class = idx_to_class[snt_probs[idx]]
-                        if type(raw_classes[idx]) == int:
-                            gold_classes = {idx_to_class[raw_classes[idx]]}
-                        else:
-                            gold_classes = set(raw_classes[idx])
-                        if pred_class in gold_classes:
-                            TP2 += 1
-                        else:
-                            FP2 += 1
-                            FN2 += 1
-                        gold_class_str = ';'.join(list(gold_classes))
-                        pred_class_str = pred_class
-                else:
-                    gold_class_str = ''
-                    pred_class_str = ''
-
-                if opt.testing:
-                    f.write(str(line_nums[idx]) + ' : ' + ' '.join(
-                        word_tag_line) + ' <=> ' + gold_class_str + ' <=> ' + pred_class_str + '\n')
-                else:
-                    f.write(' '.join(word_tag_line) + ' <=> ' + gold_class_str + ' <=> ' + pred_class_str + '\n')
-
-    if TP == 0:
-        p, r, f = 0, 0, 0
-    else:
-        p, r, f = 100 * TP / (TP + FP), 100 * TP / (TP + FN), 100 * 2 * TP / (2 * TP + FN + FP)
-
-    if TP2 == 0:
-        cp, cr, cf = 0, 0, 0
-    else:
-        cp, cr, cf = 100 * TP2 / (TP2 + FP2), 100 * TP2 / (TP2 + FN2), 100 * 2 * TP2 / (2 * TP2 + FN2 + FP2)
+def get_batch(data, data_index, j, batch_size):
+    data_feats, data_tags, data_class, sen_feats = data
+    minibatch = data_reader.get_minibatch_with_class(data_feats, data_tags, data_class, word_to_idx, tag_to_idx, class_to_idx, data_index, j, batch_size, add_start_end=False, multiClass=opt.multiClass, keep_order=opt.testing, enc_dec_focus=False, device=opt.device)
+    batch = dict(zip(('inputs', 'tags', 'raw_tags', 'classes', 'raw_classes', 'lens', 'line_nums'), minibatch))
+    batch['words'] = batch['inputs']
+    input_sens, _ = data_reader.get_sen_minibatch(sen_feats, data_index, j, batch_size, device=opt.device)
+    if opt.crf:
+        batch['inputs'] = input_sens
+    return batch
+
+def save_model():
+    model_tag.save_model(os.path.join(exp_path, opt.save_model+'.tag'))
+    if opt.task_sc:
+        model_class.save_model(os.path.join(exp_path, opt.save_model+'.class'))
 
-    mean_losses = np.mean(losses, axis=0)
-    return mean_losses, p, r, f, cp, cr, cf  # 0 if 2*TP2+FN2+FP2 == 0 else 100*2*TP2/(2*TP2+FN2+FP2)
+model_step = train_engine.TaggerClassifierStep(model_tag, model_class if opt.task_sc else None, encoder_info_filter if opt.task_sc else None, tag_loss_function, enc_dec=False, crf=opt.crf, device=opt.device)
+evaluator = train_engine.SlotIntentEvaluator(idx_to_tag, idx_to_class, multiClass=opt.multiClass, task_sc=opt.task_sc, idx_to_word=idx_to_word)
+engine = train_engine.TrainingEngine(opt, [model_tag, model_class] if opt.task_sc else [model_tag], model_step, get_batch, evaluator, logger,
+                                     optimizer=optimizer, params=params, class_loss_function=class_loss_function if opt.task_sc else None,
+                                     save_model=save_model, max_norm=opt.max_norm, prefetch_batches=opt.prefetch_batches, autocast_dtype=torch.bfloat16 if opt.bf16 else None, device=opt.device)
 
 # training mode
 if not opt.testing:
-    logger.info("Training starts at %s" % (time.asctime(time.localtime(time.time()))))
-    train_data_index = np.arange(len(train_sen_feats))
-    best_f1, best_result = -1, {}
-
-    for i in range(opt.max_epoch):
-        start_time = time.time()
-        losses = []
-        # training data shuffle
-        np.random.shuffle(train_data_index)
-        model_tag.train()
-        if opt.task_sc:
-            model_class.train()
-
-        nsentences = len(train_data_index)
-        piece_sentences = opt.batchSize if int(nsentences * 0.1 / opt.batchSize) == 0 else int(
-            nsentences * 0.1 / opt.batchSize) * opt.batchSize
-        for j in range(0, nsentences, opt.batchSize):
-            inputs, tags, raw_tags, classes, raw_classes, lens = data_reader.get_minibatch_with_class(
-                train_feats['data'], train_tags['data'], train_class['data'], word_to_idx, tag_to_idx, class_to_idx,
-                train_data_index, j, opt.batchSize, add_start_end=False, multiClass=opt.multiClass,
-                enc_dec_focus=False, device=opt.device)
-            input_sens = data_reader.get_sen_minibatch(train_sen_feats, train_data_index, j, opt.batchSize, device=opt.device)
-
-            if opt.crf:
-                max_len = max(lens)
-                masks = [([1] * l) + ([0] * (max_len - l)) for l in lens]
-                masks = torch.tensor(masks, dtype=torch.uint8, device=opt.device)
-
-                crf_feats, encoder_info = model_tag._get_lstm_features(input_sens, lens, with_snt_classifier=True)
-                tag_loss = model_tag.neg_log_likelihood(crf_feats, masks, tags)
-            else:
-                tag_scores, encoder_info = model_tag(inputs, lens, with_snt_classifier=True)
-                tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)), tags.view(-1))
-
-            if opt.task_sc:
-                class_scores = model_class(encoder_info_filter(encoder_info))
-                class_loss = class_loss_function(class_scores, classes)
-                losses.append([tag_loss.item() / sum(lens), class_loss.item() / len(lens)])
-                total_loss = opt.st_weight * tag_loss + (1 - opt.st_weight) * class_loss
-            else:
-                losses.append([tag_loss.item() / sum(lens), 0])
-                total_loss = tag_loss
-            total_loss.backward()
-
-            # Clips gradient norm of an iterable of parameters.
-            if opt.max_norm > 0:
-                torch.nn.utils.clip_grad_norm_(params, opt.max_norm)
-
-            optimizer.step()
-
-            if j % piece_sentences == 0:
-                print('[learning] epoch %i >> %2.2f%%' % (i, (j + opt.batchSize) * 100. / nsentences),
-                      'completed in %.2f (sec) <<\r' % (time.time() - start_time), end='')
-                sys.stdout.flush()
-
-        mean_loss = np.mean(losses, axis=0)
-        logger.info('Training:\tEpoch : %d\tTime : %.4fs\tLoss of tag : %.2f\tLoss of class : %.2f ' % (
-            i, time.time() - start_time, mean_loss[0], mean_loss[1]))
-        gc.collect()
-
-        model_tag.eval()
-        if opt.task_sc:
-            model_class.eval()
-        # Evaluation
-        start_time = time.time()
-
-        loss_val, p_val, r_val, f_val, cp_val, cr_val, cf_val = decode(valid_sen_feats, valid_feats['data'],
-                                                                       valid_tags['data'],
-                                                                       valid_class['data'],
-                                                                       os.path.join(exp_path,
-                                                                                    'valid.iter' + str(i)))
-        logger.info(
-            'Validation:\tEpoch : %d\tTime : %.4fs\tLoss : (%.2f, %.2f)\tP: %.2f, R: %.2f, Fscore : %.2f\tcls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f ' % (
-                i, time.time() - start_time, loss_val[0], loss_val[1], p_val, r_val, f_val, cp_val, cr_val, cf_val))
-        start_time = time.time()
-        loss_te, p_te, r_te, f_te, cp_te, cr_te, cf_te = decode(test_sen_feats, test_feats['data'],
-                                                                test_tags['data'],
-                                                                test_class['data'],
-                                                                os.path.join(exp_path, 'test.iter' + str(i)))
-        logger.info(
-            'Evaluation:\tEpoch : %d\tTime : %.4fs\tLoss : (%.2f, %.2f)\tP: %.2f, R: %.2f, Fscore : %.2f\tcls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f ' % (
-                i, time.time() - start_time, loss_te[0], loss_te[1], p_te, r_te, f_te, cp_te, cr_te, cf_te))
-
-        if opt.task_sc:
-            val_f1_score = (opt.st_weight * f_val + (1 - opt.st_weight) * cf_val)
-        else:
-            val_f1_score = f_val
-        if best_f1 < val_f1_score:
-            model_tag.save_model(os.path.join(exp_path, opt.save_model + '.tag'))
-            if opt.task_sc:
-                model_class.save_model(os.path.join(exp_path, opt.save_model + '.class'))
-            best_f1 = val_f1_score
-            logger.info(
-                'NEW BEST:\tEpoch : %d\tbest valid P: %.2f, R: %.2f, F1 : %.2f, cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f;\ttest P: %.2f, R: %.2f, F1 : %.2f, cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f' % (
-                    i, p_val, r_val, f_val, cp_val, cr_val, cf_val, p_te, r_te, f_te, cp_te, cr_te, cf_te))
-            best_result['iter'] = i
-            best_result['vp'], best_result['vr'], best_result['vf1'], best_result['vcp'], best_result['vcr'], \
-            best_result['vcf1'], best_result['vce'] = p_val, r_val, f_val, cp_val, cr_val, cf_val, loss_val
-            best_result['tp'], best_result['tr'], best_result['tf1'], best_result['tcp'], best_result['tcr'], \
-            best_result['tcf1'], best_result['tce'] = p_te, r_te, f_te, cp_te, cr_te, cf_te, loss_te
-
-    # logger.info(
-    #     'BEST RESULT: \tEpoch : %d\tbest valid P: %.2f, R: %.2f, F1 : %.2f; cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f)' % (
-    #     best_result['iter'], best_result['vp'], best_result['vr'], best_result['vf1'], best_result['vcp'],
-    #     best_result['vcr'], best_result['vcf1']))
-
-    logger.info(
-        'BEST RESULT: \tEpoch : %d\tbest valid P: %.2f, R: %.2f, F1 : %.2f; cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f)\tbest test P: %.2f, R: %.2f, F1 : %.2f; cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f) ' % (
-            best_result['iter'], best_result['vp'], best_result['vr'], best_result['vf1'], best_result['vcp'],
-            best_result['vcr'], best_result['vcf1'], best_result['tp'], best_result['tr'], best_result['tf1'],
-            best_result['tcp'], best_result['tcr'], best_result['tcf1']))
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    engine.fit((train_feats['data'], train_tags['data'], train_class['data'], train_sen_feats),
+               (valid_feats['data'], valid_tags['data'], valid_class['data'], valid_sen_feats),
+               (test_feats['data'], test_tags['data'], test_class['data'], test_sen_feats), exp_path)
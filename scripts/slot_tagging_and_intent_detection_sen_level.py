@@ -6,7 +6,6 @@ import torch.optim as optim
 import numpy as np
 import os, sys, time
 import logging
-import gc
 
 install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(install_path)
@@ -21,8 +20,10 @@ import utils.word_features as word_features
 import utils.vocab_reader as vocab_reader
 import utils.data_reader as data_reader
 import utils.read_wordEmb as read_wordEmb
+import utils.sen_bank as sen_bank
+import utils.sparse_optimizer as sparse_optimizer
 import utils.util as util
-import utils.acc as acc
+import utils.train_engine as train_engine
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--task_st', required=True,
@@ -48,12 +49,16 @@ parser.add_argument('--testing', action='store_true', help='Only test your model
 parser.add_argument('--read_model', required=False, help='Online test: read model from this file')
 parser.add_argument('--read_vocab', required=False, help='Online test: read input vocab from this file')
 parser.add_argument('--out_path', required=False, help='Online test: out_path')
-parser.add_argument('--read_input_word2vec', required=False, help='read word embedding from word2vec file')
+parser.add_argument('--read_input_word2vec', required=False, help='read word embedding from word2vec file (text, or binary *.npy converted by scripts/convert_word2vec_to_bin.py)')
 parser.add_argument('--fix_input_word2vec', action='store_true', help='fix word embedding from word2vec file')
+parser.add_argument('--word2vec_lowercase_backoff', action='store_true', help='words without pre-trained embedding take the embedding of their lowercase match')
+parser.add_argument('--sparse_word_embedding', action='store_true', help='sparse gradients of word embeddings, which are updated by SparseAdam (--optim adam) or SGD (--optim sgd)')
 
 parser.add_argument('--read_input_sen2vec', required=False, help='read sentence embedding from sen2vec file')
 parser.add_argument('--fix_input_sen2vec', action='store_true', help='fix sentence embedding from sen2vec file')
-parser.add_argument('--read_sen_bank', required=False, help='read sentence bank from sentences file')
+parser.add_argument('--sen2vec_memmap', action='store_true', help='keep sentence embedding in a read-only memory-mapped array (fixed, gathered per batch)')
+parser.add_argument('--length_bucketing', action='store_true', help='batch training sentences of similar length together (less padding)')
+parser.add_argument('--read_sen_bank', required=False, help='read sentence bank from sentences file (indexed into read_input_sen2vec + ".index" at the first use)')
 parser.add_argument('--sen_max_len', type=int, default=76, help='max length of sentence in sentence bank from sentences file')
 
 
@@ -79,6 +84,8 @@ parser.add_argument('--max_norm', type=float, default=5, help="threshold of grad
 parser.add_argument('--max_epoch', type=int, default=50, help='max number of epochs to train for')
 parser.add_argument('--experiment', default='exp', help='Where to store samples and models')
 parser.add_argument('--optim', default='sgd', help='choose an optimizer')
+parser.add_argument('--prefetch_batches', type=int, default=2, help='number of minibatches built ahead in a background thread, 0: no prefetching')
+parser.add_argument('--bf16', action='store_true', help='run the forward passes of training and decoding under bfloat16 autocast (CRF and softmax layers stay in float32)')
 
 opt = parser.parse_args()
 
@@ -90,6 +97,7 @@ if opt.test_batchSize == 0:
 assert opt.task_st in {'slot_tagger', 'slot_tagger_with_focus', 'slot_tagger_with_crf', 'slot_tagger_with_crf_sen_level'}
 assert opt.task_sc in {'none', '2tails', 'maxPooling', 'hiddenCNN', 'hiddenAttention'}
 assert opt.sc_type in {'single_cls_CE', 'multi_cls_BCE'}
+assert not opt.sparse_word_embedding or opt.optim.lower() in sparse_optimizer.SPARSE_OPTIMIZERS
 if opt.sc_type == 'multi_cls_BCE':
     opt.multiClass = True
 else:
@@ -126,6 +134,8 @@ if not opt.testing:
         exp_path += '__preEmb_in'
         if opt.fix_input_word2vec:
             exp_path += '_fixed'
+    if opt.sparse_word_embedding:
+        exp_path += '__sparseEmb'
 else:
     exp_path = opt.out_path
 if not os.path.exists(exp_path):
@@ -202,8 +212,10 @@ else:
 
 if not opt.testing and opt.read_input_word2vec:
     # pretrained-embedding initialization for training
-    # read pre-trained word embedding from file
-    ext_word_to_idx, ext_word_emb = read_wordEmb.read_word2vec_inText(opt.read_input_word2vec, opt.device)
+    # read pre-trained word embedding from file, only words of train/valid/test are kept
+    corpus_words = vocab_reader.read_word_set_from_data_files([train_data_dir, valid_data_dir, test_data_dir], lowercase=opt.word_lowercase)
+    ext_word_to_idx, ext_word_emb, backoff_num = read_wordEmb.read_word2vec_restricted(opt.read_input_word2vec, corpus_words, opt.device, backoff_lowercase=opt.word2vec_lowercase_backoff)
+    logger.info("Pre-trained word embedding covers %s / %s words of train/valid/test (%s by lowercase backoff), OOV rate: %.2f%%" % (len(ext_word_to_idx), len(corpus_words), backoff_num, 100. * (len(corpus_words) - len(ext_word_to_idx)) / max(len(corpus_words), 1)))
     for word in ext_word_to_idx:
         # filling pre-trained word to training word dict
         if word not in word_to_idx:
@@ -214,9 +226,14 @@ if not opt.testing and opt.read_input_word2vec:
 # sentence level embedding
 # logger.info(opt.read_input_sen2vec)
 if not opt.testing and opt.read_input_sen2vec:
-    ext_sen_emb = read_wordEmb.read_sen2vec_inText(opt.read_input_sen2vec, opt.device)
+    if opt.sen2vec_memmap:
+        ext_sen_emb = read_wordEmb.read_sen2vec_memmap(opt.read_input_sen2vec)
+    else:
+        ext_sen_emb = read_wordEmb.read_sen2vec_inText(opt.read_input_sen2vec, opt.device)
     ext_sen_size = len(ext_sen_emb)
-    sen2idx = data_reader.read_sen_bank(opt.read_sen_bank)
+    sen2idx = sen_bank.SentenceBank.open(opt.read_input_sen2vec, opt.read_sen_bank)
+    if len(sen2idx) == 0:
+        raise ValueError('the sentence bank of %s is empty, every example would be skipped' % opt.read_input_sen2vec)
     logger.info('Sentence size: %s, sentence_embedding size: %s, sen2idx size: %s' % (ext_sen_size, len(ext_sen_emb), len(sen2idx)))
 
 logger.info("Vocab size: %s %s %s" % (len(word_to_idx), len(tag_to_idx), len(class_to_idx)))
@@ -241,10 +258,19 @@ if not opt.testing:
                                                                                 class_to_idx, multiClass=opt.multiClass,
                                                                                 keep_order=opt.testing,
                                                                                 lowercase=opt.word_lowercase)
-    if opt.read_input_sen2vec and opt.read_sen_bank:
-        train_sen_feats = data_reader.read_sen_feats(train_data_dir, sen2idx)
-        valid_sen_feats = data_reader.read_sen_feats(valid_data_dir, sen2idx)
-        test_sen_feats = data_reader.read_sen_feats(test_data_dir, sen2idx)
+    if opt.read_input_sen2vec:
+        # examples whose sentence is not in the bank yet are skipped, and listed for scripts/update_sen_bank.py
+        unseen_sens = []
+        train_sen_feats = data_reader.read_sen_feats(train_data_dir, sen2idx, missing=unseen_sens)
+        valid_sen_feats = data_reader.read_sen_feats(valid_data_dir, sen2idx, missing=unseen_sens)
+        test_sen_feats = data_reader.read_sen_feats(test_data_dir, sen2idx, missing=unseen_sens)
+        if unseen_sens:
+            train_sen_feats = data_reader.filter_missing_sens(train_sen_feats, train_feats, train_tags, train_class)
+            valid_sen_feats = data_reader.filter_missing_sens(valid_sen_feats, valid_feats, valid_tags, valid_class)
+            test_sen_feats = data_reader.filter_missing_sens(test_sen_feats, test_feats, test_tags, test_class)
+            with open(os.path.join(exp_path, 'unseen_sentences.txt'), 'w', encoding='utf8') as f:
+                f.write(''.join(sen + '\n' for sen in unseen_sens))
+            logger.warning('%s examples skipped, their sentences are not in the sentence bank (see %s)' % (len(unseen_sens), os.path.join(exp_path, 'unseen_sentences.txt')))
 else:
     valid_feats, valid_tags, valid_class = data_reader.read_seqtag_data_with_class(valid_data_dir, word_to_idx,
                                                                                    tag_to_idx, class_to_idx,
@@ -265,13 +291,13 @@ else:
 if opt.task_st == 'slot_tagger':
     model_tag = slot_tagger.LSTMTagger(opt.emb_size, opt.hidden_size, len(word_to_idx), len(tag_to_idx),
                                        bidirectional=opt.bidirectional, num_layers=opt.num_layers, dropout=opt.dropout,
-                                       device=opt.device, extFeats_dim=extFeats_dim)
+                                       device=opt.device, extFeats_dim=extFeats_dim, sparse_embedding=opt.sparse_word_embedding)
 elif opt.task_st == 'slot_tagger_with_focus':
     model_tag = slot_tagger_with_focus.LSTMTagger_focus(opt.emb_size, opt.tag_emb_size, opt.hidden_size,
                                                         len(word_to_idx), len(tag_to_idx),
                                                         bidirectional=opt.bidirectional, num_layers=opt.num_layers,
                                                         dropout=opt.dropout, device=opt.device,
-                                                        extFeats_dim=extFeats_dim)
+                                                        extFeats_dim=extFeats_dim, sparse_embedding=opt.sparse_word_embedding)
 # elif opt.task_st == 'slot_tagger_with_crf':
 #     model_tag = slot_tagger_with_crf.LSTMTagger_CRF(opt.emb_size, opt.hidden_size, len(word_to_idx), len(tag_to_idx),
 #                                                     bidirectional=opt.bidirectional, num_layers=opt.num_layers,
@@ -279,7 +305,8 @@ elif opt.task_st == 'slot_tagger_with_focus':
 elif opt.task_st == 'slot_tagger_with_crf_sen_level':
     model_tag = slot_tagger_with_crf_sen_level.LSTMTagger_CRF_sen_level(opt.emb_size, opt.sen_max_len, ext_sen_size, opt.hidden_size, len(tag_to_idx),
                                                     bidirectional=opt.bidirectional, num_layers=opt.num_layers,
-                                                    dropout=opt.dropout, device=opt.device)
+                                                    dropout=opt.dropout, device=opt.device,
+                                                    frozen_sen_embeddings=ext_sen_emb if opt.sen2vec_memmap else None)
 else:
     exit()
 
@@ -328,19 +355,17 @@ else:
 
     # pretrained-embedding initialization for training
     if opt.read_input_word2vec:
-        word_out_of_pretrained_emb_count = 0
-        for word in word_to_idx:
-            if word in ext_word_to_idx:
-                model_tag.word_embeddings.weight.data[word_to_idx[word]] = ext_word_emb[ext_word_to_idx[word]]
-            else:
-                word_out_of_pretrained_emb_count += 1
+        pretrained_idxs, pretrained_rows = read_wordEmb.select_word2vec_rows(word_to_idx, ext_word_to_idx, ext_word_emb, opt.device)
+        model_tag.word_embeddings.weight.data.index_copy_(0, pretrained_idxs, pretrained_rows)
+        word_out_of_pretrained_emb_count = len(word_to_idx) - len(pretrained_idxs)
         logger.info("${word_out_of_pretrained_emb_count} is %s !" % (word_out_of_pretrained_emb_count))
         if opt.fix_input_word2vec:
             model_tag.word_embeddings.weight.requires_grad = False
     # pretrained_sen_embedding by HG
-    if opt.read_input_sen2vec:
-        for i in range(ext_sen_size):
-            model_tag.sen_embeddings.weight.data[i] = ext_sen_emb[i]
+    if opt.read_input_sen2vec and not opt.sen2vec_memmap:
+        model_tag.sen_embeddings.weight.data.copy_(ext_sen_emb.reshape(ext_sen_size, -1))
+        if opt.fix_input_sen2vec:
+            model_tag.sen_embeddings.weight.requires_grad = False
 
 # loss function
 weight_mask = torch.ones(len(tag_to_idx), device=opt.device)
@@ -358,327 +383,54 @@ params += list(model_tag.parameters())
 if opt.task_sc:
     params += list(model_class.parameters())
 params = list(filter(lambda p: p.requires_grad, params))  # must be list, otherwise clip_grad_norm_ will be invalid
+dense_params, sparse_params = sparse_optimizer.split_sparse_params(params, model_tag)
 if opt.optim.lower() == 'sgd':
-    optimizer = optim.SGD(params, lr=opt.lr)
+    optimizer = optim.SGD(dense_params, lr=opt.lr)
 elif opt.optim.lower() == 'adam':
-    optimizer = optim.Adam(params, lr=opt.lr, betas=(0.9, 0.999), eps=1e-8, weight_decay=0)  # (beta1, beta2)
+    optimizer = optim.Adam(dense_params, lr=opt.lr, betas=(0.9, 0.999), eps=1e-8, weight_decay=0)  # (beta1, beta2)
 elif opt.optim.lower() == 'adadelta':
-    optimizer = optim.Adadelta(params, rho=0.95, lr=1.0)
+    optimizer = optim.Adadelta(dense_params, rho=0.95, lr=1.0)
 elif opt.optim.lower() == 'rmsprop':
-    optimizer = optim.RMSprop(params, lr=opt.lr)
-
-
-def decode(sen_feats, data_feats, data_tags, data_class, output_path):
-    data_index = np.arange(len(data_feats))
-    losses = []
-    TP, FP, FN, TN = 0.0, 0.0, 0.0, 0.0
-    TP2, FP2, FN2, TN2 = 0.0, 0.0, 0.0, 0.0
-    with open(output_path, 'w') as f:
-        for j in range(0, len(data_index), opt.test_batchSize):
-            if opt.testing:
-                inputs, tags, raw_tags, classes, raw_classes, lens, line_nums = data_reader.get_minibatch_with_class(
-                    data_feats, data_tags, data_class, word_to_idx, tag_to_idx, class_to_idx, data_index, j,
-                    opt.test_batchSize, add_start_end=opt.bos_eos, multiClass=opt.multiClass, keep_order=opt.testing,
-                    enc_dec_focus=opt.enc_dec, device=opt.device)
-                input_sens = data_reader.get_sen_minibatch(sen_feats, train_data_index, j, opt.batchSize, device=opt.device)
-            else:
-                inputs, tags, raw_tags, classes, raw_classes, lens = data_reader.get_minibatch_with_class(data_feats,
-                                                                                                          data_tags,
-                                                                                                          data_class,
-                                                                                                          word_to_idx,
-                                                                                                          tag_to_idx,
-                                                                                                          class_to_idx,
-                                                                                                          data_index, j,
-                                                                                                          opt.test_batchSize,
-                                                                                                          add_start_end=opt.bos_eos,
-                                                                                                          multiClass=opt.multiClass,
-                                                                                                          keep_order=opt.testing,
-                                                                                                          enc_dec_focus=opt.enc_dec,
-                                                                                                          device=opt.device)
-                input_sens = data_reader.get_sen_minibatch(sen_feats, data_index, j, opt.batchSize, device=opt.device)
-
-            if opt.word_digit_features:
-                word_seqs = [[idx_to_word[w_idx] for w_idx in word_seq] for word_seq in inputs.data.cpu().numpy()]
-                ext_features = feature_extractor.get_digit_features(word_seqs, lens)
-
-            if opt.enc_dec:
-                opt.greed_decoding = True
-                if opt.greed_decoding:
-                    if opt.word_digit_features:
-                        tag_scores_1best, outputs_1best, encoder_info = model_tag.decode_greed(inputs, tags[:, 0:1],
-                                                                                               lens,
-                                                                                               with_snt_classifier=True,
-                                                                                               extFeats=ext_features)
-                    else:
-                        tag_scores_1best, outputs_1best, encoder_info = model_tag.decode_greed(inputs, tags[:, 0:1],
-                                                                                               lens,
-                                                                                               with_snt_classifier=True)
-                    tag_loss = tag_loss_function(tag_scores_1best.contiguous().view(-1, len(tag_to_idx)),
-                                                 tags[:, 1:].contiguous().view(-1))
-                    top_pred_slots = outputs_1best.cpu().numpy()
-                else:
-                    beam_size = 2
-                    if opt.word_digit_features:
-                        beam_scores_1best, top_path_slots, encoder_info = model_tag.decode_beam_search(inputs, lens,
-                                                                                                       beam_size,
-                                                                                                       tag_to_idx,
-                                                                                                       with_snt_classifier=True,
-                                                                                                       extFeats=ext_features)
-                    else:
-                        beam_scores_1best, top_path_slots, encoder_info = model_tag.decode_beam_search(inputs, lens,
-                                                                                                       beam_size,
-                                                                                                       tag_to_idx,
-                                                                                                       with_snt_classifier=True)
-                    top_pred_slots = [[item[0].item() for item in seq] for seq in top_path_slots]
-                    ppl = beam_scores_1best.cpu() / torch.tensor(lens, dtype=torch.float)
-                    tag_loss = ppl.exp().sum()
-                # tags = tags[:, 1:].data.cpu().numpy()
-            elif opt.crf:
-                max_len = max(lens)
-                masks = [([1] * l) + ([0] * (max_len - l)) for l in lens]
-                masks = torch.tensor(masks, dtype=torch.uint8, device=opt.device)
-                if opt.word_digit_features:
-                    crf_feats, encoder_info = model_tag._get_lstm_features(input_sens, lens, with_snt_classifier=True,
-                                                                           extFeats=ext_features)
-                else:
-                    crf_feats, encoder_info = model_tag._get_lstm_features(input_sens, lens, with_snt_classifier=True)
-                tag_path_scores, tag_path = model_tag.forward(crf_feats, masks)
-                tag_loss = model_tag.neg_log_likelihood(crf_feats, masks, tags)
-                top_pred_slots = tag_path.data.cpu().numpy()
-            else:
-                if opt.word_digit_features:
-                    tag_scores, encoder_info = model_tag(inputs, lens, with_snt_classifier=True, extFeats=ext_features)
-                else:
-                    tag_scores, encoder_info = model_tag(inputs, lens, with_snt_classifier=True)
-                tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)), tags.view(-1))
-                top_pred_slots = tag_scores.data.cpu().numpy().argmax(axis=-1)
-                # tags = tags.data.cpu().numpy()
-            if opt.task_sc:
-                class_scores = model_class(encoder_info_filter(encoder_info))
-                class_loss = class_loss_function(class_scores, classes)
-                if opt.multiClass:
-                    snt_probs = class_scores.data.cpu().numpy()
-                else:
-                    snt_probs = class_scores.data.cpu().numpy().argmax(axis=-1)
-                losses.append([tag_loss.item() / sum(lens), class_loss.item() / len(lens)])
-            else:
-                losses.append([tag_loss.item() / sum(lens), 0])
-
-            inputs = inputs.data.cpu().numpy()
-            # classes = classes.data.cpu().numpy()
-            for idx, pred_line in enumerate(top_pred_slots):
-                length = lens[idx]
-                pred_seq = [idx_to_tag[tag] for tag in pred_line][:length]
-                lab_seq = [idx_to_tag[tag] if type(tag) == int else tag for tag in raw_tags[idx]]
-                pred_chunks = acc.get_chunks(['O'] + pred_seq + ['O'])
-                label_chunks = acc.get_chunks(['O'] + lab_seq + ['O'])
-                for pred_chunk in pred_chunks:
-                    if pred_chunk in label_chunks:
-                        TP += 1
-                    else:
-                        FP += 1
-                for label_chunk in label_chunks:
-                    if label_chunk not in pred_chunks:
-                        FN += 1
-
-                input_line = [idx_to_word[word] for word in inputs[idx]][:length]
-                word_tag_line = [input_line[_idx] + ':' + lab_seq[_idx] + ':' + pred_seq[_idx] for _idx in
-                                 range(len(input_line))]
-
-                if opt.task_sc:
-                    if opt.multiClass:
-                        pred_classes = [idx_to_class[i] for i, p in enumerate(snt_probs[idx]) if p > 0.5]
-                        gold_classes = [idx_to_class[i] for i in raw_classes[idx]]
-                        for pred_class in pred_classes:
-                            if pred_class in gold_classes:
-                                TP2 += 1
-                            else:
-                                FP2 += 1
-                        for gold_class in gold_classes:
-                            if gold_class not in pred_classes:
-                                FN2 += 1
-                        gold_class_str = ';'.join(gold_classes)
-                        pred_class_str = ';'.join(pred_classes)
-                    else:
-                        pred_class = idx_to_class[snt_probs[idx]]
-                        if type(raw_classes[idx]) == int:
-                            gold_classes = {idx_to_class[raw_classes[idx]]}
-                        else:
-                            gold_classes = set(raw_classes[idx])
-                        if pred_class in gold_classes:
-                            TP2 += 1
-                        else:
-                            FP2 += 1
-                            FN2 += 1
-                        gold_class_str = ';'.join(list(gold_classes))
-                        pred_class_str = pred_class
-                else:
-                    gold_class_str = ''
-                    pred_class_str = ''
-
-                if opt.testing:
-                    f.write(str(line_nums[idx]) + ' : ' + ' '.join(
-                        word_tag_line) + ' <=> ' + gold_class_str + ' <=> ' + pred_class_str + '\n')
-                else:
-                    f.write(' '.join(word_tag_line) + ' <=> ' + gold_class_str + ' <=> ' + pred_class_str + '\n')
-
-    if TP == 0:
-        p, r, f = 0, 0, 0
-    else:
-        p, r, f = 100 * TP / (TP + FP), 100 * TP / (TP + FN), 100 * 2 * TP / (2 * TP + FN + FP)
+    optimizer = optim.RMSprop(dense_params, lr=opt.lr)
+if sparse_params:
+    optimizer = sparse_optimizer.MultipleOptimizer(optimizer, sparse_optimizer.sparse_optimizer_for(opt.optim, sparse_params, opt.lr))
+
+
+def get_batch(data, data_index, j, batch_size):
+    '''data: (feats, tags, classes) or (feats, tags, classes, sen_feats)'''
+    data_feats, data_tags, data_class = data[:3]
+    minibatch = data_reader.get_minibatch_with_class(data_feats, data_tags, data_class, word_to_idx, tag_to_idx, class_to_idx, data_index, j, batch_size, add_start_end=opt.bos_eos, multiClass=opt.multiClass, keep_order=opt.testing, enc_dec_focus=opt.enc_dec, device=opt.device)
+    batch = dict(zip(('inputs', 'tags', 'raw_tags', 'classes', 'raw_classes', 'lens', 'line_nums'), minibatch))
+    batch['words'] = batch['inputs']
+    if len(data) == 4:
+        input_sens, _ = data_reader.get_sen_minibatch(data[3], data_index, j, batch_size, device=opt.device)
+        if opt.crf:
+            batch['inputs'] = input_sens
+    if opt.word_digit_features:
+        word_seqs = [[idx_to_word[w_idx] for w_idx in word_seq] for word_seq in batch['words'].data.cpu().numpy()]
+        batch['extFeats'] = feature_extractor.get_digit_features(word_seqs, batch['lens'])
+    return batch
 
-    if TP2 == 0:
-        cp, cr, cf = 0, 0, 0
-    else:
-        cp, cr, cf = 100 * TP2 / (TP2 + FP2), 100 * TP2 / (TP2 + FN2), 100 * 2 * TP2 / (2 * TP2 + FN2 + FP2)
+def engine_data(feats, tags, classes, sen_feats=None):
+    return (feats['data'], tags['data'], classes['data']) + ((sen_feats,) if sen_feats is not None else ())
 
-    mean_losses = np.mean(losses, axis=0)
-    return mean_losses, p, r, f, cp, cr, cf  # 0 if 2*TP2+FN2+FP2 == 0 else 100*2*TP2/(2*TP2+FN2+FP2)
+def save_model():
+    model_tag.save_model(os.path.join(exp_path, opt.save_model+'.tag'))
+    if opt.task_sc:
+        model_class.save_model(os.path.join(exp_path, opt.save_model+'.class'))
 
+model_step = train_engine.TaggerClassifierStep(model_tag, model_class if opt.task_sc else None, encoder_info_filter if opt.task_sc else None, tag_loss_function, enc_dec=opt.enc_dec, crf=opt.crf, device=opt.device)
+evaluator = train_engine.SlotIntentEvaluator(idx_to_tag, idx_to_class, multiClass=opt.multiClass, task_sc=opt.task_sc, idx_to_word=idx_to_word)
+engine = train_engine.TrainingEngine(opt, [model_tag, model_class] if opt.task_sc else [model_tag], model_step, get_batch, evaluator, logger,
+                                     optimizer=optimizer, params=params, class_loss_function=class_loss_function if opt.task_sc else None,
+                                     save_model=save_model, max_norm=opt.max_norm, prefetch_batches=opt.prefetch_batches, autocast_dtype=torch.bfloat16 if opt.bf16 else None, device=opt.device)
 
 if not opt.testing:
-    logger.info("Training starts at %s" % (time.asctime(time.localtime(time.time()))))
-    train_data_index = np.arange(len(train_feats['data']))
-    best_f1, best_result = -1, {}
-
-    # print('train_feat len: %s, train sen len: %s' % (len(train_feats['data']), len(train_sen_feats)))
-    for i in range(opt.max_epoch):
-        start_time = time.time()
-        losses = []
-        # training data shuffle
-        np.random.shuffle(train_data_index)
-        model_tag.train()
-        if opt.task_sc:
-            model_class.train()
-
-        nsentences = len(train_data_index)
-        piece_sentences = opt.batchSize if int(nsentences * 0.1 / opt.batchSize) == 0 else int(
-            nsentences * 0.1 / opt.batchSize) * opt.batchSize
-        for j in range(0, nsentences, opt.batchSize):
-            inputs, tags, raw_tags, classes, raw_classes, lens = data_reader.get_minibatch_with_class(
-                train_feats['data'], train_tags['data'], train_class['data'], word_to_idx, tag_to_idx, class_to_idx,
-                train_data_index, j, opt.batchSize, add_start_end=opt.bos_eos, multiClass=opt.multiClass,
-                enc_dec_focus=opt.enc_dec, device=opt.device)
-            if opt.read_input_sen2vec:
-                input_sens = data_reader.get_sen_minibatch(train_sen_feats, train_data_index, j, opt.batchSize, device=opt.device)
-                # print('train data len: %s, lens len: %s, sen_len: %s' % (len(inputs), len(lens), len(input_sens)))
-            if opt.word_digit_features:
-                word_seqs = [[idx_to_word[w_idx] for w_idx in word_seq] for word_seq in inputs.data.cpu().numpy()]
-                ext_features = feature_extractor.get_digit_features(word_seqs, lens)
-            optimizer.zero_grad()
-            if opt.enc_dec:
-                if opt.word_digit_features:
-                    tag_scores, encoder_info = model_tag(inputs, tags[:, :-1], lens, with_snt_classifier=True,
-                                                         extFeats=ext_features)
-                else:
-                    tag_scores, encoder_info = model_tag(inputs, tags[:, :-1], lens, with_snt_classifier=True)
-                tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)),
-                                             tags[:, 1:].contiguous().view(-1))
-            elif opt.crf:
-                max_len = max(lens)
-                masks = [([1] * l) + ([0] * (max_len - l)) for l in lens]
-                masks = torch.tensor(masks, dtype=torch.uint8, device=opt.device)
-                if opt.word_digit_features:
-                    crf_feats, encoder_info = model_tag._get_lstm_features(input_sens, lens, with_snt_classifier=True,
-                                                                           extFeats=ext_features)
-                else:
-                    crf_feats, encoder_info = model_tag._get_lstm_features(input_sens, lens, with_snt_classifier=True)
-                tag_loss = model_tag.neg_log_likelihood(crf_feats, masks, tags)
-            else:
-                if opt.word_digit_features:
-                    tag_scores, encoder_info = model_tag(inputs, lens, with_snt_classifier=True, extFeats=ext_features)
-                else:
-                    tag_scores, encoder_info = model_tag(inputs, lens, with_snt_classifier=True)
-                tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)), tags.view(-1))
-            if opt.task_sc:
-                class_scores = model_class(encoder_info_filter(encoder_info))
-                class_loss = class_loss_function(class_scores, classes)
-                losses.append([tag_loss.item() / sum(lens), class_loss.item() / len(lens)])
-                total_loss = opt.st_weight * tag_loss + (1 - opt.st_weight) * class_loss
-            else:
-                losses.append([tag_loss.item() / sum(lens), 0])
-                total_loss = tag_loss
-            total_loss.backward()
-
-            # Clips gradient norm of an iterable of parameters.
-            if opt.max_norm > 0:
-                torch.nn.utils.clip_grad_norm_(params, opt.max_norm)
-
-            optimizer.step()
-
-            if j % piece_sentences == 0:
-                print('[learning] epoch %i >> %2.2f%%' % (i, (j + opt.batchSize) * 100. / nsentences),
-                      'completed in %.2f (sec) <<\r' % (time.time() - start_time), end='')
-                sys.stdout.flush()
-        print('')
-
-        mean_loss = np.mean(losses, axis=0)
-        logger.info('Training:\tEpoch : %d\tTime : %.4fs\tLoss of tag : %.2f\tLoss of class : %.2f ' % (
-        i, time.time() - start_time, mean_loss[0], mean_loss[1]))
-        gc.collect()
-
-        model_tag.eval()
-        if opt.task_sc:
-            model_class.eval()
-        # Evaluation
-        start_time = time.time()
-        loss_val, p_val, r_val, f_val, cp_val, cr_val, cf_val = decode(valid_sen_feats, valid_feats['data'], valid_tags['data'],
-                                                                       valid_class['data'],
-                                                                       os.path.join(exp_path, 'valid.iter' + str(i)))
-        logger.info(
-            'Validation:\tEpoch : %d\tTime : %.4fs\tLoss : (%.2f, %.2f)\tP: %.2f, R: %.2f, Fscore : %.2f\tcls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f ' % (
-            i, time.time() - start_time, loss_val[0], loss_val[1], p_val, r_val, f_val, cp_val, cr_val, cf_val))
-        start_time = time.time()
-        loss_te, p_te, r_te, f_te, cp_te, cr_te, cf_te = decode(test_sen_feats, test_feats['data'], test_tags['data'],
-                                                                test_class['data'],
-                                                                os.path.join(exp_path, 'test.iter' + str(i)))
-        logger.info(
-            'Evaluation:\tEpoch : %d\tTime : %.4fs\tLoss : (%.2f, %.2f)\tP: %.2f, R: %.2f, Fscore : %.2f\tcls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f ' % (
-            i, time.time() - start_time, loss_te[0], loss_te[1], p_te, r_te, f_te, cp_te, cr_te, cf_te))
-
-        if opt.task_sc:
-            val_f1_score = (opt.st_weight * f_val + (1 - opt.st_weight) * cf_val)
-        else:
-            val_f1_score = f_val
-        if best_f1 < val_f1_score:
-            model_tag.save_model(os.path.join(exp_path, opt.save_model + '.tag'))
-            if opt.task_sc:
-                model_class.save_model(os.path.join(exp_path, opt.save_model + '.class'))
-            best_f1 = val_f1_score
-            logger.info(
-                'NEW BEST:\tEpoch : %d\tbest valid P: %.2f, R: %.2f, F1 : %.2f, cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f;\ttest P: %.2f, R: %.2f, F1 : %.2f, cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f' % (
-                i, p_val, r_val, f_val, cp_val, cr_val, cf_val, p_te, r_te, f_te, cp_te, cr_te, cf_te))
-            best_result['iter'] = i
-            best_result['vp'], best_result['vr'], best_result['vf1'], best_result['vcp'], best_result['vcr'], \
-            best_result['vcf1'], best_result['vce'] = p_val, r_val, f_val, cp_val, cr_val, cf_val, loss_val
-            best_result['tp'], best_result['tr'], best_result['tf1'], best_result['tcp'], best_result['tcr'], \
-            best_result['tcf1'], best_result['tce'] = p_te, r_te, f_te, cp_te, cr_te, cf_te, loss_te
-
-    # logger.info(
-    #     'BEST RESULT: \tEpoch : %d\tbest valid P: %.2f, R: %.2f, F1 : %.2f; cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f)' % (
-    #     best_result['iter'], best_result['vp'], best_result['vr'], best_result['vf1'], best_result['vcp'],
-    #     best_result['vcr'], best_result['vcf1']))
-
-    logger.info(
-        'BEST RESULT: \tEpoch : %d\tbest valid P: %.2f, R: %.2f, F1 : %.2f; cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f)\tbest test P: %.2f, R: %.2f, F1 : %.2f; cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f) ' % (
-        best_result['iter'], best_result['vp'], best_result['vr'], best_result['vf1'], best_result['vcp'],
-        best_result['vcr'], best_result['vcf1'], best_result['tp'], best_result['tr'], best_result['tf1'],
-        best_result['tcp'], best_result['tcr'], best_result['tcf1']))
+    if opt.length_bucketing:
+        engine.shuffle = lambda train_data_index: data_reader.get_length_bucketed_index([len(seq) for seq in train_feats['data']], opt.batchSize)
+    with_sens = opt.read_input_sen2vec is not None
+    engine.fit(engine_data(train_feats, train_tags, train_class, train_sen_feats if with_sens else None),
+               engine_data(valid_feats, valid_tags, valid_class, valid_sen_feats if with_sens else None),
+               engine_data(test_feats, test_tags, test_class, test_sen_feats if with_sens else None), exp_path)
 else:
-    logger.info("Testing starts at %s" % (time.asctime(time.localtime(time.time()))))
-    model_tag.eval()
-    if opt.task_sc:
-        model_class.eval()
-    start_time = time.time()
-    loss_val, p_val, r_val, f_val, cp_val, cr_val, cf_val = decode(valid_sen_feats, valid_feats['data'], valid_tags['data'],
-                                                                   valid_class['data'],
-                                                                   os.path.join(exp_path, 'valid.eval'))
-    logger.info(
-        'Validation:\tTime : %.4fs\tLoss : (%.2f, %.2f)\tP: %.2f, R: %.2f, Fscore : %.2f\tcls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f ' % (
-        time.time() - start_time, loss_val[0], loss_val[1], p_val, r_val, f_val, cp_val, cr_val, cf_val))
-    start_time = time.time()
-    loss_te, p_te, r_te, f_te, cp_te, cr_te, cf_te = decode(test_sen_feats, test_feats['data'], test_tags['data'], test_class['data'],
-                                                            os.path.join(exp_path, 'test.eval'))
-    logger.info(
-        'Evaluation:\tTime : %.4fs\tLoss : (%.2f, %.2f)\tP: %.2f, R: %.2f, Fscore : %.2f\tcls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f ' % (
-        time.time() - start_time, loss_te[0], loss_te[1], p_te, r_te, f_te, cp_te, cr_te, cf_te))
+    engine.test(engine_data(valid_feats, valid_tags, valid_class), engine_data(test_feats, test_tags, test_class), exp_path)
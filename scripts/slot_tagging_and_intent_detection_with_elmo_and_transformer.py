@@ -7,7 +7,6 @@ import torch.optim as optim
 import numpy as np
 import os, sys, time
 import logging
-import gc
 
 install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(install_path)
@@ -17,7 +16,7 @@ sys.path.append(install_path)
 from transformers import BertTokenizer, BertModel, XLNetTokenizer, XLNetModel 
 from transformers.optimization import AdamW, WarmupLinearSchedule
 from models.optimization import BertAdam
-from utils.bert_xlnet_inputs import prepare_inputs_for_bert_xlnet
+from utils.bert_xlnet_inputs import prepare_inputs_for_bert_xlnet, word_piece_lengths
 
 from allennlp.modules.elmo import Elmo, batch_to_ids
 
@@ -30,7 +29,7 @@ import utils.vocab_reader as vocab_reader
 import utils.data_reader_for_elmo as data_reader
 import utils.read_wordEmb as read_wordEmb
 import utils.util as util
-import utils.acc as acc
+import utils.train_engine as train_engine
 
 MODEL_CLASSES = {
         'bert': (BertModel, BertTokenizer),
@@ -82,6 +81,10 @@ parser.add_argument('--max_epoch', type=int, default=50, help='max number of epo
 parser.add_argument('--experiment', default='exp', help='Where to store samples and models')
 parser.add_argument('--optim', default='bertadam', help='choose an optimizer')
 parser.add_argument('--warmup_proportion', type=float, default=0.1, help='Proportion of training to perform linear learning rate warmup for. E.g., 0.1 = 10%% of training.')
+parser.add_argument('--prefetch_batches', type=int, default=2, help='number of minibatches built ahead in a background thread, 0: no prefetching')
+parser.add_argument('--grad_accum_steps', type=int, default=1, help='number of batches whose gradients are summed before each optimizer step, i.e. an effective batch size of batchSize * grad_accum_steps')
+parser.add_argument('--max_batch_tokens', type=int, default=0, help='run each training batch as micro-batches of at most this many (padded) word-pieces to bound the memory, 0: no limit')
+parser.add_argument('--bf16', action='store_true', help='run the forward passes of training and decoding under bfloat16 autocast (CRF and softmax layers stay in float32)')
 
 opt = parser.parse_args()
 
@@ -256,264 +259,84 @@ if opt.task_sc:
     else:
         class_loss_function = nn.NLLLoss(size_average=False)
 
-# optimizer
-if opt.optim.lower() == 'bertadam':
-    named_params = []
-    named_params += list(model_tag.named_parameters())
-    if opt.task_sc:
-        named_params += list(model_class.named_parameters())
-    named_params = list(filter(lambda p: p[1].requires_grad, named_params))
-    no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
-    optimizer_grouped_parameters = [
-        {'params': [p for n, p in named_params if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
-        {'params': [p for n, p in named_params if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
-        ]
-    num_train_optimization_steps = len(train_feats['data']) // opt.batchSize * opt.max_epoch
-    optimizer = BertAdam(optimizer_grouped_parameters, lr=opt.lr, warmup=opt.warmup_proportion, t_total=num_train_optimization_steps)
-elif opt.optim.lower() == 'adamw':
-    params = []
-    params += list(model_tag.parameters())
-    if opt.task_sc:
-        params += list(model_class.parameters())
-    params = list(filter(lambda p: p.requires_grad, params))
-    named_params = []
-    named_params += list(model_tag.named_parameters())
-    if opt.task_sc:
-        named_params += list(model_class.named_parameters())
-    named_params = list(filter(lambda p: p[1].requires_grad, named_params))
-    no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
-    optimizer_grouped_parameters = [
-        {'params': [p for n, p in named_params if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
-        {'params': [p for n, p in named_params if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
-        ]
-    num_train_optimization_steps = len(train_feats['data']) // opt.batchSize * opt.max_epoch
-    optimizer = AdamW(optimizer_grouped_parameters, lr=opt.lr, correct_bias=False)  # To reproduce BertAdam specific behavior set correct_bias=False
-    scheduler = WarmupLinearSchedule(optimizer, warmup_steps=int(opt.warmup_proportion * num_train_optimization_steps), t_total=num_train_optimization_steps)  # PyTorch scheduler
-
-# prepare_inputs_for_bert(sentences, word_lengths)
-
-def decode(data_feats, data_tags, data_class, output_path):
-    data_index = np.arange(len(data_feats))
-    losses = []
-    TP, FP, FN, TN = 0.0, 0.0, 0.0, 0.0
-    TP2, FP2, FN2, TN2 = 0.0, 0.0, 0.0, 0.0
-    with open(output_path, 'w') as f:
-        for j in range(0, len(data_index), opt.test_batchSize):
-            if opt.testing:
-                words, tags, raw_tags, classes, raw_classes, lens, line_nums = data_reader.get_minibatch_with_class(data_feats, data_tags, data_class, tag_to_idx, class_to_idx, data_index, j, opt.test_batchSize, add_start_end=opt.bos_eos, multiClass=opt.multiClass, keep_order=opt.testing, enc_dec_focus=opt.enc_dec, device=opt.device)
-            else:
-                words, tags, raw_tags, classes, raw_classes, lens = data_reader.get_minibatch_with_class(data_feats, data_tags, data_class, tag_to_idx, class_to_idx, data_index, j, opt.test_batchSize, add_start_end=opt.bos_eos, multiClass=opt.multiClass, keep_order=opt.testing, enc_dec_focus=opt.enc_dec, device=opt.device)
-            inputs = {}
-            inputs['transformer'] = prepare_inputs_for_bert_xlnet(words, lens, tokenizer, 
-                    cls_token_at_end=bool(opt.pretrained_model_type in ['xlnet']),  # xlnet has a cls token at the end
-                    cls_token=tokenizer.cls_token,
-                    sep_token=tokenizer.sep_token,
-                    cls_token_segment_id=2 if opt.pretrained_model_type in ['xlnet'] else 0,
-                    pad_on_left=bool(opt.pretrained_model_type in ['xlnet']), # pad on the left for xlnet
-                    pad_token_segment_id=4 if opt.pretrained_model_type in ['xlnet'] else 0,
-                    device=opt.device)
-            inputs['elmo'] = batch_to_ids(words).to(opt.device)
-
-            if opt.enc_dec:
-                opt.greed_decoding = True
-                if opt.greed_decoding:
-                    tag_scores_1best, outputs_1best, encoder_info = model_tag.decode_greed(inputs, tags[:, 0:1], lens, with_snt_classifier=True)
-                    tag_loss = tag_loss_function(tag_scores_1best.contiguous().view(-1, len(tag_to_idx)), tags[:, 1:].contiguous().view(-1))
-                    top_pred_slots = outputs_1best.cpu().numpy()
-                else:
-                    beam_size = 2
-                    beam_scores_1best, top_path_slots, encoder_info = model_tag.decode_beam_search(inputs, lens, beam_size, tag_to_idx, with_snt_classifier=True)
-                    top_pred_slots = [[item[0].item() for item in seq] for seq in top_path_slots]
-                    ppl = beam_scores_1best.cpu() / torch.tensor(lens, dtype=torch.float)
-                    tag_loss = ppl.exp().sum()
-                #tags = tags[:, 1:].data.cpu().numpy()
-            elif opt.crf:
-                max_len = max(lens)
-                masks = [([1] * l) + ([0] * (max_len - l)) for l in lens]
-                masks = torch.tensor(masks, dtype=torch.uint8, device=opt.device)
-                crf_feats, encoder_info = model_tag._get_lstm_features(inputs, lens, with_snt_classifier=True)
-                tag_path_scores, tag_path = model_tag.forward(crf_feats, masks)
-                tag_loss = model_tag.neg_log_likelihood(crf_feats, masks, tags)
-                top_pred_slots = tag_path.data.cpu().numpy()
-            else:
-                tag_scores, encoder_info = model_tag(inputs, lens, with_snt_classifier=True)
-                tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)), tags.view(-1))
-                top_pred_slots = tag_scores.data.cpu().numpy().argmax(axis=-1)
-                #tags = tags.data.cpu().numpy()
-            if opt.task_sc:
-                class_scores = model_class(encoder_info_filter(encoder_info))
-                class_loss = class_loss_function(class_scores, classes)
-                if opt.multiClass:
-                    snt_probs = class_scores.data.cpu().numpy()
-                else:
-                    snt_probs = class_scores.data.cpu().numpy().argmax(axis=-1)
-                losses.append([tag_loss.item()/sum(lens), class_loss.item()/len(lens)])
-            else:
-                losses.append([tag_loss.item()/sum(lens), 0])
-
-            #classes = classes.data.cpu().numpy()
-            for idx, pred_line in enumerate(top_pred_slots):
-                length = lens[idx]
-                pred_seq = [idx_to_tag[tag] for tag in pred_line][:length]
-                lab_seq = [idx_to_tag[tag] if type(tag) == int else tag for tag in raw_tags[idx]]
-                pred_chunks = acc.get_chunks(['O']+pred_seq+['O'])
-                label_chunks = acc.get_chunks(['O']+lab_seq+['O'])
-                for pred_chunk in pred_chunks:
-                    if pred_chunk in label_chunks:
-                        TP += 1
-                    else:
-                        FP += 1
-                for label_chunk in label_chunks:
-                    if label_chunk not in pred_chunks:
-                        FN += 1
-
-                input_line = words[idx]
-                word_tag_line = [input_line[_idx]+':'+lab_seq[_idx]+':'+pred_seq[_idx] for _idx in range(len(input_line))]
-                
-                if opt.task_sc:
-                    if opt.multiClass:
-                        pred_classes = [idx_to_class[i] for i,p in enumerate(snt_probs[idx]) if p > 0.5]
-                        gold_classes = [idx_to_class[i] for i in raw_classes[idx]]
-                        for pred_class in pred_classes:
-                            if pred_class in gold_classes:
-                                TP2 += 1
-                            else:
-                                FP2 += 1
-                        for gold_class in gold_classes:
-                            if gold_class not in pred_classes:
-                                FN2 += 1
-                        gold_class_str = ';'.join(gold_classes)
-                        pred_class_str = ';'.join(pred_classes)
-                    else:
-                        pred_class = idx_to_class[snt_probs[idx]]
-                        if type(raw_classes[idx]) == int:
-                            gold_classes = {idx_to_class[raw_classes[idx]]}
-                        else:
-                            gold_classes = set(raw_classes[idx])
-                        if pred_class in gold_classes:
-                            TP2 += 1
-                        else:
-                            FP2 += 1
-                            FN2 += 1
-                        gold_class_str = ';'.join(list(gold_classes))
-                        pred_class_str = pred_class
-                else:
-                    gold_class_str = ''
-                    pred_class_str = ''
-
-                if opt.testing:
-                    f.write(str(line_nums[idx])+' : '+' '.join(word_tag_line)+' <=> '+gold_class_str+' <=> '+pred_class_str+'\n')
-                else:
-                    f.write(' '.join(word_tag_line)+' <=> '+gold_class_str+' <=> '+pred_class_str+'\n')
-
-    if TP == 0:
-        p, r, f = 0, 0, 0
-    else:
-        p, r, f = 100*TP/(TP+FP), 100*TP/(TP+FN), 100*2*TP/(2*TP+FN+FP)
-    
-    mean_losses = np.mean(losses, axis=0)
-    return mean_losses, p, r, f, 0 if 2*TP2+FN2+FP2 == 0 else 100*2*TP2/(2*TP2+FN2+FP2)
-
+# optimizer (training only)
+params, optimizer, scheduler = None, None, None
 if not opt.testing:
-    logger.info("Training starts at %s" % (time.asctime(time.localtime(time.time()))))
-    train_data_index = np.arange(len(train_feats['data']))
-    best_f1, best_result = -1, {}
-    for i in range(opt.max_epoch):
-        start_time = time.time()
-        losses = []
-        # training data shuffle
-        np.random.shuffle(train_data_index)
-        model_tag.train()
+    if opt.optim.lower() == 'bertadam':
+        named_params = []
+        named_params += list(model_tag.named_parameters())
         if opt.task_sc:
-            model_class.train()
-        
-        nsentences = len(train_data_index)
-        piece_sentences = opt.batchSize if int(nsentences * 0.1 / opt.batchSize) == 0 else int(nsentences * 0.1 / opt.batchSize) * opt.batchSize
-        for j in range(0, nsentences, opt.batchSize):
-            words, tags, raw_tags, classes, raw_classes, lens = data_reader.get_minibatch_with_class(train_feats['data'], train_tags['data'], train_class['data'], tag_to_idx, class_to_idx, train_data_index, j, opt.batchSize, add_start_end=opt.bos_eos, multiClass=opt.multiClass, enc_dec_focus=opt.enc_dec, device=opt.device)
-            inputs = {}
-            inputs['transformer'] = prepare_inputs_for_bert_xlnet(words, lens, tokenizer, 
-                    cls_token_at_end=bool(opt.pretrained_model_type in ['xlnet']),  # xlnet has a cls token at the end
-                    cls_token=tokenizer.cls_token,
-                    sep_token=tokenizer.sep_token,
-                    cls_token_segment_id=2 if opt.pretrained_model_type in ['xlnet'] else 0,
-                    pad_on_left=bool(opt.pretrained_model_type in ['xlnet']), # pad on the left for xlnet
-                    pad_token_segment_id=4 if opt.pretrained_model_type in ['xlnet'] else 0,
-                    device=opt.device)
-            inputs['elmo'] = batch_to_ids(words).to(opt.device)
-            optimizer.zero_grad()
-            if opt.enc_dec:
-                tag_scores, encoder_info = model_tag(inputs, tags[:, :-1], lens, with_snt_classifier=True)
-                tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)), tags[:, 1:].contiguous().view(-1))
-            elif opt.crf:
-                max_len = max(lens)
-                masks = [([1] * l) + ([0] * (max_len - l)) for l in lens]
-                masks = torch.tensor(masks, dtype=torch.uint8, device=opt.device)
-                crf_feats, encoder_info = model_tag._get_lstm_features(inputs, lens, with_snt_classifier=True)
-                tag_loss = model_tag.neg_log_likelihood(crf_feats, masks, tags)
-            else:
-                tag_scores, encoder_info = model_tag(inputs, lens, with_snt_classifier=True)
-                tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)), tags.view(-1))
-            if opt.task_sc:
-                class_scores = model_class(encoder_info_filter(encoder_info))
-                class_loss = class_loss_function(class_scores, classes)
-                losses.append([tag_loss.item()/sum(lens), class_loss.item()/len(lens)])
-                total_loss = opt.st_weight * tag_loss + (1 - opt.st_weight) * class_loss
-            else:
-                losses.append([tag_loss.item()/sum(lens), 0])
-                total_loss = tag_loss
-            total_loss.backward()
-            
-            # Clips gradient norm of an iterable of parameters.
-            if opt.optim.lower() != 'bertadam' and opt.max_norm > 0:
-                torch.nn.utils.clip_grad_norm_(params, opt.max_norm)
-            
-            if opt.optim.lower() == 'adamw':
-                scheduler.step()
-            optimizer.step()
-
-            if j % piece_sentences == 0:
-                print('[learning] epoch %i >> %2.2f%%'%(i,(j+opt.batchSize)*100./nsentences),'completed in %.2f (sec) <<\r'%(time.time()-start_time), end='')
-                sys.stdout.flush()
-        print('')
-        
-        mean_loss = np.mean(losses, axis=0)
-        logger.info('Training:\tEpoch : %d\tTime : %.4fs\tLoss of tag : %.2f\tLoss of class : %.2f ' % (i, time.time() - start_time, mean_loss[0], mean_loss[1]))
-        gc.collect()
-
-        model_tag.eval()
+            named_params += list(model_class.named_parameters())
+        named_params = list(filter(lambda p: p[1].requires_grad, named_params))
+        no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
+        optimizer_grouped_parameters = [
+            {'params': [p for n, p in named_params if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
+            {'params': [p for n, p in named_params if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
+            ]
+        num_train_optimization_steps = train_engine.optimization_steps(len(train_feats['data']), opt.batchSize, opt.grad_accum_steps, opt.max_epoch)
+        optimizer = BertAdam(optimizer_grouped_parameters, lr=opt.lr, warmup=opt.warmup_proportion, t_total=num_train_optimization_steps)
+    elif opt.optim.lower() == 'adamw':
+        params = []
+        params += list(model_tag.parameters())
         if opt.task_sc:
-            model_class.eval()
-        # Evaluation
-        start_time = time.time()
-        loss_val, p_val, r_val, f_val, cf_val = decode(valid_feats['data'], valid_tags['data'], valid_class['data'], os.path.join(exp_path, 'valid.iter'+str(i)))
-        logger.info('Validation:\tEpoch : %d\tTime : %.4fs\tLoss : (%.2f, %.2f)\tFscore : %.2f\tcls-F1 : %.2f ' % (i, time.time() - start_time, loss_val[0], loss_val[1], f_val, cf_val))
-        start_time = time.time()
-        loss_te, p_te, r_te, f_te, cf_te = decode(test_feats['data'], test_tags['data'], test_class['data'], os.path.join(exp_path, 'test.iter'+str(i)))
-        logger.info('Evaluation:\tEpoch : %d\tTime : %.4fs\tLoss : (%.2f, %.2f)\tFscore : %.2f\tcls-F1 : %.2f ' % (i, time.time() - start_time, loss_te[0], loss_te[1], f_te, cf_te))
-
+            params += list(model_class.parameters())
+        params = list(filter(lambda p: p.requires_grad, params))
+        named_params = []
+        named_params += list(model_tag.named_parameters())
         if opt.task_sc:
-            val_f1_score = (opt.st_weight * f_val + (1 - opt.st_weight) * cf_val)
-        else:
-            val_f1_score = f_val
-        if best_f1 < val_f1_score:
-            model_tag.save_model(os.path.join(exp_path, opt.save_model+'.tag'))
-            if opt.task_sc:
-                model_class.save_model(os.path.join(exp_path, opt.save_model+'.class'))
-            best_f1 = val_f1_score
-            logger.info('NEW BEST:\tEpoch : %d\tbest valid F1 : %.2f, cls-F1 : %.2f;\ttest F1 : %.2f, cls-F1 : %.2f' % (i, f_val, cf_val, f_te, cf_te))
-            best_result['iter'] = i
-            best_result['vf1'], best_result['vcf1'], best_result['vce'] = f_val, cf_val, loss_val
-            best_result['tf1'], best_result['tcf1'], best_result['tce'] = f_te, cf_te, loss_te
-    logger.info('BEST RESULT: \tEpoch : %d\tbest valid (Loss: (%.2f, %.2f) F1 : %.2f cls-F1 : %.2f)\tbest test (Loss: (%.2f, %.2f) F1 : %.2f cls-F1 : %.2f) ' % (best_result['iter'], best_result['vce'][0], best_result['vce'][1], best_result['vf1'], best_result['vcf1'], best_result['tce'][0], best_result['tce'][1], best_result['tf1'], best_result['tcf1']))
-else:    
-    logger.info("Testing starts at %s" % (time.asctime(time.localtime(time.time()))))
-    model_tag.eval()
+            named_params += list(model_class.named_parameters())
+        named_params = list(filter(lambda p: p[1].requires_grad, named_params))
+        no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
+        optimizer_grouped_parameters = [
+            {'params': [p for n, p in named_params if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
+            {'params': [p for n, p in named_params if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
+            ]
+        num_train_optimization_steps = train_engine.optimization_steps(len(train_feats['data']), opt.batchSize, opt.grad_accum_steps, opt.max_epoch)
+        optimizer = AdamW(optimizer_grouped_parameters, lr=opt.lr, correct_bias=False)  # To reproduce BertAdam specific behavior set correct_bias=False
+        scheduler = WarmupLinearSchedule(optimizer, warmup_steps=int(opt.warmup_proportion * num_train_optimization_steps), t_total=num_train_optimization_steps)  # PyTorch scheduler
+
+# prepare_inputs_for_bert(sentences, word_lengths)
+
+def get_batch(data, data_index, j, batch_size):
+    data_feats, data_tags, data_class = data
+    minibatch = data_reader.get_minibatch_with_class(data_feats, data_tags, data_class, tag_to_idx, class_to_idx, data_index, j, batch_size, add_start_end=opt.bos_eos, multiClass=opt.multiClass, keep_order=opt.testing, enc_dec_focus=opt.enc_dec, device=opt.device)
+    batch = dict(zip(('words', 'tags', 'raw_tags', 'classes', 'raw_classes', 'lens', 'line_nums'), minibatch))
+    batch['inputs'] = {}
+    batch['inputs']['transformer'] = prepare_inputs_for_bert_xlnet(batch['words'], batch['lens'], tokenizer,
+            cls_token_at_end=bool(opt.pretrained_model_type in ['xlnet']),  # xlnet has a cls token at the end
+            cls_token=tokenizer.cls_token,
+            sep_token=tokenizer.sep_token,
+            cls_token_segment_id=2 if opt.pretrained_model_type in ['xlnet'] else 0,
+            pad_on_left=bool(opt.pretrained_model_type in ['xlnet']), # pad on the left for xlnet
+            pad_token_segment_id=4 if opt.pretrained_model_type in ['xlnet'] else 0,
+            device=opt.device)
+    batch['inputs']['elmo'] = batch_to_ids(batch['words']).to(opt.device)
+    return batch
+
+def save_model():
+    model_tag.save_model(os.path.join(exp_path, opt.save_model+'.tag'))
     if opt.task_sc:
-        model_class.eval()
-    start_time = time.time()
-    loss_val, p_val, r_val, f_val, cf_val = decode(valid_feats['data'], valid_tags['data'], valid_class['data'], os.path.join(exp_path, 'valid.eval'))
-    logger.info('Validation:\tTime : %.4fs\tLoss : (%.2f, %.2f)\tFscore : %.2f\tcls-F1 : %.2f ' % (time.time() - start_time, loss_val[0], loss_val[1], f_val, cf_val))
-    start_time = time.time()
-    loss_te, p_te, r_te, f_te, cf_te = decode(test_feats['data'], test_tags['data'], test_class['data'], os.path.join(exp_path, 'test.eval'))
-    logger.info('Evaluation:\tTime : %.4fs\tLoss : (%.2f, %.2f)\tFscore : %.2f\tcls-F1 : %.2f ' % (time.time() - start_time, loss_te[0], loss_te[1], f_te, cf_te))
+        model_class.save_model(os.path.join(exp_path, opt.save_model+'.class'))
+
+# --max_batch_tokens bounds the (padded) word-pieces of the transformer inputs, not the words
+sentence_length = None
+if not opt.testing and opt.max_batch_tokens > 0:
+    train_word_piece_lengths = word_piece_lengths(train_feats['data'], tokenizer)
+    sentence_length = lambda data, i: train_word_piece_lengths[i]
+
+model_step = train_engine.TaggerClassifierStep(model_tag, model_class if opt.task_sc else None, encoder_info_filter if opt.task_sc else None, tag_loss_function, enc_dec=opt.enc_dec, crf=opt.crf, device=opt.device)
+evaluator = train_engine.SlotIntentEvaluator(idx_to_tag, idx_to_class, multiClass=opt.multiClass, task_sc=opt.task_sc)
+engine = train_engine.TrainingEngine(opt, [model_tag, model_class] if opt.task_sc else [model_tag], model_step, get_batch, evaluator, logger,
+                                     optimizer=optimizer, params=params if opt.optim.lower() != 'bertadam' else None, class_loss_function=class_loss_function if opt.task_sc else None,
+                                     save_model=save_model, scheduler=scheduler if opt.optim.lower() == 'adamw' else None,
+                                     max_norm=opt.max_norm if opt.optim.lower() != 'bertadam' else 0, prefetch_batches=opt.prefetch_batches,
+                                     accumulation_steps=opt.grad_accum_steps, max_batch_tokens=opt.max_batch_tokens,
+                                     sentence_length=sentence_length, autocast_dtype=torch.bfloat16 if opt.bf16 else None, device=opt.device)
+
+if not opt.testing:
+    engine.fit((train_feats['data'], train_tags['data'], train_class['data']),
+               (valid_feats['data'], valid_tags['data'], valid_class['data']),
+               (test_feats['data'], test_tags['data'], test_class['data']), exp_path)
+else:
+    engine.test((valid_feats['data'], valid_tags['data'], valid_class['data']),
+                (test_feats['data'], test_tags['data'], test_class['data']), exp_path)
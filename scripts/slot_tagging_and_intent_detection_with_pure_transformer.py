@@ -7,7 +7,6 @@ import torch.optim as optim
 import numpy as np
 import os, sys, time
 import logging
-import gc
 
 install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(install_path)
@@ -17,7 +16,7 @@ sys.path.append(install_path)
 from transformers import BertTokenizer, BertModel, XLNetTokenizer, XLNetModel 
 from transformers.optimization import AdamW, WarmupLinearSchedule
 from models.optimization import BertAdam
-from utils.bert_xlnet_inputs import prepare_inputs_for_bert_xlnet
+from utils.bert_xlnet_inputs import prepare_inputs_for_bert_xlnet, word_piece_lengths
 
 import models.slot_tagger_and_intent_detector_with_pure_transformer as joint_transformer
 
@@ -25,7 +24,8 @@ import utils.vocab_reader as vocab_reader
 import utils.data_reader_for_elmo as data_reader
 import utils.read_wordEmb as read_wordEmb
 import utils.util as util
-import utils.acc as acc
+import utils.train_engine as train_engine
+import utils.quantization as quantization
 
 MODEL_CLASSES = {
         'bert': (BertModel, BertTokenizer),
@@ -51,6 +51,7 @@ parser.add_argument('--testing', action='store_true', help='Only test your model
 parser.add_argument('--read_model', required=False, help='Online test: read model from this file')
 parser.add_argument('--read_vocab', required=False, help='Online test: read input vocab from this file')
 parser.add_argument('--out_path', required=False, help='Online test: out_path')
+parser.add_argument('--quantize_int8', action='store_true', help='Online test: dynamic int8 quantization of the Linear layers of the transformer and of the heads (CPU only); the quantized model is exported to out_path/<save_model>.int8, and can be read by --read_model')
 
 parser.add_argument('--pretrained_model_type', required=True, help='bert, xlnet')
 parser.add_argument('--pretrained_model_name', required=True, help='bert-base-uncased, bert-base-cased, bert-large-uncased, bert-large-cased, bert-base-multilingual-cased, bert-base-chinese; xlnet-base-cased, xlnet-large-cased')
@@ -69,10 +70,15 @@ parser.add_argument('--max_epoch', type=int, default=50, help='max number of epo
 parser.add_argument('--experiment', default='exp', help='Where to store samples and models')
 parser.add_argument('--optim', default='bertadam', help='choose an optimizer')
 parser.add_argument('--warmup_proportion', type=float, default=0.1, help='Proportion of training to perform linear learning rate warmup for. E.g., 0.1 = 10%% of training.')
+parser.add_argument('--prefetch_batches', type=int, default=2, help='number of minibatches built ahead in a background thread, 0: no prefetching')
+parser.add_argument('--grad_accum_steps', type=int, default=1, help='number of batches whose gradients are summed before each optimizer step, i.e. an effective batch size of batchSize * grad_accum_steps')
+parser.add_argument('--max_batch_tokens', type=int, default=0, help='run each training batch as micro-batches of at most this many (padded) word-pieces to bound the memory, 0: no limit')
+parser.add_argument('--bf16', action='store_true', help='run the forward passes of training and decoding under bfloat16 autocast (CRF and softmax layers stay in float32)')
 
 opt = parser.parse_args()
 
 assert opt.testing == bool(opt.out_path) == bool(opt.read_model) ==  bool(opt.read_vocab)
+assert not opt.quantize_int8 or (opt.testing and opt.deviceId < 0 and not opt.bf16)
 
 if opt.test_batchSize == 0:
     opt.test_batchSize = opt.batchSize
@@ -193,7 +199,11 @@ model_tag_and_class = model_tag_and_class.to(opt.device)
 
 # read pretrained model
 if opt.read_model:
-    model_tag_and_class.load_model(opt.read_model)
+    # int8 model files (exported by --quantize_int8) are detected when loading
+    model_tag_and_class = quantization.load_model(model_tag_and_class, opt.read_model, quantize=opt.quantize_int8)
+    if opt.quantize_int8:
+        model_tag_and_class.save_model(os.path.join(exp_path, opt.save_model+'.int8'))
+        logger.info("int8 model is exported to %s" % (os.path.join(exp_path, opt.save_model+'.int8')))
 else:
     assert not opt.testing
     #custom init (needed maybe) ...
@@ -209,231 +219,91 @@ if opt.task_sc:
     else:
         class_loss_function = nn.NLLLoss(size_average=False)
 
-# optimizer
-if opt.optim.lower() == 'sgd':
-    params = list(filter(lambda p: p.requires_grad, model_tag_and_class.parameters()))
-    optimizer = optim.SGD(params, lr=opt.lr)
-elif opt.optim.lower() == 'adam':
-    params = list(filter(lambda p: p.requires_grad, model_tag_and_class.parameters()))
-    optimizer = optim.Adam(params, lr=opt.lr, betas=(0.9, 0.999), eps=1e-8, weight_decay=0) # (beta1, beta2)
-elif opt.optim.lower() == 'bertadam':
-    named_params = list(model_tag_and_class.named_parameters())
-    named_params = list(filter(lambda p: p[1].requires_grad, named_params))
-    no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
-    optimizer_grouped_parameters = [
-        {'params': [p for n, p in named_params if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
-        {'params': [p for n, p in named_params if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
-        ]
-    num_train_optimization_steps = len(train_feats['data']) // opt.batchSize * opt.max_epoch
-    optimizer = BertAdam(optimizer_grouped_parameters, lr=opt.lr, warmup=opt.warmup_proportion, t_total=num_train_optimization_steps)
-elif opt.optim.lower() == 'adamw':
-    params = list(filter(lambda p: p.requires_grad, model_tag_and_class.parameters()))
-    named_params = list(model_tag_and_class.named_parameters())
-    named_params = list(filter(lambda p: p[1].requires_grad, named_params))
-    no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
-    optimizer_grouped_parameters = [
-        {'params': [p for n, p in named_params if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
-        {'params': [p for n, p in named_params if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
-        ]
-    num_train_optimization_steps = len(train_feats['data']) // opt.batchSize * opt.max_epoch
-    optimizer = AdamW(optimizer_grouped_parameters, lr=opt.lr, correct_bias=False)  # To reproduce BertAdam specific behavior set correct_bias=False
-    scheduler = WarmupLinearSchedule(optimizer, warmup_steps=int(opt.warmup_proportion * num_train_optimization_steps), t_total=num_train_optimization_steps)  # PyTorch scheduler
+# optimizer (training only)
+params, optimizer, scheduler = None, None, None
+if not opt.testing:
+    if opt.optim.lower() == 'sgd':
+        params = list(filter(lambda p: p.requires_grad, model_tag_and_class.parameters()))
+        optimizer = optim.SGD(params, lr=opt.lr)
+    elif opt.optim.lower() == 'adam':
+        params = list(filter(lambda p: p.requires_grad, model_tag_and_class.parameters()))
+        optimizer = optim.Adam(params, lr=opt.lr, betas=(0.9, 0.999), eps=1e-8, weight_decay=0) # (beta1, beta2)
+    elif opt.optim.lower() == 'bertadam':
+        named_params = list(model_tag_and_class.named_parameters())
+        named_params = list(filter(lambda p: p[1].requires_grad, named_params))
+        no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
+        optimizer_grouped_parameters = [
+            {'params': [p for n, p in named_params if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
+            {'params': [p for n, p in named_params if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
+            ]
+        num_train_optimization_steps = train_engine.optimization_steps(len(train_feats['data']), opt.batchSize, opt.grad_accum_steps, opt.max_epoch)
+        optimizer = BertAdam(optimizer_grouped_parameters, lr=opt.lr, warmup=opt.warmup_proportion, t_total=num_train_optimization_steps)
+    elif opt.optim.lower() == 'adamw':
+        params = list(filter(lambda p: p.requires_grad, model_tag_and_class.parameters()))
+        named_params = list(model_tag_and_class.named_parameters())
+        named_params = list(filter(lambda p: p[1].requires_grad, named_params))
+        no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
+        optimizer_grouped_parameters = [
+            {'params': [p for n, p in named_params if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
+            {'params': [p for n, p in named_params if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
+            ]
+        num_train_optimization_steps = train_engine.optimization_steps(len(train_feats['data']), opt.batchSize, opt.grad_accum_steps, opt.max_epoch)
+        optimizer = AdamW(optimizer_grouped_parameters, lr=opt.lr, correct_bias=False)  # To reproduce BertAdam specific behavior set correct_bias=False
+        scheduler = WarmupLinearSchedule(optimizer, warmup_steps=int(opt.warmup_proportion * num_train_optimization_steps), t_total=num_train_optimization_steps)  # PyTorch scheduler
 
 # prepare_inputs_for_bert(sentences, word_lengths)
 
-def decode(data_feats, data_tags, data_class, output_path):
-    data_index = np.arange(len(data_feats))
-    losses = []
-    TP, FP, FN, TN = 0.0, 0.0, 0.0, 0.0
-    TP2, FP2, FN2, TN2 = 0.0, 0.0, 0.0, 0.0
-    with open(output_path, 'w') as f:
-        for j in range(0, len(data_index), opt.test_batchSize):
-            if opt.testing:
-                words, tags, raw_tags, classes, raw_classes, lens, line_nums = data_reader.get_minibatch_with_class(data_feats, data_tags, data_class, tag_to_idx, class_to_idx, data_index, j, opt.test_batchSize, add_start_end=opt.bos_eos, multiClass=opt.multiClass, keep_order=opt.testing, enc_dec_focus=False, device=opt.device)
-            else:
-                words, tags, raw_tags, classes, raw_classes, lens = data_reader.get_minibatch_with_class(data_feats, data_tags, data_class, tag_to_idx, class_to_idx, data_index, j, opt.test_batchSize, add_start_end=opt.bos_eos, multiClass=opt.multiClass, keep_order=opt.testing, enc_dec_focus=False, device=opt.device)
-
-            inputs = prepare_inputs_for_bert_xlnet(words, lens, tokenizer, 
-                    cls_token_at_end=bool(opt.pretrained_model_type in ['xlnet']),  # xlnet has a cls token at the end
-                    cls_token=tokenizer.cls_token,
-                    sep_token=tokenizer.sep_token,
-                    cls_token_segment_id=2 if opt.pretrained_model_type in ['xlnet'] else 0,
-                    pad_on_left=bool(opt.pretrained_model_type in ['xlnet']), # pad on the left for xlnet
-                    pad_token_segment_id=4 if opt.pretrained_model_type in ['xlnet'] else 0,
-                    device=opt.device)
-
-            if opt.task_st == 'NN':
-                tag_scores, class_scores = model_tag_and_class(inputs, lens)
-                tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)), tags.view(-1))
-                top_pred_slots = tag_scores.data.cpu().numpy().argmax(axis=-1)
-            else:
-                max_len = max(lens)
-                masks = [([1] * l) + ([0] * (max_len - l)) for l in lens]
-                masks = torch.tensor(masks, dtype=torch.uint8, device=opt.device)
-                crf_feats, class_scores = model_tag_and_class(inputs, lens)
-                tag_path_scores, tag_path = model_tag_and_class.crf_viterbi_decode(crf_feats, masks)
-                tag_loss = model_tag_and_class.crf_neg_log_likelihood(crf_feats, masks, tags)
-                top_pred_slots = tag_path.data.cpu().numpy()
-            #tags = tags.data.cpu().numpy()
-            if opt.task_sc:
-                class_loss = class_loss_function(class_scores, classes)
-                if opt.multiClass:
-                    snt_probs = class_scores.data.cpu().numpy()
-                else:
-                    snt_probs = class_scores.data.cpu().numpy().argmax(axis=-1)
-                losses.append([tag_loss.item()/sum(lens), class_loss.item()/len(lens)])
-            else:
-                losses.append([tag_loss.item()/sum(lens), 0])
-
-            #classes = classes.data.cpu().numpy()
-            for idx, pred_line in enumerate(top_pred_slots):
-                length = lens[idx]
-                pred_seq = [idx_to_tag[tag] for tag in pred_line][:length]
-                lab_seq = [idx_to_tag[tag] if type(tag) == int else tag for tag in raw_tags[idx]]
-                pred_chunks = acc.get_chunks(['O']+pred_seq+['O'])
-                label_chunks = acc.get_chunks(['O']+lab_seq+['O'])
-                for pred_chunk in pred_chunks:
-                    if pred_chunk in label_chunks:
-                        TP += 1
-                    else:
-                        FP += 1
-                for label_chunk in label_chunks:
-                    if label_chunk not in pred_chunks:
-                        FN += 1
-
-                input_line = words[idx]
-                word_tag_line = [input_line[_idx]+':'+lab_seq[_idx]+':'+pred_seq[_idx] for _idx in range(len(input_line))]
-                
-                if opt.task_sc:
-                    if opt.multiClass:
-                        pred_classes = [idx_to_class[i] for i,p in enumerate(snt_probs[idx]) if p > 0.5]
-                        gold_classes = [idx_to_class[i] for i in raw_classes[idx]]
-                        for pred_class in pred_classes:
-                            if pred_class in gold_classes:
-                                TP2 += 1
-                            else:
-                                FP2 += 1
-                        for gold_class in gold_classes:
-                            if gold_class not in pred_classes:
-                                FN2 += 1
-                        gold_class_str = ';'.join(gold_classes)
-                        pred_class_str = ';'.join(pred_classes)
-                    else:
-                        pred_class = idx_to_class[snt_probs[idx]]
-                        if type(raw_classes[idx]) == int:
-                            gold_classes = {idx_to_class[raw_classes[idx]]}
-                        else:
-                            gold_classes = set(raw_classes[idx])
-                        if pred_class in gold_classes:
-                            TP2 += 1
-                        else:
-                            FP2 += 1
-                            FN2 += 1
-                        gold_class_str = ';'.join(list(gold_classes))
-                        pred_class_str = pred_class
-                else:
-                    gold_class_str = ''
-                    pred_class_str = ''
-
-                if opt.testing:
-                    f.write(str(line_nums[idx])+' : '+' '.join(word_tag_line)+' <=> '+gold_class_str+' <=> '+pred_class_str+'\n')
-                else:
-                    f.write(' '.join(word_tag_line)+' <=> '+gold_class_str+' <=> '+pred_class_str+'\n')
-
-    if TP == 0:
-        p, r, f = 0, 0, 0
+def get_batch(data, data_index, j, batch_size):
+    data_feats, data_tags, data_class = data
+    minibatch = data_reader.get_minibatch_with_class(data_feats, data_tags, data_class, tag_to_idx, class_to_idx, data_index, j, batch_size, add_start_end=opt.bos_eos, multiClass=opt.multiClass, keep_order=opt.testing, enc_dec_focus=False, device=opt.device)
+    batch = dict(zip(('words', 'tags', 'raw_tags', 'classes', 'raw_classes', 'lens', 'line_nums'), minibatch))
+    batch['inputs'] = prepare_inputs_for_bert_xlnet(batch['words'], batch['lens'], tokenizer,
+            cls_token_at_end=bool(opt.pretrained_model_type in ['xlnet']),  # xlnet has a cls token at the end
+            cls_token=tokenizer.cls_token,
+            sep_token=tokenizer.sep_token,
+            cls_token_segment_id=2 if opt.pretrained_model_type in ['xlnet'] else 0,
+            pad_on_left=bool(opt.pretrained_model_type in ['xlnet']), # pad on the left for xlnet
+            pad_token_segment_id=4 if opt.pretrained_model_type in ['xlnet'] else 0,
+            device=opt.device)
+    return batch
+
+def model_step(batch, decoding=False):
+    inputs, tags, lens = batch['inputs'], batch['tags'], batch['lens']
+    top_pred_slots = None
+    if opt.task_st == 'NN':
+        tag_scores, class_scores = model_tag_and_class(inputs, lens)
+        tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)), tags.view(-1))
+        if decoding:
+            top_pred_slots = tag_scores.data.cpu().numpy().argmax(axis=-1)
     else:
-        p, r, f = 100*TP/(TP+FP), 100*TP/(TP+FN), 100*2*TP/(2*TP+FN+FP)
-    
-    mean_losses = np.mean(losses, axis=0)
-    return mean_losses, p, r, f, 0 if 2*TP2+FN2+FP2 == 0 else 100*2*TP2/(2*TP2+FN2+FP2)
+        masks = train_engine.length_mask(lens, opt.device)
+        crf_feats, class_scores = model_tag_and_class(inputs, lens)
+        tag_loss = model_tag_and_class.crf_neg_log_likelihood(crf_feats, masks, tags)
+        if decoding:
+            tag_path_scores, tag_path = model_tag_and_class.crf_viterbi_decode(crf_feats, masks)
+            top_pred_slots = tag_path.data.cpu().numpy()
+    return tag_loss, class_scores, top_pred_slots
+
+# --max_batch_tokens bounds the (padded) word-pieces of the transformer inputs, not the words
+sentence_length = None
+if not opt.testing and opt.max_batch_tokens > 0:
+    train_word_piece_lengths = word_piece_lengths(train_feats['data'], tokenizer)
+    sentence_length = lambda data, i: train_word_piece_lengths[i]
+
+evaluator = train_engine.SlotIntentEvaluator(idx_to_tag, idx_to_class, multiClass=opt.multiClass, task_sc=opt.task_sc)
+engine = train_engine.TrainingEngine(opt, [model_tag_and_class], model_step, get_batch, evaluator, logger,
+                                     optimizer=optimizer, params=params if opt.optim.lower() != 'bertadam' else None,
+                                     class_loss_function=class_loss_function if opt.task_sc else None,
+                                     save_model=lambda: model_tag_and_class.save_model(os.path.join(exp_path, opt.save_model)),
+                                     scheduler=scheduler if opt.optim.lower() == 'adamw' else None,
+                                     max_norm=opt.max_norm if opt.optim.lower() != 'bertadam' else 0, prefetch_batches=opt.prefetch_batches,
+                                     accumulation_steps=opt.grad_accum_steps, max_batch_tokens=opt.max_batch_tokens,
+                                     sentence_length=sentence_length, autocast_dtype=torch.bfloat16 if opt.bf16 else None, device=opt.device)
 
 if not opt.testing:
-    logger.info("Training starts at %s" % (time.asctime(time.localtime(time.time()))))
-    train_data_index = np.arange(len(train_feats['data']))
-    best_f1, best_result = -1, {}
-    for i in range(opt.max_epoch):
-        start_time = time.time()
-        losses = []
-        # training data shuffle
-        np.random.shuffle(train_data_index)
-        model_tag_and_class.train()
-        
-        nsentences = len(train_data_index)
-        piece_sentences = opt.batchSize if int(nsentences * 0.1 / opt.batchSize) == 0 else int(nsentences * 0.1 / opt.batchSize) * opt.batchSize
-        for j in range(0, nsentences, opt.batchSize):
-            words, tags, raw_tags, classes, raw_classes, lens = data_reader.get_minibatch_with_class(train_feats['data'], train_tags['data'], train_class['data'], tag_to_idx, class_to_idx, train_data_index, j, opt.batchSize, add_start_end=opt.bos_eos, multiClass=opt.multiClass, enc_dec_focus=False, device=opt.device)
-            inputs = prepare_inputs_for_bert_xlnet(words, lens, tokenizer, 
-                    cls_token_at_end=bool(opt.pretrained_model_type in ['xlnet']),  # xlnet has a cls token at the end
-                    cls_token=tokenizer.cls_token,
-                    sep_token=tokenizer.sep_token,
-                    cls_token_segment_id=2 if opt.pretrained_model_type in ['xlnet'] else 0,
-                    pad_on_left=bool(opt.pretrained_model_type in ['xlnet']), # pad on the left for xlnet
-                    pad_token_segment_id=4 if opt.pretrained_model_type in ['xlnet'] else 0,
-                    device=opt.device)
-            optimizer.zero_grad()
-            if opt.task_st == 'NN':
-                tag_scores, class_scores = model_tag_and_class(inputs, lens)
-                tag_loss = tag_loss_function(tag_scores.contiguous().view(-1, len(tag_to_idx)), tags.view(-1))
-            else:
-                max_len = max(lens)
-                masks = [([1] * l) + ([0] * (max_len - l)) for l in lens]
-                masks = torch.tensor(masks, dtype=torch.uint8, device=opt.device)
-                crf_feats, class_scores = model_tag_and_class(inputs, lens)
-                tag_loss = model_tag_and_class.crf_neg_log_likelihood(crf_feats, masks, tags)
-            if opt.task_sc:
-                class_loss = class_loss_function(class_scores, classes)
-                losses.append([tag_loss.item()/sum(lens), class_loss.item()/len(lens)])
-                total_loss = opt.st_weight * tag_loss + (1 - opt.st_weight) * class_loss
-            else:
-                losses.append([tag_loss.item()/sum(lens), 0])
-                total_loss = tag_loss
-            total_loss.backward()
-            
-            # Clips gradient norm of an iterable of parameters.
-            if opt.optim.lower() != 'bertadam' and opt.max_norm > 0:
-                torch.nn.utils.clip_grad_norm_(params, opt.max_norm)
-
-            if opt.optim.lower() == 'adamw':
-                scheduler.step()
-            optimizer.step()
-
-            if j % piece_sentences == 0:
-                print('[learning] epoch %i >> %2.2f%%'%(i,(j+opt.batchSize)*100./nsentences),'completed in %.2f (sec) <<\r'%(time.time()-start_time), end='')
-                sys.stdout.flush()
-        print('')
-        
-        mean_loss = np.mean(losses, axis=0)
-        logger.info('Training:\tEpoch : %d\tTime : %.4fs\tLoss of tag : %.2f\tLoss of class : %.2f ' % (i, time.time() - start_time, mean_loss[0], mean_loss[1]))
-        gc.collect()
-
-        model_tag_and_class.eval()
-        # Evaluation
-        start_time = time.time()
-        loss_val, p_val, r_val, f_val, cf_val = decode(valid_feats['data'], valid_tags['data'], valid_class['data'], os.path.join(exp_path, 'valid.iter'+str(i)))
-        logger.info('Validation:\tEpoch : %d\tTime : %.4fs\tLoss : (%.2f, %.2f)\tFscore : %.2f\tcls-F1 : %.2f ' % (i, time.time() - start_time, loss_val[0], loss_val[1], f_val, cf_val))
-        start_time = time.time()
-        loss_te, p_te, r_te, f_te, cf_te = decode(test_feats['data'], test_tags['data'], test_class['data'], os.path.join(exp_path, 'test.iter'+str(i)))
-        logger.info('Evaluation:\tEpoch : %d\tTime : %.4fs\tLoss : (%.2f, %.2f)\tFscore : %.2f\tcls-F1 : %.2f ' % (i, time.time() - start_time, loss_te[0], loss_te[1], f_te, cf_te))
-
-        if opt.task_sc:
-            val_f1_score = (opt.st_weight * f_val + (1 - opt.st_weight) * cf_val)
-        else:
-            val_f1_score = f_val
-        if best_f1 < val_f1_score:
-            model_tag_and_class.save_model(os.path.join(exp_path, opt.save_model))
-            best_f1 = val_f1_score
-            logger.info('NEW BEST:\tEpoch : %d\tbest valid F1 : %.2f, cls-F1 : %.2f;\ttest F1 : %.2f, cls-F1 : %.2f' % (i, f_val, cf_val, f_te, cf_te))
-            best_result['iter'] = i
-            best_result['vf1'], best_result['vcf1'], best_result['vce'] = f_val, cf_val, loss_val
-            best_result['tf1'], best_result['tcf1'], best_result['tce'] = f_te, cf_te, loss_te
-    logger.info('BEST RESULT: \tEpoch : %d\tbest valid (Loss: (%.2f, %.2f) F1 : %.2f cls-F1 : %.2f)\tbest test (Loss: (%.2f, %.2f) F1 : %.2f cls-F1 : %.2f) ' % (best_result['iter'], best_result['vce'][0], best_result['vce'][1], best_result['vf1'], best_result['vcf1'], best_result['tce'][0], best_result['tce'][1], best_result['tf1'], best_result['tcf1']))
-else:    
-    logger.info("Testing starts at %s" % (time.asctime(time.localtime(time.time()))))
-    model_tag_and_class.eval()
-    start_time = time.time()
-    loss_val, p_val, r_val, f_val, cf_val = decode(valid_feats['data'], valid_tags['data'], valid_class['data'], os.path.join(exp_path, 'valid.eval'))
-    logger.info('Validation:\tTime : %.4fs\tLoss : (%.2f, %.2f)\tFscore : %.2f\tcls-F1 : %.2f ' % (time.time() - start_time, loss_val[0], loss_val[1], f_val, cf_val))
-    start_time = time.time()
-    loss_te, p_te, r_te, f_te, cf_te = decode(test_feats['data'], test_tags['data'], test_class['data'], os.path.join(exp_path, 'test.eval'))
-    logger.info('Evaluation:\tTime : %.4fs\tLoss : (%.2f, %.2f)\tFscore : %.2f\tcls-F1 : %.2f ' % (time.time() - start_time, loss_te[0], loss_te[1], f_te, cf_te))
+    engine.fit((train_feats['data'], train_tags['data'], train_class['data']),
+               (valid_feats['data'], valid_tags['data'], valid_class['data']),
+               (test_feats['data'], test_tags['data'], test_class['data']), exp_path)
+else:
+    engine.test((valid_feats['data'], valid_tags['data'], valid_class['data']),
+                (test_feats['data'], test_tags['data'], test_class['data']), exp_path)
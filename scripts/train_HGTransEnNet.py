@@ -7,8 +7,8 @@ import os, sys
 install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(install_path)
 
-from models.hyedge import neighbor_distance
-from models.hygraph import hyedge_concat
+from models.hyedge import neighbor_distance, neighbor_group, select_node_index, count_hyedge, count_node
+from models.hygraph import hyedge_concat, node_batches, Hypergraph
 from models.HGTransEnNet import HGTransEnNet as HGTransEnNet
 from models.utils.meter import trans_class_acc
 
@@ -24,6 +24,7 @@ acc: 0.9170
 
 # initialize parameters
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+batch_size = None # number of nodes of each sampled sub-hypergraph; None: full-batch training
 
 # load data
 features = None
@@ -45,22 +46,24 @@ def generate_target(en_ba_dim):
         ba_target += [i] * en_ba_dim[1, i]
     return np.array(en_target + ba_target)
 
-def H2idx(H):
-    node_len, edge_len = H.size()
-    node_indices = []
-    edge_indices = []
-    for i in range(node_len):
-        for j in range(edge_len):
-            if H[i, j]:
-                node_indices.append(i)
-                edge_indices.append(j)
-    return torch.LongTensor([node_indices, edge_indices])
+def load_H(d, en_ba_dim):
+    '''
+    incidence matrix in index form [node_idx, hyedge_idx], read from H_idx.npy (see data_processing/en_bert_feature_extract.generate_H);
+    if it is absent, H is generated from en_ba_sen_nums_metadata, no dense N x E matrix is built
+    '''
+    H_path = os.path.join(d, 'H_idx.npy')
+    if os.path.exists(H_path):
+        return torch.from_numpy(np.load(H_path)).long()
+    return neighbor_group(en_ba_dim)
 
 d = '/path/to/HG_data/restaurant'
-H_all = np.load(os.path.join(d, 'H.npy')) # H (incidence matrix)
 en_ba_dim = np.load(os.path.join(d, 'en_ba_sen_nums_metadata.npy'))
-X_1d = np.load(os.path.join(d, 'X_1d.npy')) # X (vertex feature tensor)
-n_class = H_all.shape[1]
+H_all = load_H(d, en_ba_dim) # H (incidence matrix, index form)
+X_2d = np.load(os.path.join(d, 'X_2d.npy'), mmap_mode='r') # N x max_len x 768, float16/float32 memmap
+X_1d = X_2d.reshape(X_2d.shape[0], -1) # X (vertex feature tensor), a view of X_2d
+x_in_file = None # e.g. 'X_2d_rp256.npy' reduced by data_processing/reduce_HG_features.py; None: X_1d is the input of HyConv
+X_in = X_1d if x_in_file is None else np.load(os.path.join(d, x_in_file), mmap_mode='r')
+n_class = count_hyedge(H_all)
 target = generate_target(en_ba_dim)
 print(en_ba_dim)
 
@@ -71,17 +74,29 @@ i = 9
 en_c_num = en_cum_num[i]
 ba_c_num = ba_cum_num[i]
 
-X_c = np.row_stack((X_1d[: en_c_num], X_1d[en_nums: en_nums + ba_c_num]))
-H_c = np.row_stack((H_all[: en_c_num], H_all[en_nums: en_nums + ba_c_num]))
+x_rows = np.concatenate((np.arange(en_c_num), np.arange(en_nums, en_nums + ba_c_num))) # rows of X_1d and X_in
+node_mask = torch.zeros(count_node(H_all), dtype=torch.bool)
+node_mask[: en_c_num] = True
+node_mask[en_nums: en_nums + ba_c_num] = True
+H_c = select_node_index(H_all, node_mask)
 target_c = np.concatenate((target[: en_c_num], target[en_nums: en_nums + ba_c_num]))
 
-X_c, H_c, target_c = torch.FloatTensor(X_c), torch.from_numpy(H_c), torch.from_numpy(target_c)
-ft, H, target_c = X_c.to(device), H2idx(H_c.to(device)), target_c.to(device)
+if batch_size is None:
+    X_c, target_c = torch.from_numpy(np.asarray(X_in[x_rows], dtype=np.float32)), torch.from_numpy(target_c)
+    ft, H, target_c = X_c.to(device), Hypergraph(H_c.to(device)), target_c.to(device)
+    in_ft = ft.size(1)
+else:
+    # only the features of the sampled nodes are read from X_in and moved to device
+    target_c = torch.from_numpy(target_c)
+    val_batches = [(nodes, Hypergraph(H_b.to(device))) for nodes, H_b in node_batches(H_c, batch_size, shuffle=False)]
+    in_ft = X_in.shape[1]
+
+def batch_input(nodes):
+    return torch.from_numpy(np.asarray(X_in[x_rows[nodes.numpy()]], dtype=np.float32)).to(device)
 
 # construct model
 n_class_c = i + 1
-in_ft = ft.size(1)
-model = HGTransEnNet(in_ft, n_class_c, hiddens=(8,))
+model = HGTransEnNet(in_ft, n_class_c, hiddens=(8,), sparse_conv=True)
 model = model.to(device)
 # model = HGEnTrans()
 optimizer = torch.optim.Adam(model.parameters(), lr=0.020)
@@ -90,19 +105,36 @@ optimizer = torch.optim.Adam(model.parameters(), lr=0.020)
 
 def train():
     model.train()
-    optimizer.zero_grad()
-    pred = model(ft, H)
-    loss = F.nll_loss(pred, target_c)
-    print('loss:', loss)
-    loss.backward()
-    optimizer.step()
+    if batch_size is None:
+        optimizer.zero_grad()
+        pred = model(ft, H)
+        loss = F.nll_loss(pred, target_c)
+        print('loss:', loss)
+        loss.backward()
+        optimizer.step()
+    else:
+        for nodes, H_b in node_batches(H_c, batch_size):
+            optimizer.zero_grad()
+            pred = model(batch_input(nodes), Hypergraph(H_b.to(device)))
+            loss = F.nll_loss(pred, target_c[nodes].to(device))
+            loss.backward()
+            optimizer.step()
+        print('loss:', loss)
 
 def val():
     model.eval()
-    pred = model(ft, H)
-
-    _train_acc = trans_class_acc(pred, target_c)
-    # _val_acc = trans_class_acc(pred, target, mask_val)
+    if batch_size is None:
+        pred = model(ft, H)
+
+        _train_acc = trans_class_acc(pred, target_c)
+        # _val_acc = trans_class_acc(pred, target, mask_val)
+    else:
+        TP = 0
+        with torch.no_grad():
+            for nodes, H_b in val_batches:
+                pred = model(batch_input(nodes), H_b)
+                TP += pred.max(1)[1].eq(target_c[nodes].to(device)).sum().item()
+        _train_acc = TP / target_c.size(0)
 
     return _train_acc  # , _val_acc
 
@@ -117,7 +149,15 @@ for epoch in range(1, 110):
         best_acc = train_acc
     print(f'Epoch: {epoch}, Train:{train_acc:.4f}')
 
+# cached hyperedge features for inductive inference on unseen sentences, see scripts/infer_HGTransEnNet.py
+model.eval()
+x_all = (lambda start, end: ft[start: end]) if batch_size is None else (lambda start, end: batch_input(torch.arange(start, end)))
+torch.save({'model': model.state_dict(), 'in_ch': in_ft, 'n_class': n_class_c, 'hiddens': (8,),
+            'hyedge_fts': [ft_l.cpu() for ft_l in model.hyedge_cache(x_all, H_c, chunk_size=batch_size)],
+            'H': H_c, 'x_in_path': os.path.join(d, x_in_file or 'X_2d.npy'), 'x_rows': x_rows},
+           os.path.join(d, 'HGTransEnNet.pt'))
+
 if train_acc > 0.93:
-    np.save(os.path.join(d, 'ba_sen_emb_by_HG.npy'), torch.Tensor.cpu(ft).numpy()[en_nums:])
+    np.save(os.path.join(d, 'ba_sen_emb_by_HG.npy'), np.asarray(X_1d[x_rows[en_nums:]], dtype=np.float32))
 else:
     print('acc too low!')
\ No newline at end of file
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+'''
+@Desc   : append new sentences and their embeddings to a sentence bank (sen2vec .npy + sen2vec.npy.index,
+          see utils/sen_bank.py) in place, e.g. the unseen_sentences.txt listed by
+          slot_tagging_and_intent_detection_sen_level.py once their embeddings are extracted
+'''
+
+import os, sys
+import argparse
+import numpy as np
+
+install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(install_path)
+
+import utils.sen_bank as sen_bank
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sen2vec', required=True, help='sentence embedding file (.npy) of the bank')
+    parser.add_argument('--sen_bank', required=False, help='sentences file of sen2vec, only needed to build the index at the first use')
+    parser.add_argument('--new_sentences', required=True, help='new sentences, one per line')
+    parser.add_argument('--new_sen2vec', required=True, help='embeddings of the new sentences (.npy), one row per line of new_sentences')
+    args = parser.parse_args()
+
+    with open(args.new_sentences, 'r', encoding='utf8') as f:
+        sentences = [line.strip() for line in f if line.strip() != '']
+    embeddings = np.load(args.new_sen2vec, mmap_mode='r')
+
+    bank = sen_bank.SentenceBank.open(args.sen2vec, args.sen_bank)
+    old_size = len(bank)
+    bank.append(sentences, embeddings)
+    print('%d / %d sentences are new, the bank has %d sentences' % (len(bank) - old_size, len(sentences), len(bank)))
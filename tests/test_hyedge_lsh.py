@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+'''
+@Desc   : neighbor_distance_lsh emits each (node, hyedge) incidence at most once, and is exact when every point
+          shares a bucket with every other point
+'''
+
+import os, sys
+import torch
+
+install_path = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(install_path)
+
+from models.hyedge import neighbor_distance_lsh, neighbor_distance_chunked
+
+
+def incidences(H):
+    return set(map(tuple, H.t().tolist()))
+
+
+def test_lsh_no_repeated_incidence():
+    # rows with less than k distinct candidates across the hash tables
+    for seed in range(20):
+        torch.manual_seed(seed)
+        x = torch.randn(300, 16)
+        H = neighbor_distance_lsh(x, 8, hash_bits=10, hash_tables=6, seed=seed)
+        assert len(incidences(H)) == H.size(1), 'repeated (node, hyedge) pairs with seed %d' % (seed)
+
+
+def test_lsh_agrees_with_chunked():
+    torch.manual_seed(0)
+    x = torch.randn(300, 16)
+    H_exact = neighbor_distance_chunked(x, 8, chunk_size=64)
+    # one bucket per table (hash_bits=0) covers every point; so do many 2-bucket tables
+    for hash_bits, hash_tables in ((0, 1), (1, 32)):
+        H = neighbor_distance_lsh(x, 8, hash_bits=hash_bits, hash_tables=hash_tables, chunk_size=64)
+        assert H.size(1) == H_exact.size(1) and incidences(H) == incidences(H_exact), (hash_bits, hash_tables)
+
+
+if __name__ == '__main__':
+    test_lsh_no_repeated_incidence()
+    test_lsh_agrees_with_chunked()
+    print('OK')
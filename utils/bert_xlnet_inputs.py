@@ -72,3 +72,7 @@ def prepare_inputs_for_bert_xlnet(sentences, word_lengths, tokenizer, cls_token_
     selects_tensor = torch.tensor(list(itertools.chain.from_iterable(selected_indexes)), dtype=torch.long, device=device)
     copies_tensor = torch.tensor(list(itertools.chain.from_iterable(copied_indexes)), dtype=torch.long, device=device)
     return {'tokens': tokens_tensor, 'segments': segments_tensor, 'selects': selects_tensor, 'copies': copies_tensor, 'mask': input_mask}
+
+def word_piece_lengths(sentences, tokenizer):
+    """ number of tokens of each sentence (list of words) in prepare_inputs_for_bert_xlnet: its word-pieces, [CLS] and [SEP] """
+    return [sum(len(tokenizer.tokenize(w)) for w in ws) + 2 for ws in sentences]
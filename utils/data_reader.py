@@ -132,7 +132,15 @@ def read_sen_bank(data_path):
             i += 1
     return sen2idx
 
-def read_sen_feats(data_path, sen_bank, separator=':'):
+def read_sen_feats(data_path, sen_bank, separator=':', missing=None):
+    '''
+    @params:
+        1. sen_bank: dict from read_sen_bank, or utils.sen_bank.SentenceBank
+        2. missing: if a list is given, sentences absent from the bank are appended to it and get
+            sen_idx None (see filter_missing_sens); otherwise a KeyError is raised
+    @return:
+        1. (sen_idx, sentence length) of each example
+    '''
     sen_seqs = []
     with open(data_path, 'r') as f:
         line_num = -1
@@ -149,11 +157,40 @@ def read_sen_feats(data_path, sen_bank, separator=':'):
                 word, tag = separator.join(tmp[:-1]), tmp[-1]
                 tokens.append(word)
             raw_sen = ' '.join(tokens)
-            sen_idx = sen_bank[raw_sen]
-            sen_seqs.append(sen_idx)
+            sen_idx = sen_bank.get(raw_sen)
+            if sen_idx is None:
+                if missing is None:
+                    raise KeyError('line %d of %s is not in the sentence bank: %s' % (line_num + 1, data_path, raw_sen))
+                missing.append(raw_sen)
+            sen_seqs.append((sen_idx, len(tokens)))
     return sen_seqs
 
+def filter_missing_sens(sen_feats, *labels):
+    '''
+    drop the examples whose sentence is not in the sentence bank (sen_idx None), from sen_feats
+    and the parallel {'data': [...]} dicts of read_seqtag_data_with_class
+    @return:
+        1. filtered sen_feats
+    '''
+    keep = [idx for idx, (sen_idx, _) in enumerate(sen_feats) if sen_idx is not None]
+    for label in labels:
+        label['data'] = [label['data'][idx] for idx in keep]
+    return [sen_feats[idx] for idx in keep]
+
 
 def get_sen_minibatch(input_sen_feats, train_data_indx, index, batch_size, device=None):
+    """Prepare minibatch of (sentence id, length) pairs, sorted by length like get_minibatch_with_class."""
     input_sens = [input_sen_feats[idx] for idx in train_data_indx[index:index + batch_size]]
-    return torch.tensor(input_sens, dtype=torch.long, device=device)
\ No newline at end of file
+    input_sens.sort(key=lambda x: x[1], reverse=True)
+    sen_lens = [sen_len for _, sen_len in input_sens]
+    return torch.tensor([sen_idx for sen_idx, _ in input_sens], dtype=torch.long, device=device), sen_lens
+
+
+def get_length_bucketed_index(lengths, batch_size):
+    """Shuffled data index whose consecutive batch_size chunks hold sentences of similar length."""
+    lengths = np.asarray(lengths)
+    data_index = np.random.permutation(len(lengths))
+    data_index = data_index[np.argsort(lengths[data_index], kind='stable')]
+    batches = [data_index[i:i + batch_size] for i in range(0, len(data_index), batch_size)]
+    np.random.shuffle(batches)
+    return np.concatenate(batches) if batches else data_index
\ No newline at end of file
@@ -0,0 +1,39 @@
+"""TorchScript export of a slot tagger + intent classifier (models/joint_inference.py), checked against the eager models."""
+import numpy as np
+import torch
+
+from models.joint_inference import JointSlotIntentInference
+
+def export_torchscript(model_tag, model_class, output_path):
+    '''
+    script JointSlotIntentInference(model_tag, model_class) and save it to output_path, which torch.jit.load reads
+    without the code of this repository
+    @return:
+        1. the scripted module
+    '''
+    scripted_model = torch.jit.script(JointSlotIntentInference(model_tag, model_class))
+    scripted_model.save(output_path)
+    return scripted_model
+
+def compare_with_eager(scripted_model, model_step, batches):
+    '''
+    run the exported model and model_step (train_engine.TaggerClassifierStep of the same models) on the minibatches
+    @return:
+        1. number of sentences
+        2. number of sentences whose tags differ
+        3. max absolute difference of the class scores
+    '''
+    sentence_num, tag_diff_num, class_diff = 0, 0, 0.0
+    with torch.no_grad():
+        for j, batch in batches:
+            lens = batch['lens']
+            _, class_scores, top_pred_slots = model_step(batch, decoding=True)
+            tag_ids, exported_class_scores = scripted_model(batch['inputs'], torch.tensor(lens, dtype=torch.long))
+            tag_ids = tag_ids.cpu().numpy()
+            for idx, length in enumerate(lens):
+                if not np.array_equal(np.asarray(top_pred_slots[idx][:length]), tag_ids[idx][:length]):
+                    tag_diff_num += 1
+            if class_scores is not None:
+                class_diff = max(class_diff, (class_scores.float() - exported_class_scores).abs().max().item())
+            sentence_num += len(lens)
+    return sentence_num, tag_diff_num, class_diff
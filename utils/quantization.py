@@ -0,0 +1,44 @@
+"""Dynamic int8 quantization of the LSTM and Linear layers of trained models, for inference on CPU."""
+import torch
+import torch.nn as nn
+
+try:
+    from torch.ao.quantization import quantize_dynamic as _quantize_dynamic
+except ImportError:
+    from torch.quantization import quantize_dynamic as _quantize_dynamic
+
+QUANTIZED_LAYERS = {nn.LSTM, nn.Linear}
+
+def quantize_dynamic(model):
+    '''
+    int8 weights for the nn.LSTM and nn.Linear layers of model (activations are quantized on the fly),
+    embeddings, convolutions and the CRF transitions stay in float32. Quantized layers only run on CPU.
+    @return:
+        1. quantized copy of model, in eval mode
+    '''
+    model = model.cpu().eval()
+    return _quantize_dynamic(model, QUANTIZED_LAYERS, dtype=torch.qint8)
+
+def is_quantized_state_dict(state_dict):
+    return any('_packed_params' in key or '_all_weight_values' in key for key in state_dict)
+
+def load_model(model, model_path, quantize=False):
+    '''
+    load a model file written by save_model, which may be a quantized model (detected from its keys).
+    @params:
+        1. quantize: quantize a float32 model after loading it
+    @return:
+        1. model, or its quantized copy
+    '''
+    try:
+        # the packed int8 weights are pickled as torch.ScriptObject, which weights_only loading refuses
+        state_dict = torch.load(open(model_path, 'rb'), map_location=lambda storage, loc: storage, weights_only=False)
+    except TypeError:
+        # torch < 1.13
+        state_dict = torch.load(open(model_path, 'rb'), map_location=lambda storage, loc: storage)
+    if is_quantized_state_dict(state_dict):
+        model = quantize_dynamic(model)
+    model.load_state_dict(state_dict)
+    if quantize and not is_quantized_state_dict(state_dict):
+        model = quantize_dynamic(model)
+    return model
@@ -7,20 +7,180 @@ def read_word2vec_inText(file_path, device):
         head = f.readline().strip()
         word_num, emb_dim = [int(value) for value in head.split(' ')]
         word_to_idx = {}
-        embedding = [0] * word_num
+        embedding = np.zeros((word_num, emb_dim), dtype=np.float32)
         for line in f:
             line = line.strip('\n\r')
             items = line.split(' ')
             word = items[0]
-            vector = [float(value) for value in items[1:]]
             idx = len(word_to_idx)
             word_to_idx[word] = idx
-            embedding[idx] = vector
-    embedding = torch.tensor(embedding, dtype=torch.float, device=device)
+            embedding[idx] = np.asarray(items[1:], dtype=np.float32)
+    embedding = torch.from_numpy(embedding).to(device)
     return word_to_idx, embedding
 
 
+def _bin_prefix(file_path):
+    '''binary word2vec is stored as "prefix.vocab" (one word per line) + "prefix.npy"'''
+    for suffix in ('.npy', '.vocab'):
+        if file_path.endswith(suffix):
+            return file_path[:-len(suffix)]
+    return file_path
+
+def is_word2vec_inBin(file_path):
+    return file_path.endswith('.npy') or file_path.endswith('.vocab')
+
+def convert_word2vec_inText_to_bin(text_path, bin_path, dtype='float32'):
+    '''
+    Convert a word2vec text file ("word_num emb_dim" header, then "word v1 v2 ...") to the binary format.
+    The matrix is written row by row into a .npy memmap, so the text file is never held in memory.
+    @return:
+        1. number of words
+        2. embedding dimension
+    '''
+    prefix = _bin_prefix(bin_path)
+    with open(text_path, 'r') as f:
+        head = f.readline().strip()
+        word_num, emb_dim = [int(value) for value in head.split(' ')]
+        embedding = np.lib.format.open_memmap(prefix + '.npy', mode='w+', dtype=np.dtype(dtype), shape=(word_num, emb_dim))
+        with open(prefix + '.vocab', 'w') as vocab_file:
+            idx = 0
+            for line in f:
+                items = line.strip('\n\r').split(' ')
+                embedding[idx] = np.asarray(items[1:], dtype=np.float32)
+                vocab_file.write(items[0] + '\n')
+                idx += 1
+    assert idx == word_num, 'header of %s declares %d words, but %d are found' % (text_path, word_num, idx)
+    embedding.flush()
+    del embedding
+    return word_num, emb_dim
+
+def save_word2vec_inBin(words, embedding, bin_path, dtype='float32'):
+    '''write words (list) and their embedding (len(words) x emb_dim array) in the binary format of read_word2vec_inBin'''
+    prefix = _bin_prefix(bin_path)
+    assert len(words) == len(embedding)
+    np.save(prefix + '.npy', np.asarray(embedding, dtype=np.dtype(dtype)))
+    with open(prefix + '.vocab', 'w') as vocab_file:
+        vocab_file.write(''.join(word + '\n' for word in words))
+
+def read_word2vec_inBin(file_path):
+    '''
+    Read binary word2vec. The embedding matrix is memory-mapped (float32 or float16), nothing is materialized.
+    @return:
+        1. word_to_idx: word -> row of the embedding matrix
+        2. embedding: np.memmap of size word_num x emb_dim
+    '''
+    prefix = _bin_prefix(file_path)
+    embedding = np.load(prefix + '.npy', mmap_mode='r')
+    word_to_idx = {}
+    word_num = 0
+    with open(prefix + '.vocab', 'r') as f:
+        for line in f:
+            word = line.strip('\n\r')
+            if word not in word_to_idx:
+                word_to_idx[word] = word_num
+            word_num += 1
+    assert len(embedding) == word_num, '%s.vocab has %d words, but %s.npy has %d rows' % (prefix, word_num, prefix, len(embedding))
+    return word_to_idx, embedding
+
+def read_word2vec(file_path, device):
+    if is_word2vec_inBin(file_path):
+        return read_word2vec_inBin(file_path)
+    else:
+        return read_word2vec_inText(file_path, device)
+
+def select_word2vec_rows(word_to_idx, ext_word_to_idx, ext_word_emb, device):
+    '''
+    Gather pre-trained vectors of the words in word_to_idx, only these rows are materialized.
+    @params:
+        1. word_to_idx: vocabulary of the model
+        2. ext_word_to_idx, ext_word_emb: returned by read_word2vec_inText/read_word2vec_inBin
+    @return:
+        1. idxs: LongTensor, rows of the model embedding matrix
+        2. rows: FloatTensor, len(idxs) x emb_dim
+    usage: word_embeddings.weight.data.index_copy_(0, idxs, rows)
+    '''
+    pairs = [(ext_word_to_idx[word], idx) for word, idx in word_to_idx.items() if word in ext_word_to_idx]
+    pairs.sort()  # sequential reads on the memory-mapped matrix
+    src_idxs = np.array([src for src, _ in pairs], dtype=np.int64)
+    dst_idxs = torch.tensor([dst for _, dst in pairs], dtype=torch.long, device=device)
+    if isinstance(ext_word_emb, torch.Tensor):
+        rows = ext_word_emb.index_select(0, torch.from_numpy(src_idxs).to(ext_word_emb.device))
+    else:
+        rows = torch.from_numpy(np.asarray(ext_word_emb[src_idxs]))
+    return dst_idxs, rows.to(device, dtype=torch.float)
+
+def _match_word2vec_vocab(ext_word, words, lower_to_words, exact, backoff):
+    '''return corpus words which take the vector of ext_word, and record the matching'''
+    matched = []
+    if ext_word in words and ext_word not in exact:
+        exact[ext_word] = True
+        matched.append(ext_word)
+    if lower_to_words is not None:
+        for word in lower_to_words.get(ext_word.lower(), ()):
+            if word not in exact and word not in backoff:
+                backoff[word] = True
+                matched.append(word)
+    return matched
+
+def read_word2vec_restricted(file_path, words, device, backoff_lowercase=False):
+    '''
+    Scan a (text or binary) word2vec file once and only keep the vectors of the given words.
+    @params:
+        1. words: words of the corpus, e.g. collected from train/valid/test by vocab_reader.read_word_set_from_data_files
+        2. backoff_lowercase: a word without exact match takes the vector of its first case-insensitive match
+    @return:
+        1. word_to_idx: matched word -> row of embedding (keys are words of the corpus)
+        2. embedding: FloatTensor, len(word_to_idx) x emb_dim
+        3. number of words matched by the lowercase backoff
+    '''
+    words = set(words)
+    lower_to_words = None
+    if backoff_lowercase:
+        lower_to_words = {}
+        for word in words:
+            lower_to_words.setdefault(word.lower(), []).append(word)
+    exact, backoff = {}, {}
+    word_to_idx = {}
+    if is_word2vec_inBin(file_path):
+        ext_word_to_idx, ext_word_emb = read_word2vec_inBin(file_path)
+        rows = []
+        for ext_word, ext_idx in ext_word_to_idx.items():
+            for word in _match_word2vec_vocab(ext_word, words, lower_to_words, exact, backoff):
+                if word in word_to_idx:  # an exact match takes over a backoff match
+                    rows[word_to_idx[word]] = ext_idx
+                else:
+                    word_to_idx[word] = len(rows)
+                    rows.append(ext_idx)
+        embedding = np.asarray(ext_word_emb[np.array(rows, dtype=np.int64)], dtype=np.float32)
+        embedding = embedding.reshape(len(rows), ext_word_emb.shape[1])
+    else:
+        with open(file_path, 'r') as f:
+            head = f.readline().strip()
+            word_num, emb_dim = [int(value) for value in head.split(' ')]
+            rows = []
+            for line in f:
+                ext_word, values = line.strip('\n\r').split(' ', 1)
+                matched = _match_word2vec_vocab(ext_word, words, lower_to_words, exact, backoff)
+                if not matched:
+                    continue
+                vector = np.asarray(values.split(' '), dtype=np.float32)
+                for word in matched:
+                    if word in word_to_idx:
+                        rows[word_to_idx[word]] = vector
+                    else:
+                        word_to_idx[word] = len(rows)
+                        rows.append(vector)
+        embedding = np.array(rows, dtype=np.float32).reshape(len(rows), emb_dim)
+    backoff_num = len([word for word in backoff if word not in exact])
+    embedding = torch.from_numpy(embedding).to(device)
+    return word_to_idx, embedding, backoff_num
+
+
 def read_sen2vec_inText(file_path, device):
     sen2embs = np.load(file_path)
     embedding = torch.tensor(sen2embs, dtype=torch.float, device=device)
-    return embedding
\ No newline at end of file
+    return embedding
+
+def read_sen2vec_memmap(file_path):
+    '''sentence embeddings (.npy, float16 or float32) as a read-only memmap, for LSTMTagger_CRF_sen_level(frozen_sen_embeddings=...)'''
+    return np.load(file_path, mmap_mode='r')
@@ -0,0 +1,141 @@
+"""Persistent sentence bank: content hash of a sentence -> row of the sen2vec array."""
+import os
+import hashlib
+import numpy as np
+
+def normalize_sentence(sentence):
+    return ' '.join(sentence.strip().split())
+
+def sentence_hash(sentence):
+    return hashlib.sha1(normalize_sentence(sentence).encode('utf8')).hexdigest()
+
+def _read_npy_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    return version, shape, fortran_order, dtype
+
+def append_npy_rows(npy_path, rows):
+    '''
+    Append rows to a .npy file (C order) without rewriting it: only the shape in the header is updated
+    (numpy reserves space in the header for a growing first dimension).
+    @return:
+        1. number of rows after appending
+    '''
+    with open(npy_path, 'r+b') as f:
+        version, shape, fortran_order, dtype = _read_npy_header(f)
+        data_offset = f.tell()
+        assert not fortran_order and len(shape) >= 1
+        rows = np.ascontiguousarray(np.asarray(rows, dtype=dtype).reshape((-1,) + shape[1:]))
+        new_shape = (shape[0] + len(rows),) + shape[1:]
+        preamble_len = 6 + 2 + (2 if version == (1, 0) else 4)
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.lib.format.dtype_to_descr(dtype), new_shape)
+        header_len = data_offset - preamble_len
+        if len(header) + 1 > header_len:
+            f.close()
+            # no space left in the header, rewrite the file
+            old = np.load(npy_path)
+            np.save(npy_path, np.concatenate([old, rows], axis=0))
+            return new_shape[0]
+        f.seek(preamble_len)
+        f.write((header + ' ' * (header_len - len(header) - 1) + '\n').encode('latin1'))
+        f.seek(0, 2)
+        f.write(rows.tobytes())
+    return new_shape[0]
+
+class SentenceBank(object):
+    '''
+    Content hash of each sentence -> row of the sen2vec array, stored in "sen2vec.npy.index"
+    (one "hash<TAB>row<TAB>sentence" line per sentence, append only).
+    Lookups compare the sentence itself, so hash collisions cannot return a wrong row.
+    '''
+
+    def __init__(self, sen2vec_path):
+        self.sen2vec_path = sen2vec_path
+        self.index_path = sen2vec_path + '.index'
+        self.hash2rows = {}
+        self.sentences = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf8') as f:
+                for line in f:
+                    sen_hash, row, sentence = line.rstrip('\n').split('\t', 2)
+                    self._add(sen_hash, int(row), sentence)
+
+    def _add(self, sen_hash, row, sentence):
+        self.hash2rows.setdefault(sen_hash, []).append(row)
+        self.sentences[row] = sentence
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def __contains__(self, sentence):
+        return self.get(sentence) is not None
+
+    def __getitem__(self, sentence):
+        row = self.get(sentence)
+        if row is None:
+            raise KeyError(sentence)
+        return row
+
+    def get(self, sentence, default=None):
+        sentence = normalize_sentence(sentence)
+        for row in self.hash2rows.get(sentence_hash(sentence), ()):
+            if self.sentences[row] == sentence:
+                return row
+        return default
+
+    def _write_index(self, entries):
+        with open(self.index_path, 'a', encoding='utf8') as f:
+            f.write(''.join('%s\t%d\t%s\n' % entry for entry in entries))
+        for entry in entries:
+            self._add(*entry)
+
+    @classmethod
+    def open(cls, sen2vec_path, sen_bank_path=None):
+        '''load the index next to sen2vec_path, built from the sentences file at the first use'''
+        if not os.path.exists(sen2vec_path + '.index'):
+            if sen_bank_path is None:
+                raise FileNotFoundError('%s.index does not exist, the sentences file of %s is needed to build it' % (sen2vec_path, sen2vec_path))
+            return cls.build(sen_bank_path, sen2vec_path)
+        return cls(sen2vec_path)
+
+    @classmethod
+    def build(cls, sen_bank_path, sen2vec_path):
+        '''index the sentences file of read_sen_bank (row i of sen2vec is its i-th non-empty line)'''
+        bank = cls(sen2vec_path)
+        assert len(bank) == 0, '%s already exists' % bank.index_path
+        entries = []
+        with open(sen_bank_path, 'r', encoding='utf8') as f:
+            for line in f:
+                if line.strip() == '':
+                    continue
+                sentence = normalize_sentence(line)
+                entries.append((sentence_hash(sentence), len(entries), sentence))
+        bank._write_index(entries)
+        return bank
+
+    def append(self, sentences, embeddings):
+        '''
+        add new sentences and their embeddings (one row of sen2vec per sentence) without rebuilding;
+        sentences already in the bank are skipped
+        @return:
+            1. rows of the sentences
+        '''
+        embeddings = np.asarray(embeddings)
+        assert len(embeddings) == len(sentences)
+        rows, entries, new_rows = [], [], []
+        for sentence, embedding in zip(sentences, embeddings):
+            sentence = normalize_sentence(sentence)
+            row = self.get(sentence)
+            if row is None:
+                row = len(self) + len(entries)
+                entries.append((sentence_hash(sentence), row, sentence))
+                new_rows.append(embedding)
+            rows.append(row)
+        if entries:
+            row_num = append_npy_rows(self.sen2vec_path, np.stack(new_rows))
+            assert row_num == len(self) + len(entries), 'sen2vec has %d rows, but the bank has %d sentences' % (row_num, len(self) + len(entries))
+            self._write_index(entries)
+        return rows
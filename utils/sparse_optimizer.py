@@ -0,0 +1,59 @@
+"""Optimizers for models with sparse (nn.Embedding(sparse=True)) gradients."""
+import torch
+import torch.optim as optim
+
+def split_sparse_params(params, model):
+    '''
+    Separate trainable word embeddings with sparse gradients from the other parameters.
+    @return:
+        1. dense_params
+        2. sparse_params
+    '''
+    sparse_params = []
+    if getattr(model, 'sparse_embedding', False) and hasattr(model, 'word_embeddings') and model.word_embeddings.weight.requires_grad:
+        sparse_params.append(model.word_embeddings.weight)
+    dense_params = [p for p in params if all(p is not sp for sp in sparse_params)]
+    return dense_params, sparse_params
+
+# --optim values with a sparse counterpart for the word embeddings
+SPARSE_OPTIMIZERS = ('sgd', 'adam')
+
+def sparse_optimizer_for(optim_name, sparse_params, lr):
+    '''SGD supports sparse gradients directly, Adam is replaced by SparseAdam (lazy Adam) with the same lr.'''
+    if optim_name.lower() == 'sgd':
+        return optim.SGD(sparse_params, lr=lr)
+    elif optim_name.lower() == 'adam':
+        return optim.SparseAdam(sparse_params, lr=lr, betas=(0.9, 0.999), eps=1e-8)
+    else:
+        raise ValueError('sparse word embeddings can be trained with %s, not %s' % (' or '.join(SPARSE_OPTIMIZERS), optim_name))
+
+class MultipleOptimizer(object):
+    '''Steps several optimizers together, e.g. a dense optimizer and a sparse one for word embeddings.'''
+
+    def __init__(self, *optimizers):
+        self.optimizers = [optimizer for optimizer in optimizers if optimizer is not None]
+
+    @property
+    def param_groups(self):
+        return [group for optimizer in self.optimizers for group in optimizer.param_groups]
+
+    def zero_grad(self):
+        for optimizer in self.optimizers:
+            optimizer.zero_grad()
+
+    def step(self, closure=None):
+        '''closure (re-evaluating the loss) is called once, not once per optimizer'''
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for optimizer in self.optimizers:
+            optimizer.step()
+        return loss
+
+    def state_dict(self):
+        return [optimizer.state_dict() for optimizer in self.optimizers]
+
+    def load_state_dict(self, state_dicts):
+        for optimizer, state_dict in zip(self.optimizers, state_dicts):
+            optimizer.load_state_dict(state_dict)
@@ -0,0 +1,394 @@
+"""Training engine shared by the slot tagging and intent detection scripts."""
+import os, sys, time
+import gc
+import queue
+import threading
+import contextlib
+import numpy as np
+import torch
+import utils.acc as acc
+from models.joint_slot_intent import JointSlotIntent
+
+def length_mask(lens, device=None):
+    '''batch x max(lens) bool mask of the real tokens'''
+    lens_tensor = torch.tensor(lens, dtype=torch.long, device=device)
+    return torch.arange(max(lens), device=device)[None, :] < lens_tensor[:, None]
+
+class BatchPrefetcher(object):
+    '''
+    Iterate the minibatches get_batch(data, data_index, j, batch_size) for j in range(0, len(data_index), batch_size),
+    or for the (j, batch_size) of spans, building up to `depth` batches ahead in a background thread while the model
+    runs on the current one. depth = 0 builds each batch when it is needed.
+    '''
+
+    def __init__(self, get_batch, data, data_index, batch_size, depth=0, spans=None):
+        self.get_batch = get_batch
+        self.data, self.data_index, self.batch_size = data, data_index, batch_size
+        self.depth = depth
+        self.spans = spans
+
+    def _spans(self):
+        if self.spans is not None:
+            return self.spans
+        return [(j, self.batch_size) for j in range(0, len(self.data_index), self.batch_size)]
+
+    def _produce(self, batches):
+        try:
+            for j, batch_size in self._spans():
+                batches.put((j, self.get_batch(self.data, self.data_index, j, batch_size)))
+        except BaseException as e:
+            batches.put((None, e))
+            return
+        batches.put((None, None))
+
+    def __iter__(self):
+        if self.depth <= 0:
+            for j, batch_size in self._spans():
+                yield j, self.get_batch(self.data, self.data_index, j, batch_size)
+            return
+        batches = queue.Queue(maxsize=self.depth)
+        producer = threading.Thread(target=self._produce, args=(batches,), daemon=True)
+        producer.start()
+        while True:
+            j, batch = batches.get()
+            if j is None:
+                if batch is not None:
+                    raise batch
+                break
+            yield j, batch
+        producer.join()
+
+def optimization_steps(nsentences, batch_size, accumulation_steps=1, max_epoch=1):
+    '''number of optimizer steps (t_total of the learning rate schedules) of TrainingEngine.fit'''
+    batch_num = (nsentences + batch_size - 1) // batch_size
+    return (batch_num + accumulation_steps - 1) // accumulation_steps * max_epoch
+
+def token_budget_spans(data_index, batch_size, max_tokens, lengths):
+    '''
+    Split each batch data_index[j: j + batch_size] into micro-batches of at most max_tokens padded tokens
+    (sentences sorted by length, a longer sentence is alone in its micro-batch).
+    @return:
+        1. data_index reordered by length inside each batch
+        2. (j, micro_batch_size) of the micro-batches
+        3. whether each micro-batch is the last one of its batch
+    '''
+    new_index, spans, batch_ends = [], [], []
+    for j in range(0, len(data_index), batch_size):
+        batch_index = sorted(data_index[j: j + batch_size], key=lambda i: -lengths[i])
+        start = 0
+        while start < len(batch_index):
+            max_len = max(lengths[batch_index[start]], 1)
+            size = max(max_tokens // max_len, 1)
+            size = min(size, len(batch_index) - start)
+            spans.append((j + start, size))
+            start += size
+            batch_ends.append(start == len(batch_index))
+        new_index.extend(batch_index)
+    return np.array(new_index, dtype=np.asarray(data_index).dtype), spans, batch_ends
+
+class SlotIntentEvaluator(object):
+    '''
+    Chunk-level slot F1 and intent P/R/F1, and the "word:gold_tag:pred_tag ... <=> gold_class <=> pred_class" output lines.
+    @params:
+        1. idx_to_word: if given, batch['words'] holds word indices, otherwise lists of words
+    '''
+
+    def __init__(self, idx_to_tag, idx_to_class, multiClass=False, task_sc=True, idx_to_word=None):
+        self.idx_to_tag, self.idx_to_class, self.idx_to_word = idx_to_tag, idx_to_class, idx_to_word
+        self.multiClass, self.task_sc = multiClass, task_sc
+        self.reset()
+
+    def reset(self):
+        self.TP, self.FP, self.FN = 0.0, 0.0, 0.0
+        self.TP2, self.FP2, self.FN2 = 0.0, 0.0, 0.0
+
+    def _class_strs(self, snt_prob, raw_class):
+        idx_to_class = self.idx_to_class
+        if self.multiClass:
+            pred_classes = [idx_to_class[i] for i, p in enumerate(snt_prob) if p > 0.5]
+            gold_classes = [idx_to_class[i] for i in raw_class]
+            for pred_class in pred_classes:
+                if pred_class in gold_classes:
+                    self.TP2 += 1
+                else:
+                    self.FP2 += 1
+            for gold_class in gold_classes:
+                if gold_class not in pred_classes:
+                    self.FN2 += 1
+            return ';'.join(gold_classes), ';'.join(pred_classes)
+        pred_class = idx_to_class[snt_prob]
+        if type(raw_class) == int:
+            gold_classes = {idx_to_class[raw_class]}
+        else:
+            gold_classes = set(raw_class)
+        if pred_class in gold_classes:
+            self.TP2 += 1
+        else:
+            self.FP2 += 1
+            self.FN2 += 1
+        return ';'.join(list(gold_classes)), pred_class
+
+    def add_batch(self, batch, top_pred_slots, snt_probs=None):
+        '''
+        @return:
+            1. output lines of the batch (prefixed by the line numbers when batch has 'line_nums')
+        '''
+        words, lens, raw_tags = batch['words'], batch['lens'], batch['raw_tags']
+        if self.idx_to_word is not None:
+            words = [[self.idx_to_word[w] for w in seq] for seq in words.tolist()]
+        lines = []
+        for idx, pred_line in enumerate(top_pred_slots):
+            length = lens[idx]
+            pred_seq = [self.idx_to_tag[tag] for tag in pred_line][:length]
+            lab_seq = [self.idx_to_tag[tag] if type(tag) == int else tag for tag in raw_tags[idx]]
+            pred_chunks = acc.get_chunks(['O'] + pred_seq + ['O'])
+            label_chunks = acc.get_chunks(['O'] + lab_seq + ['O'])
+            for pred_chunk in pred_chunks:
+                if pred_chunk in label_chunks:
+                    self.TP += 1
+                else:
+                    self.FP += 1
+            for label_chunk in label_chunks:
+                if label_chunk not in pred_chunks:
+                    self.FN += 1
+
+            input_line = words[idx][:length]
+            word_tag_line = [input_line[_idx] + ':' + lab_seq[_idx] + ':' + pred_seq[_idx] for _idx in range(len(input_line))]
+            if self.task_sc:
+                gold_class_str, pred_class_str = self._class_strs(snt_probs[idx], batch['raw_classes'][idx])
+            else:
+                gold_class_str, pred_class_str = '', ''
+            line = ' '.join(word_tag_line) + ' <=> ' + gold_class_str + ' <=> ' + pred_class_str
+            if 'line_nums' in batch:
+                line = str(batch['line_nums'][idx]) + ' : ' + line
+            lines.append(line)
+        return lines
+
+    def scores(self):
+        '''slot P, R, F1 and intent P, R, F1 (in %)'''
+        TP, FP, FN = self.TP, self.FP, self.FN
+        if TP == 0:
+            p, r, f = 0, 0, 0
+        else:
+            p, r, f = 100 * TP / (TP + FP), 100 * TP / (TP + FN), 100 * 2 * TP / (2 * TP + FN + FP)
+        TP2, FP2, FN2 = self.TP2, self.FP2, self.FN2
+        if TP2 == 0:
+            cp, cr, cf = 0, 0, 0
+        else:
+            cp, cr, cf = 100 * TP2 / (TP2 + FP2), 100 * TP2 / (TP2 + FN2), 100 * 2 * TP2 / (2 * TP2 + FN2 + FP2)
+        return p, r, f, cp, cr, cf
+
+class TaggerClassifierStep(object):
+    '''
+    The model_step of TrainingEngine for the model_tag + model_class scripts: models.joint_slot_intent.JointSlotIntent
+    of a slot tagger (LSTMTagger | LSTMTagger_focus | LSTMTagger_CRF | ...) and an intent classifier fed with
+    encoder_info_filter(encoder_info). The batch holds 'inputs' of model_tag, 'tags', 'lens', and optionally 'extFeats'.
+    '''
+
+    def __init__(self, model_tag, model_class, encoder_info_filter, tag_loss_function, enc_dec=False, crf=False, device=None):
+        self.model = JointSlotIntent(model_tag, model_class, encoder_info_filter, tag_loss_function, enc_dec=enc_dec, crf=crf, device=device)
+
+    def __call__(self, batch, decoding=False):
+        '''
+        @return:
+            1. tag_loss
+            2. class_scores (None without model_class)
+            3. top_pred_slots (None if not decoding)
+        '''
+        return self.model(batch['inputs'], batch['tags'], batch['lens'], extFeats=batch.get('extFeats'), decoding=decoding)
+
+class TrainingEngine(object):
+    '''
+    Epoch loop, evaluation and model selection of the slot tagging and intent detection scripts.
+    The scripts plug in:
+        1. get_batch(data, data_index, j, batch_size): input pipeline, returns a dict with at least 'lens', 'tags',
+            'raw_tags', 'classes', 'raw_classes', 'words' (and 'line_nums' in testing); data is a tuple of parallel lists
+        2. model_step(batch, decoding): model and tag loss, returns (tag_loss, class_scores, top_pred_slots), see TaggerClassifierStep
+        3. class_loss_function: applied to class_scores and batch['classes']
+        4. evaluator: SlotIntentEvaluator
+        5. save_model(): writes the best model
+    @params:
+        1. opt: batchSize, test_batchSize, max_epoch, task_sc, st_weight, multiClass of the script arguments
+        2. modules: switched between train() and eval(); frozen_modules stay in eval() while training
+        3. shuffle(train_data_index): order of the training data of each epoch, default np.random.shuffle in place
+        4. prefetch_batches: number of batches built ahead in a background thread (BatchPrefetcher)
+        5. accumulation_steps: gradients of this many batches are summed before each optimizer step
+            (the losses are sums, so this trains with batches of accumulation_steps * opt.batchSize sentences)
+        6. autocast_dtype: e.g. torch.bfloat16, forward passes run under torch.autocast; None for float32
+        7. max_batch_tokens: if > 0, each training batch is run as micro-batches of at most this many padded tokens
+            (token_budget_spans), whose gradients are summed; sentence_length(data, i) is the number of tokens of
+            sentence i, default len(data[0][i])
+    '''
+
+    def __init__(self, opt, modules, model_step, get_batch, evaluator, logger, optimizer=None, params=None,
+                 class_loss_function=None, save_model=None, scheduler=None, max_norm=0, frozen_modules=(),
+                 shuffle=None, prefetch_batches=0, accumulation_steps=1, autocast_dtype=None, max_batch_tokens=0,
+                 sentence_length=None, device=None):
+        self.opt, self.modules, self.frozen_modules = opt, modules, frozen_modules
+        self.model_step, self.get_batch, self.evaluator = model_step, get_batch, evaluator
+        self.logger = logger
+        self.optimizer, self.params, self.scheduler, self.max_norm = optimizer, params, scheduler, max_norm
+        self.class_loss_function, self.save_model = class_loss_function, save_model
+        self.shuffle = shuffle if shuffle is not None else self._shuffle
+        self.prefetch_batches, self.accumulation_steps = prefetch_batches, accumulation_steps
+        self.autocast_dtype, self.device = autocast_dtype, device
+        self.max_batch_tokens = max_batch_tokens
+        self.sentence_length = sentence_length if sentence_length is not None else (lambda data, i: len(data[0][i]))
+
+    @staticmethod
+    def _shuffle(train_data_index):
+        np.random.shuffle(train_data_index)
+        return train_data_index
+
+    def _autocast(self):
+        if self.autocast_dtype is None:
+            return contextlib.nullcontext()
+        device_type = self.device.type if self.device is not None else 'cpu'
+        return torch.autocast(device_type=device_type, dtype=self.autocast_dtype)
+
+    def _set_mode(self, training):
+        for module in self.modules:
+            module.train(training)
+        if training:
+            for module in self.frozen_modules:
+                module.eval()
+
+    def _losses(self, batch, decoding=False):
+        with self._autocast():
+            tag_loss, class_scores, top_pred_slots = self.model_step(batch, decoding)
+            if self.opt.task_sc:
+                class_loss = self.class_loss_function(class_scores, batch['classes'])
+        lens = batch['lens']
+        if self.opt.task_sc:
+            loss_record = [tag_loss.item() / sum(lens), class_loss.item() / len(lens)]
+            total_loss = self.opt.st_weight * tag_loss + (1 - self.opt.st_weight) * class_loss
+        else:
+            loss_record = [tag_loss.item() / sum(lens), 0]
+            total_loss = tag_loss
+        return total_loss, loss_record, class_scores, top_pred_slots
+
+    def _optimizer_step(self):
+        # Clips gradient norm of an iterable of parameters.
+        if self.max_norm > 0:
+            for param in self.params:
+                # the rows of a sparse gradient repeat per occurrence of a word, merge them before taking the norm
+                if param.grad is not None and param.grad.is_sparse:
+                    param.grad = param.grad.coalesce()
+            torch.nn.utils.clip_grad_norm_(self.params, self.max_norm)
+        if self.scheduler is not None:
+            self.scheduler.step()
+        self.optimizer.step()
+
+    def train_epoch(self, epoch, train_data, train_data_index):
+        '''
+        @return:
+            1. mean [tag loss per token, class loss per sentence]
+        '''
+        opt = self.opt
+        start_time = time.time()
+        losses = []
+        data_time, step_time, step_num = 0.0, 0.0, 0
+        self._set_mode(True)
+
+        nsentences = len(train_data_index)
+        batch_num = (nsentences + opt.batchSize - 1) // opt.batchSize
+        piece_sentences = opt.batchSize if int(nsentences * 0.1 / opt.batchSize) == 0 else int(nsentences * 0.1 / opt.batchSize) * opt.batchSize
+        spans, batch_ends = None, None
+        if self.max_batch_tokens > 0:
+            lengths = [self.sentence_length(train_data, i) for i in range(len(train_data[0]))]
+            train_data_index, spans, batch_ends = token_budget_spans(train_data_index, opt.batchSize, self.max_batch_tokens, lengths)
+        batch_step, zero_grad = 0, True
+        tic = time.time()
+        for step, (j, batch) in enumerate(BatchPrefetcher(self.get_batch, train_data, train_data_index, opt.batchSize, self.prefetch_batches, spans)):
+            toc = time.time()
+            if zero_grad:
+                self.optimizer.zero_grad()
+                zero_grad = False
+            total_loss, loss_record, _, _ = self._losses(batch)
+            losses.append(loss_record)
+            total_loss.backward()
+            if batch_ends is None or batch_ends[step]:
+                batch_step += 1
+                if batch_step % self.accumulation_steps == 0 or batch_step == batch_num:
+                    self._optimizer_step()
+                    zero_grad = True
+            data_time += toc - tic
+            tic = time.time()
+            step_time += tic - toc
+            step_num += 1
+
+            if j % piece_sentences == 0:
+                print('[learning] epoch %i >> %2.2f%%' % (epoch, (j + opt.batchSize) * 100. / nsentences), 'completed in %.2f (sec) <<\r' % (time.time() - start_time), end='')
+                sys.stdout.flush()
+        print('')
+
+        mean_loss = np.mean(losses, axis=0)
+        self.logger.info('Training:\tEpoch : %d\tTime : %.4fs\tLoss of tag : %.2f\tLoss of class : %.2f ' % (epoch, time.time() - start_time, mean_loss[0], mean_loss[1]))
+        self.logger.info('Throughput:\tEpoch : %d\t%.1f sentences/s\tdata wait : %.2fms/step\tcompute : %.2fms/step' % (epoch, nsentences / max(data_time + step_time, 1e-8), 1000 * data_time / max(step_num, 1), 1000 * step_time / max(step_num, 1)))
+        gc.collect()
+        return mean_loss
+
+    def decode(self, data, output_path):
+        '''
+        @return:
+            1. mean [tag loss per token, class loss per sentence]
+            2. slot P, R, F1 and intent P, R, F1 (in %)
+        '''
+        opt = self.opt
+        self._set_mode(False)
+        self.evaluator.reset()
+        data_index = np.arange(len(data[0]))
+        losses = []
+        with torch.no_grad(), open(output_path, 'w') as f:
+            for j, batch in BatchPrefetcher(self.get_batch, data, data_index, opt.test_batchSize, self.prefetch_batches):
+                _, loss_record, class_scores, top_pred_slots = self._losses(batch, decoding=True)
+                losses.append(loss_record)
+                snt_probs = None
+                if opt.task_sc:
+                    if opt.multiClass:
+                        snt_probs = class_scores.data.float().cpu().numpy()
+                    else:
+                        snt_probs = class_scores.data.float().cpu().numpy().argmax(axis=-1)
+                for line in self.evaluator.add_batch(batch, top_pred_slots, snt_probs):
+                    f.write(line + '\n')
+        return np.mean(losses, axis=0), self.evaluator.scores()
+
+    def _log_decode(self, name, data, output_path, epoch=None):
+        start_time = time.time()
+        loss, (p, r, f, cp, cr, cf) = self.decode(data, output_path)
+        epoch_str = '' if epoch is None else 'Epoch : %d\t' % epoch
+        self.logger.info('%s:\t%sTime : %.4fs\tLoss : (%.2f, %.2f)\tP: %.2f, R: %.2f, Fscore : %.2f\tcls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f ' % (name, epoch_str, time.time() - start_time, loss[0], loss[1], p, r, f, cp, cr, cf))
+        return loss, p, r, f, cp, cr, cf
+
+    def fit(self, train_data, valid_data, test_data, exp_path):
+        '''train opt.max_epoch epochs, save the model with the best valid (weighted) F1, and return its results'''
+        opt = self.opt
+        self.logger.info("Training starts at %s" % (time.asctime(time.localtime(time.time()))))
+        train_data_index = np.arange(len(train_data[0]))
+        best_f1, best_result = -1, {}
+        for i in range(opt.max_epoch):
+            train_data_index = self.shuffle(train_data_index)
+            self.train_epoch(i, train_data, train_data_index)
+
+            # Evaluation
+            loss_val, p_val, r_val, f_val, cp_val, cr_val, cf_val = self._log_decode('Validation', valid_data, os.path.join(exp_path, 'valid.iter' + str(i)), i)
+            loss_te, p_te, r_te, f_te, cp_te, cr_te, cf_te = self._log_decode('Evaluation', test_data, os.path.join(exp_path, 'test.iter' + str(i)), i)
+
+            if opt.task_sc:
+                val_f1_score = (opt.st_weight * f_val + (1 - opt.st_weight) * cf_val)
+            else:
+                val_f1_score = f_val
+            if best_f1 < val_f1_score:
+                self.save_model()
+                best_f1 = val_f1_score
+                self.logger.info('NEW BEST:\tEpoch : %d\tbest valid P: %.2f, R: %.2f, F1 : %.2f, cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f;\ttest P: %.2f, R: %.2f, F1 : %.2f, cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f' % (i, p_val, r_val, f_val, cp_val, cr_val, cf_val, p_te, r_te, f_te, cp_te, cr_te, cf_te))
+                best_result['iter'] = i
+                best_result['vp'], best_result['vr'], best_result['vf1'], best_result['vcp'], best_result['vcr'], best_result['vcf1'], best_result['vce'] = p_val, r_val, f_val, cp_val, cr_val, cf_val, loss_val
+                best_result['tp'], best_result['tr'], best_result['tf1'], best_result['tcp'], best_result['tcr'], best_result['tcf1'], best_result['tce'] = p_te, r_te, f_te, cp_te, cr_te, cf_te, loss_te
+        self.logger.info('BEST RESULT: \tEpoch : %d\tbest valid P: %.2f, R: %.2f, F1 : %.2f; cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f)\tbest test P: %.2f, R: %.2f, F1 : %.2f; cls-P: %.2f, cls-R: %.2f, cls-F1 : %.2f) ' % (best_result['iter'], best_result['vp'], best_result['vr'], best_result['vf1'], best_result['vcp'], best_result['vcr'], best_result['vcf1'], best_result['tp'], best_result['tr'], best_result['tf1'], best_result['tcp'], best_result['tcr'], best_result['tcf1']))
+        return best_result
+
+    def test(self, valid_data, test_data, exp_path):
+        self.logger.info("Testing starts at %s" % (time.asctime(time.localtime(time.time()))))
+        self._log_decode('Validation', valid_data, os.path.join(exp_path, 'valid.eval'))
+        self._log_decode('Evaluation', test_data, os.path.join(exp_path, 'test.eval'))
@@ -125,3 +125,21 @@ def read_vocab_from_data_file(data_path, vocab_config={'mini_word_freq':1, 'bos_
     print('Constructing input vocabulary from ', data_path, ' ...')
     word2idx, idx2word = construct_vocab(input_seqs, vocab_config)
     return (word2idx, idx2word)
+
+def read_word_set_from_data_files(data_paths, lowercase=False, separator=':'):
+    '''
+    Collect all words of the data files (e.g. train, valid and test), which is used to restrict pre-trained word embeddings.
+    '''
+    words = set()
+    for data_path in data_paths:
+        with open(data_path, 'r') as f:
+            for line in f:
+                slot_tag_line = line.strip('\n\r').split(' <=> ')[0]
+                if slot_tag_line == "":
+                    continue
+                for item in slot_tag_line.split(' '):
+                    word = separator.join(item.split(separator)[:-1])
+                    if lowercase:
+                        word = word.lower()
+                    words.add(word)
+    return words